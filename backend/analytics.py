@@ -0,0 +1,321 @@
+# backend/analytics.py
+"""
+Columnar snapshot of the travel data for reporting (/api/analytics/*).
+
+Reports used to aggregate the live SQLite file and competed with API
+traffic for it. Instead they run on a DuckDB snapshot of the tables, on a
+thread, and never touch SQLite. Results are up to one refresh interval
+old; every response says how old.
+
+One worker, the one holding ANALYTICS_DIR/analytics.lock, builds the
+snapshots: every ANALYTICS_REFRESH_SECONDS it streams the tables out of
+SQLite in one read transaction, ANALYTICS_BATCH_ROWS rows at a time, into
+a new DuckDB file, and publishes it by renaming it into place. Every
+worker opens the newest file read-only, so the data is read once per
+refresh and shared through the OS page cache rather than copied into
+each worker.
+
+Needs the duckdb and pyarrow packages (in requirements.txt). Without
+them (or with ANALYTICS=0) the endpoints answer 503. In sharded mode
+(shards.py) the snapshot unions every shard.
+"""
+import asyncio
+import fcntl
+import importlib.util
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import shards
+from database import DATABASE_DIR, DATABASE_PATH
+
+logger = logging.getLogger(__name__)
+
+# duckdb and pyarrow are slow to import and only the snapshot code uses
+# them, so they're imported there, on first use
+HAVE_DUCKDB = all(importlib.util.find_spec(name) for name in ("duckdb", "pyarrow"))
+
+ANALYTICS = os.getenv('ANALYTICS', '1') == '1'
+ANALYTICS_REFRESH_SECONDS = float(os.getenv('ANALYTICS_REFRESH_SECONDS', 300))
+ANALYTICS_DIR = os.path.join(DATABASE_DIR, os.getenv('ANALYTICS_DIR', 'analytics'))
+ANALYTICS_LOCK_PATH = os.path.join(ANALYTICS_DIR, 'analytics.lock')
+# Rows read from SQLite per step while building; bounds the build's memory
+ANALYTICS_BATCH_ROWS = int(os.getenv('ANALYTICS_BATCH_ROWS', 10000))
+# How often workers look for a newer snapshot file
+ANALYTICS_CHECK_SECONDS = 5
+# DuckDB threads per report; keep some cores for the API
+ANALYTICS_THREADS = int(os.getenv('ANALYTICS_THREADS', 2))
+
+# Snapshot tables and the columns copied into them. Names and emails stay out.
+SNAPSHOT_COLUMNS = {
+    "travel_agencies": {"id": "int", "name": "str"},
+    "users": {"id": "int", "travel_agency_id": "int"},
+    "itineraries": {
+        "id": "int", "tour_name": "str", "date_start": "date", "date_end": "date",
+        "user_id": "int"
+    },
+    "trips": {
+        "id": "int", "date_start": "date", "date_end": "date", "transporter": "str",
+        "mode": "str", "location_start": "str", "location_end": "str",
+        "itinerary_id": "int"
+    },
+    "lodgings": {
+        "id": "int", "date_start": "date", "date_end": "date", "name": "str",
+        "room_count": "int", "itinerary_id": "int"
+    },
+}
+# Tables only the catalog holds; shards have copies of their agency's row
+CATALOG_TABLES = ("travel_agencies",)
+
+
+class Snapshot:
+    def __init__(self, path):
+        import duckdb
+
+        self.path = path
+        # Read-only: every worker opens the same file, and the OS page cache
+        # holds one copy of it however many workers there are
+        self.connection = duckdb.connect(
+            path, read_only=True, config={"threads": ANALYTICS_THREADS}
+        )
+        built_at, build_ms, row_counts = self.connection.execute(
+            "SELECT built_at, build_ms, row_counts FROM snapshot_info"
+        ).fetchone()
+        self.built_at = built_at
+        self.build_ms = build_ms
+        self.row_counts = json.loads(row_counts)
+
+    def query(self, sql, parameters=()):
+        """Rows of ``sql`` as dicts; runs on the calling thread"""
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(sql, parameters)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def close(self):
+        self.connection.close()
+
+    def meta(self):
+        return {
+            "snapshot_at": self.built_at,
+            "snapshot_age_seconds": round(time.time() - self.built_at, 3)
+        }
+
+
+snapshot = None
+stats = {"refreshes": 0, "builds": 0, "failures": 0, "last_build_ms": None, "rows": {}}
+_refresher = None
+_lock_file = None
+_refresh_lock = asyncio.Lock()
+
+
+def available():
+    return ANALYTICS and HAVE_DUCKDB
+
+
+def unavailable_reason():
+    if not ANALYTICS:
+        return "Analytics is disabled (ANALYTICS=0)"
+    if not HAVE_DUCKDB:
+        return "Analytics needs the duckdb and pyarrow packages"
+    return "The analytics snapshot is still being built"
+
+
+def _copy_tables(path, tables, connection, counts):
+    """Append ``tables`` of the SQLite file at ``path`` to the DuckDB
+    ``connection``, ANALYTICS_BATCH_ROWS rows at a time, in one read transaction"""
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True, isolation_level=None)
+    try:
+        source.execute("BEGIN")
+        for table in tables:
+            columns = SNAPSHOT_COLUMNS[table]
+            cursor = source.execute(f"SELECT {', '.join(columns)} FROM {table}")
+            # SQLite stores dates as ISO text; DuckDB gets real DATE columns
+            select = ", ".join(
+                f"CAST({name} AS DATE)" if kind == "date" else name
+                for name, kind in columns.items()
+            )
+            while rows := cursor.fetchmany(ANALYTICS_BATCH_ROWS):
+                connection.register("arrow_rows", _arrow_table(table, rows))
+                connection.execute(f"INSERT INTO {table} SELECT {select} FROM arrow_rows")
+                connection.unregister("arrow_rows")
+                counts[table] += len(rows)
+        source.execute("COMMIT")
+    finally:
+        source.close()
+
+
+def _arrow_table(table, rows):
+    import pyarrow as pa
+
+    arrow_types = {"int": pa.int64(), "str": pa.string(), "date": pa.string()}
+    columns = SNAPSHOT_COLUMNS[table]
+    values = list(zip(*rows))
+    return pa.table({
+        name: pa.array(column, type=arrow_types[kind])
+        for (name, kind), column in zip(columns.items(), values)
+    })
+
+
+def build_snapshot():
+    """Write a new snapshot file into ANALYTICS_DIR and return its path;
+    blocking, run it on a thread"""
+    import duckdb
+
+    started = time.perf_counter()
+    built_at = time.time()
+    os.makedirs(ANALYTICS_DIR, exist_ok=True)
+    path = os.path.join(ANALYTICS_DIR, f"snapshot_{int(built_at * 1000)}.duckdb")
+    partial_path = path + ".partial"
+    if os.path.exists(partial_path):
+        os.unlink(partial_path)
+    connection = duckdb.connect(partial_path, config={"threads": ANALYTICS_THREADS})
+    try:
+        duckdb_types = {"int": "BIGINT", "str": "VARCHAR", "date": "DATE"}
+        for table, columns in SNAPSHOT_COLUMNS.items():
+            definitions = ", ".join(f"{name} {duckdb_types[kind]}" for name, kind in columns.items())
+            connection.execute(f"CREATE TABLE {table} ({definitions})")
+        counts = {table: 0 for table in SNAPSHOT_COLUMNS}
+        _copy_tables(DATABASE_PATH, list(SNAPSHOT_COLUMNS), connection, counts)
+        if shards.SHARDING:
+            sharded_tables = [table for table in SNAPSHOT_COLUMNS if table not in CATALOG_TABLES]
+            for agency_id in shards.shard_ids():
+                _copy_tables(shards.shard_path(agency_id), sharded_tables, connection, counts)
+        connection.execute(
+            "CREATE TABLE snapshot_info AS SELECT ? AS built_at, ? AS build_ms, ? AS row_counts",
+            [built_at, (time.perf_counter() - started) * 1000, json.dumps(counts)]
+        )
+        connection.execute("CHECKPOINT")
+    except BaseException:
+        connection.close()
+        os.unlink(partial_path)
+        raise
+    connection.close()
+    # Published only once complete; workers never open a half-written file
+    os.rename(partial_path, path)
+    _prune(keep=path)
+    return path
+
+
+def _built_at(path):
+    return int(os.path.basename(path)[len("snapshot_"):-len(".duckdb")]) / 1000
+
+
+def _snapshot_files():
+    """Published snapshot files, newest first"""
+    if not os.path.isdir(ANALYTICS_DIR):
+        return []
+    return sorted(
+        (os.path.join(ANALYTICS_DIR, name) for name in os.listdir(ANALYTICS_DIR)
+         if name.startswith("snapshot_") and name.endswith(".duckdb")),
+        key=_built_at, reverse=True
+    )
+
+
+def _prune(keep):
+    # Workers still reading an older file keep it open; unlinking is safe
+    for path in _snapshot_files():
+        if path != keep:
+            os.unlink(path)
+
+
+def _acquire_lock():
+    """Whether this worker is (now) the one building snapshots"""
+    global _lock_file
+    if _lock_file is not None:
+        return True
+    os.makedirs(ANALYTICS_DIR, exist_ok=True)
+    lock_file = open(ANALYTICS_LOCK_PATH, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+    _lock_file = lock_file
+    logger.info(f"Worker {os.getpid()} builds the analytics snapshots")
+    return True
+
+
+async def refresh():
+    """Build a snapshot if this worker is the builder and the newest is due,
+    then switch to the newest one; False if that failed"""
+    global snapshot
+    loop = asyncio.get_running_loop()
+    async with _refresh_lock:
+        try:
+            files = _snapshot_files()
+            newest = _built_at(files[0]) if files else None
+            if _acquire_lock() and (
+                newest is None or time.time() - newest >= ANALYTICS_REFRESH_SECONDS
+            ):
+                started = time.perf_counter()
+                await loop.run_in_executor(None, build_snapshot)
+                stats["builds"] += 1
+                stats["last_build_ms"] = round((time.perf_counter() - started) * 1000, 3)
+                files = _snapshot_files()
+            if not files or (snapshot is not None and snapshot.path == files[0]):
+                return True
+            new_snapshot = await loop.run_in_executor(None, Snapshot, files[0])
+        except Exception as e:
+            stats["failures"] += 1
+            logger.error(f"Error refreshing the analytics snapshot: {e}")
+            return False
+    # Reports still running keep the old connection alive until they finish
+    snapshot = new_snapshot
+    stats["refreshes"] += 1
+    stats["rows"] = snapshot.row_counts
+    logger.info(f"Analytics snapshot of {time.ctime(snapshot.built_at)} in use: {snapshot.row_counts}")
+    return True
+
+
+async def run(sql, parameters=()):
+    """(rows, meta) for ``sql`` against the current snapshot; None if there is none"""
+    current = snapshot
+    if current is None:
+        return None
+    rows = await asyncio.get_running_loop().run_in_executor(
+        None, current.query, sql, parameters
+    )
+    return rows, current.meta()
+
+
+def summary():
+    return {
+        **stats,
+        "available": available(),
+        "builder": _lock_file is not None,
+        "snapshot_age_seconds": snapshot.meta()["snapshot_age_seconds"] if snapshot else None
+    }
+
+
+async def _refresh_periodically():
+    while True:
+        await refresh()
+        # Non-builders only look for a newer file, so they can look often
+        await asyncio.sleep(min(ANALYTICS_CHECK_SECONDS, ANALYTICS_REFRESH_SECONDS))
+
+
+async def start_analytics(app, loop):
+    global _refresher
+    if not ANALYTICS:
+        return
+    if not HAVE_DUCKDB:
+        logger.warning("duckdb/pyarrow not installed; /api/analytics is unavailable")
+        return
+    _refresher = asyncio.create_task(_refresh_periodically())
+
+
+async def stop_analytics(app, loop):
+    global _refresher, _lock_file, snapshot
+    if _refresher is not None:
+        _refresher.cancel()
+        _refresher = None
+    snapshot = None
+    if _lock_file is not None:
+        _lock_file.close()
+        _lock_file = None
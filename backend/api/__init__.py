@@ -8,5 +8,7 @@ from sanic import Sanic
 
 def init_app(app: Sanic) -> None:
     """Initialize the API package with the Sanic app instance."""
-    # You can add any API-wide configuration here
-    pass
\ No newline at end of file
+    from api import admission
+    from api.routes import ADMISSION_POOLS
+
+    admission.install(app, ADMISSION_POOLS)
@@ -0,0 +1,197 @@
+# backend/api/admission.py
+"""
+Admission control and load shedding.
+
+Requests are admitted into a named concurrency pool (reads, writes, exports).
+Each pool runs at most `concurrency` requests at once and parks up to
+`queue` more; once the queue is full, or a parked request has waited
+`ADMISSION_QUEUE_TIMEOUT` seconds, the request is shed with 503 + Retry-After.
+Separate pools mean a burst of exports or slow writes can't starve cheap reads.
+
+Which pool a blueprint uses is configured in api/routes/__init__.py.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+import weakref
+
+from sanic import json
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', '1') == '1'
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 5))
+
+# pool name -> (concurrency, queue)
+POOL_DEFAULTS = {
+    'reads': (32, 256),
+    'writes': (8, 64),
+    'exports': (2, 4),
+}
+
+
+class PoolFull(Exception):
+    def __init__(self, pool):
+        super().__init__(f"Pool {pool.name} is full")
+        self.pool = pool
+
+
+class ConcurrencyPool:
+    """A semaphore with a bounded wait queue and queue-time metrics"""
+
+    def __init__(self, name, concurrency, queue, queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.admitted = 0
+        self.shed = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+        self.service_time_total = 0.0
+
+    async def acquire(self):
+        """Wait for a slot; return the time spent queued or raise PoolFull"""
+        if self._semaphore.locked() and self.waiting >= self.queue:
+            self.shed += 1
+            raise PoolFull(self)
+
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            raise PoolFull(self)
+        finally:
+            self.waiting -= 1
+
+        queued = time.perf_counter() - start
+        self.active += 1
+        self.admitted += 1
+        self.queue_time_total += queued
+        self.queue_time_max = max(self.queue_time_max, queued)
+        return queued
+
+    def release(self, service_time):
+        self.active -= 1
+        self.service_time_total += service_time
+        self._semaphore.release()
+
+    def retry_after(self):
+        """Seconds until the current backlog should have drained, at least 1"""
+        if not self.admitted:
+            return 1
+        avg_service = self.service_time_total / self.admitted
+        backlog = self.active + self.waiting
+        return max(1, math.ceil(backlog * avg_service / self.concurrency))
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "queue": self.queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "queue_time_avg_ms": (
+                self.queue_time_total / self.admitted * 1000 if self.admitted else 0.0
+            ),
+            "queue_time_max_ms": self.queue_time_max * 1000,
+        }
+
+
+def create_pools():
+    """Build pools from POOL_DEFAULTS, overridable via ADMISSION_<POOL>_CONCURRENCY/_QUEUE"""
+    pools = {}
+    for name, (concurrency, queue) in POOL_DEFAULTS.items():
+        prefix = f"ADMISSION_{name.upper()}"
+        pools[name] = ConcurrencyPool(
+            name,
+            int(os.getenv(f"{prefix}_CONCURRENCY", concurrency)),
+            int(os.getenv(f"{prefix}_QUEUE", queue)),
+        )
+    return pools
+
+
+pools = create_pools()
+
+
+def blueprint_name(request):
+    """Blueprint of the matched route, from names like 'app.trips.get_trips'"""
+    parts = (request.name or "").split(".")
+    return parts[1] if len(parts) == 3 else None
+
+
+def select_pool(request, blueprint_pools):
+    """Pick the pool for a request, or None if it isn't admission-controlled"""
+    config = blueprint_pools.get(blueprint_name(request))
+    if config is None:
+        return None
+    if getattr(request.route.ctx, 'admission_pool', None):
+        return pools[request.route.ctx.admission_pool]
+    if request.method in ("GET", "HEAD"):
+        return pools[config["read"]]
+    return pools[config["write"]]
+
+
+def stats():
+    return {name: pool.stats() for name, pool in pools.items()}
+
+
+def hold_slot(request):
+    """Keep the request's slot past response middleware; call the result to free it.
+
+    Streamed responses run response middleware in request.respond(), before
+    the body is sent.
+    """
+    request.ctx.admission_held = True
+    return getattr(request.ctx, 'admission_release', None) or (lambda: None)
+
+
+def install(app, blueprint_pools):
+    """Register admission middleware for the blueprints in ``blueprint_pools``"""
+    if not ADMISSION_CONTROL:
+        return
+
+    @app.on_request(priority=100)
+    async def admit(request):
+        pool = select_pool(request, blueprint_pools)
+        if pool is None:
+            return
+        try:
+            queued = await pool.acquire()
+        except PoolFull:
+            logger.warning(f"Shedding {request.method} {request.path} ({pool.name} pool full)")
+            return json(
+                {"error": "Server is busy, please retry"},
+                status=503,
+                headers={"Retry-After": str(pool.retry_after())}
+            )
+
+        started = time.perf_counter()
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                pool.release(time.perf_counter() - started)
+
+        request.ctx.admission_release = release
+        request.ctx.admission_queue_time = queued
+        # Cancelled requests skip response middleware; free the slot when
+        # the request object goes away instead.
+        weakref.finalize(request, release)
+
+    @app.on_response(priority=100)
+    async def release_slot(request, response):
+        release = getattr(request.ctx, 'admission_release', None)
+        if release is not None:
+            if not getattr(request.ctx, 'admission_held', False):
+                release()
+            response.headers["X-Queue-Time-Ms"] = f"{request.ctx.admission_queue_time * 1000:.1f}"
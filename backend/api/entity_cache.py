@@ -0,0 +1,161 @@
+# backend/api/entity_cache.py
+"""
+Read-through cache of TravelAgency and User rows, plus each agency's list
+of users.
+
+Entries are plain to_dict() snapshots in bounded LRUs, one per worker. A
+committed write to users or travel_agencies is announced on the worker
+bus, and every worker drops the affected entries. The version counter
+goes up on every invalidation. A reader notes it before querying and
+stores its result only if nothing was invalidated meanwhile, so a read
+that raced a write can't put the old row back.
+
+Bus messages can be lost, so entries also expire ENTITY_CACHE_TTL
+seconds after they were read; that also bounds how long rows written
+outside the server (seed.py, manual SQL) stay unseen. Opt out with
+ENTITY_CACHE=0.
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import bus
+import changes
+
+logger = logging.getLogger(__name__)
+
+ENTITY_CACHE = os.getenv('ENTITY_CACHE', '1') == '1'
+ENTITY_CACHE_SIZE = int(os.getenv('ENTITY_CACHE_SIZE', 10000))
+ENTITY_CACHE_TTL = float(os.getenv('ENTITY_CACHE_TTL', 300))
+ENTITY_TABLES = ("users", "travel_agencies")
+
+
+class LRU:
+    def __init__(self, maxsize, ttl=ENTITY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires at, value)
+        self.expired = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self.entries[key]
+            self.expired += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        self.entries.pop(key, None)
+
+    def items(self):
+        """(key, value) pairs, expired ones included"""
+        return [(key, value) for key, (_, value) in self.entries.items()]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class EntityCache:
+    def __init__(self, maxsize=ENTITY_CACHE_SIZE):
+        self.agencies = LRU(maxsize)
+        self.users = LRU(maxsize)
+        self.members = LRU(maxsize)  # agency id -> user ids, ordered by name
+        self.version = 0
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _count(self, value):
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def user(self, user_id):
+        """The cached user dict, or None"""
+        if not ENTITY_CACHE:
+            return None
+        return self._count(self.users.get(user_id))
+
+    def agency_users(self, agency_id):
+        """The agency's user dicts in name order, or None unless all are cached"""
+        if not ENTITY_CACHE:
+            return None
+        user_ids = self.members.get(agency_id)
+        users = None
+        if user_ids is not None and self.agencies.get(agency_id) is not None:
+            users = [self.users.get(user_id) for user_id in user_ids]
+            if any(user is None for user in users):
+                users = None
+        return self._count(users)
+
+    def store_user(self, user, version):
+        if ENTITY_CACHE and version == self.version:
+            self.users.put(user["id"], user)
+
+    def store_agency_users(self, agency, users, version):
+        if not ENTITY_CACHE or version != self.version:
+            return
+        self.agencies.put(agency["id"], agency)
+        for user in users:
+            self.users.put(user["id"], user)
+        self.members.put(agency["id"], [user["id"] for user in users])
+
+    def invalidate(self, entries):
+        """Drop cached rows for ``entries``, a list of [table, op, id, agency id]"""
+        self.version += 1
+        self.stats["invalidations"] += len(entries)
+        for table, op, row_id, agency_id in entries:
+            if table == "users":
+                self.users.pop(row_id)
+                if agency_id is not None:
+                    self.members.pop(agency_id)
+                # Deletes and agency moves: drop any list the user was on
+                for member_of, user_ids in self.members.items():
+                    if row_id in user_ids:
+                        self.members.pop(member_of)
+            elif table == "travel_agencies":
+                self.agencies.pop(row_id)
+                self.members.pop(row_id)
+                if op == "delete":
+                    # ON DELETE CASCADE took the agency's users with it
+                    for user_id, user in self.users.items():
+                        if user["travel_agency_id"] == row_id:
+                            self.users.pop(user_id)
+
+    def clear(self, payload=None):
+        """Drop every entry, e.g. after a backfill rewrote rows (backfill.py)"""
+        self.version += 1
+        for lru in (self.agencies, self.users, self.members):
+            lru.entries.clear()
+
+    def summary(self):
+        return {
+            **self.stats,
+            "agencies": len(self.agencies),
+            "users": len(self.users),
+            "agency_user_lists": len(self.members),
+            "expired": sum(lru.expired for lru in (self.agencies, self.users, self.members)),
+        }
+
+
+entity_cache = EntityCache()
+bus.subscribe("entities.invalidate", entity_cache.invalidate)
+bus.subscribe("entities.clear", entity_cache.clear)
+
+
+@changes.on_commit
+def invalidate_on_commit(change_list):
+    entries = [
+        [change.table, change.op, change.id, (change.data or {}).get("travel_agency_id")]
+        for change in change_list if change.table in ENTITY_TABLES
+    ]
+    if entries:
+        bus.publish("entities.invalidate", entries, include_self=True)
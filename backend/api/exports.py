@@ -0,0 +1,159 @@
+# backend/api/exports.py
+"""
+Bulk exports of a collection as Parquet or Arrow IPC:
+GET /api/trips/export?format=parquet (or format=arrow).
+
+Rows come off a server-side cursor EXPORT_BATCH_ROWS at a time. Each
+batch becomes one Arrow record batch (one row group in Parquet) and is
+sent as soon as it's encoded, so memory stays at about one batch however
+large the table is. Columns keep their database types; dates are date32.
+
+Needs the pyarrow package (in requirements.txt); without it the export
+endpoints answer 501.
+"""
+import importlib.util
+import io
+import logging
+import os
+
+from sanic import json
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, Numeric
+
+import shards
+from api import admission
+from database import get_session
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_ROWS = int(os.getenv('EXPORT_BATCH_ROWS', 10000))
+EXPORT_PARQUET_COMPRESSION = os.getenv('EXPORT_PARQUET_COMPRESSION', 'zstd')
+
+# pyarrow is slow to import and only exports use it, so it's imported
+# in the functions below, on first use
+HAVE_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+# format -> (content type, file extension)
+FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
+class InvalidFormat(ValueError):
+    pass
+
+
+def parse_format(request):
+    export_format = request.args.get('format')
+    if export_format not in FORMATS:
+        raise InvalidFormat(f"format must be one of {', '.join(FORMATS)}")
+    return export_format
+
+
+def arrow_type(column):
+    import pyarrow as pa
+
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+    if isinstance(column.type, Date):
+        return pa.date32()
+    if isinstance(column.type, (Float, Numeric)):
+        return pa.float64()
+    return pa.string()
+
+
+def arrow_schema(model):
+    import pyarrow as pa
+
+    return pa.schema([
+        pa.field(column.name, arrow_type(column), nullable=column.nullable)
+        for column in model.__table__.columns
+    ])
+
+
+class _Sink(io.RawIOBase):
+    """File object the writers encode into; take() hands over what they wrote"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _writer(export_format, sink, schema):
+    import pyarrow as pa
+
+    if export_format == "parquet":
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(sink, schema, compression=EXPORT_PARQUET_COMPRESSION)
+    return pa.ipc.new_stream(sink, schema)
+
+
+async def _partitions(query):
+    """Lists of up to EXPORT_BATCH_ROWS rows of ``query``, shard by shard when sharded"""
+    if shards.SHARDING:
+        factories = [shards.sessions_for(agency_id) for agency_id in shards.shard_ids()]
+    else:
+        factories = [get_session]
+    for factory in factories:
+        async with factory() as session:
+            result = await session.stream(
+                query.execution_options(yield_per=EXPORT_BATCH_ROWS)
+            )
+            async for rows in result.partitions():
+                yield rows
+
+
+async def export(request, model, query, export_format, collection):
+    """Stream the rows ``query`` selects from ``model`` as ``export_format``"""
+    if not HAVE_PYARROW:
+        return json({"error": "Exports need the pyarrow package"}, status=501)
+    import pyarrow as pa
+
+    schema = arrow_schema(model)
+    query = query.with_only_columns(*model.__table__.columns).order_by(model.id)
+    content_type, extension = FORMATS[export_format]
+    response = await request.respond(content_type=content_type, headers={
+        "Content-Disposition": f'attachment; filename="{collection}.{extension}"'
+    })
+    # Response middleware ran in respond(); keep the exports slot until the end
+    release = admission.hold_slot(request)
+    sink = _Sink()
+    try:
+        writer = _writer(export_format, sink, schema)
+        async for rows in _partitions(query):
+            columns = list(zip(*rows))
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+            await response.send(sink.take())
+        writer.close()
+        await response.send(sink.take())
+        await response.eof()
+    except Exception as e:
+        # The status line is long gone; the client sees a truncated body
+        logger.error(f"Error exporting {collection} as {export_format}: {e}")
+        raise
+    finally:
+        release()
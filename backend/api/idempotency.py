@@ -0,0 +1,245 @@
+# backend/api/idempotency.py
+"""
+Idempotency-Key support for the create endpoints (POST /api/trips/,
+/api/lodgings/, /api/itineraries/).
+
+A client that retries a POST with the same Idempotency-Key header gets
+the first attempt's response back, marked Idempotent-Replayed: true,
+and nothing is written again. Keys live in the idempotency_keys table of
+the main database (the catalog when sharding):
+
+- The first request claims its key by inserting a row with no response
+  and an expiry IDEMPOTENCY_LOCK_SECONDS away, runs, then stores its
+  response there for IDEMPOTENCY_TTL_SECONDS. 5xx responses aren't
+  stored: the key is released so a retry runs again.
+- A duplicate that arrives while the first is still running waits for
+  it: on the same worker through a future, across workers by polling
+  the row. After IDEMPOTENCY_WAIT_SECONDS it gets 409 and Retry-After.
+- Reusing a key with a different body gets 422.
+- A claim whose worker died expires like any other key and is taken
+  over by the next retry.
+
+Expired rows are deleted in batches by the maintenance scheduler
+(maintenance.py). A crash after the write committed but before the
+response was stored leaves the key to expire, so that one case can
+still run twice.
+"""
+import asyncio
+import hashlib
+import json as jsonlib
+import logging
+import os
+import time
+from functools import wraps
+
+from sanic import json
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert
+
+# Keys are kept in the main database, whichever shard the request writes to
+from database import get_session, using_sessions
+from api.models.models import IdempotencyKey
+from api.single_flight import from_snapshot, snapshot
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', 86400))
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv('IDEMPOTENCY_LOCK_SECONDS', 60))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', 30))
+IDEMPOTENCY_POLL_MS = float(os.getenv('IDEMPOTENCY_POLL_MS', 50))
+IDEMPOTENCY_GC_BATCH = int(os.getenv('IDEMPOTENCY_GC_BATCH', 1000))
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+_in_flight = {}  # (scope, key) -> (fingerprint, future of the response snapshot)
+stats = {"claimed": 0, "replayed": 0, "waited": 0, "conflicts": 0, "mismatches": 0}
+
+
+def fingerprint(request):
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.body or b"")
+    return digest.hexdigest()
+
+
+async def _claim(scope, key, request_fingerprint):
+    """Take the key unless someone holds it; True if we now own it"""
+    now = time.time()
+    values = {
+        "scope": scope, "key": key, "fingerprint": request_fingerprint,
+        "status": None, "headers": None, "content_type": None, "body": None,
+        "created_at": now, "expires_at": now + IDEMPOTENCY_LOCK_SECONDS
+    }
+    statement = insert(IdempotencyKey).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=["scope", "key"],
+        set_={name: value for name, value in values.items() if name not in ("scope", "key")},
+        # Only an expired key (finished long ago, or its claimer died) is free
+        where=IdempotencyKey.expires_at < now
+    )
+    with using_sessions(None):
+        async with get_session() as session:
+            result = await session.execute(statement)
+            await session.commit()
+            return result.rowcount == 1
+
+
+async def _load(scope, key):
+    with using_sessions(None):
+        async with get_session() as session:
+            result = await session.execute(
+                select(IdempotencyKey).filter(
+                    IdempotencyKey.scope == scope, IdempotencyKey.key == key
+                )
+            )
+            return result.scalar_one_or_none()
+
+
+async def _store(scope, key, response):
+    body, status, headers, content_type = snapshot(response)
+    with using_sessions(None):
+        async with get_session() as session:
+            await session.execute(
+                update(IdempotencyKey)
+                .filter(IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+                .values(
+                    status=status, headers=jsonlib.dumps(headers),
+                    content_type=content_type, body=body,
+                    expires_at=time.time() + IDEMPOTENCY_TTL_SECONDS
+                )
+            )
+            await session.commit()
+
+
+async def _release(scope, key):
+    with using_sessions(None):
+        async with get_session() as session:
+            await session.execute(
+                delete(IdempotencyKey).filter(
+                    IdempotencyKey.scope == scope, IdempotencyKey.key == key,
+                    IdempotencyKey.status.is_(None)
+                )
+            )
+            await session.commit()
+
+
+def replay(snap):
+    response = from_snapshot(snap)
+    response.headers["Idempotent-Replayed"] = "true"
+    stats["replayed"] += 1
+    return response
+
+
+def mismatch():
+    stats["mismatches"] += 1
+    return json({"error": f"{HEADER} was already used with a different request"}, status=422)
+
+
+def still_running():
+    stats["conflicts"] += 1
+    return json(
+        {"error": f"A request with this {HEADER} is still in progress"},
+        status=409, headers={"Retry-After": "1"}
+    )
+
+
+async def _wait_for_other_worker(scope, key, deadline):
+    """The stored response once the claim's holder finishes, or None if it gives up"""
+    while time.monotonic() < deadline:
+        await asyncio.sleep(IDEMPOTENCY_POLL_MS / 1000)
+        row = await _load(scope, key)
+        if row is None or row.expires_at < time.time():
+            return None  # released or abandoned: try to claim it
+        if row.status is not None:
+            return row
+    return False
+
+
+def idempotent(handler):
+    """Let clients retry ``handler`` safely by sending an Idempotency-Key"""
+    @wraps(handler)
+    async def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return await handler(request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return json({"error": f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters"}, status=400)
+
+        scope, request_fingerprint = request.name, fingerprint(request)
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            local = _in_flight.get((scope, key))
+            if local is not None:
+                # A duplicate on this worker: wait for the first one's response
+                if local[0] != request_fingerprint:
+                    return mismatch()
+                stats["waited"] += 1
+                try:
+                    snap = await asyncio.wait_for(
+                        asyncio.shield(local[1]), deadline - time.monotonic()
+                    )
+                except asyncio.TimeoutError:
+                    return still_running()
+                if snap is not None:
+                    return replay(snap)
+                continue  # it failed; go again
+
+            if await _claim(scope, key, request_fingerprint):
+                break
+            row = await _load(scope, key)
+            if row is None:
+                continue
+            if row.fingerprint != request_fingerprint:
+                return mismatch()
+            if row.status is None:
+                # Running on another worker
+                stats["waited"] += 1
+                row = await _wait_for_other_worker(scope, key, deadline)
+                if row is False:
+                    return still_running()
+                if row is None:
+                    continue
+                if row.fingerprint != request_fingerprint:
+                    return mismatch()
+            return replay((
+                row.body, row.status, jsonlib.loads(row.headers), row.content_type
+            ))
+
+        stats["claimed"] += 1
+        future = asyncio.get_running_loop().create_future()
+        _in_flight[(scope, key)] = (request_fingerprint, future)
+        snap = None
+        try:
+            response = await handler(request, *args, **kwargs)
+            if response.status < 500:
+                snap = snapshot(response)
+                await _store(scope, key, response)
+            else:
+                await _release(scope, key)
+            return response
+        except BaseException:
+            await asyncio.shield(_release(scope, key))
+            raise
+        finally:
+            del _in_flight[(scope, key)]
+            future.set_result(snap)
+
+    return wrapper
+
+
+def purge_expired(connection, path):
+    """Delete expired keys IDEMPOTENCY_GC_BATCH at a time (a maintenance job)"""
+    if not connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'idempotency_keys'"
+    ).fetchone():
+        return {"skipped": "no idempotency_keys table"}
+    deleted = 0
+    while True:
+        # Short transactions, so writers never wait long behind the purge
+        count = connection.execute(
+            "DELETE FROM idempotency_keys WHERE rowid IN ("
+            "SELECT rowid FROM idempotency_keys WHERE expires_at < ? LIMIT ?)",
+            (time.time(), IDEMPOTENCY_GC_BATCH)
+        ).rowcount
+        deleted += count
+        if count < IDEMPOTENCY_GC_BATCH:
+            return {"deleted": deleted}
@@ -0,0 +1,35 @@
+# backend/api/includes.py
+"""
+?include= expansion for list endpoints, e.g. GET /api/itineraries?include=trips,user.
+
+Each requested relationship is loaded with selectinload: one batched
+IN query per relationship for the whole page, never one query per row.
+"""
+from sqlalchemy.orm import selectinload
+
+
+class InvalidInclude(ValueError):
+    pass
+
+
+def parse_include(request, allowed):
+    """Relationship names in ``?include=``, checked against ``allowed``"""
+    raw = request.args.get('include')
+    if not raw:
+        return []
+    names = list(dict.fromkeys(part.strip() for part in raw.split(',') if part.strip()))
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise InvalidInclude(
+            f"Unknown include: {', '.join(unknown)}. Allowed: {', '.join(allowed)}"
+        )
+    return names
+
+
+def load_options(model, names):
+    return [selectinload(getattr(model, name)) for name in names]
+
+
+def link_suffix(names):
+    """Query-string tail that keeps ?include= on the HATEOAS links"""
+    return f"&include={','.join(names)}" if names else ""
@@ -0,0 +1,186 @@
+# backend/api/live.py
+"""
+Live change events for WebSocket subscribers.
+
+When trips, lodgings or itineraries are committed, the worker that wrote
+them works out the affected channels ("itinerary:<id>", "agency:<id>")
+and publishes the events on the worker bus. Every worker, including the
+writer, then fans them out to its local subscribers.
+
+Each subscriber has a bounded queue. A client that falls LIVE_QUEUE_SIZE
+events behind has its backlog dropped and gets a single "resync" message
+instead, telling it to re-fetch over HTTP. A slow client therefore can't
+grow memory without bound or hold up other subscribers.
+"""
+import asyncio
+import logging
+import os
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import select
+
+import bus
+import changes
+import shards
+from database import get_session
+from api.models.models import Itinerary, User
+
+logger = logging.getLogger(__name__)
+
+LIVE_QUEUE_SIZE = int(os.getenv('LIVE_QUEUE_SIZE', 100))
+LIVE_TABLES = ("trips", "lodgings", "itineraries")
+AGENCY_CACHE_SIZE = 4096
+
+
+class Subscriber:
+    def __init__(self, channel, maxsize=LIVE_QUEUE_SIZE):
+        self.channel = channel
+        self.queue = asyncio.Queue(maxsize)
+        self.resyncs = 0
+
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too far behind: drop the backlog and ask the client to re-fetch
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.resyncs += 1
+            self.queue.put_nowait({"type": "resync", "channel": self.channel})
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class Hub:
+    def __init__(self):
+        self.channels = defaultdict(set)
+        self.stats = {"delivered": 0, "resyncs": 0}
+
+    def subscribe(self, channel):
+        subscriber = Subscriber(channel)
+        self.channels[channel].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.stats["resyncs"] += subscriber.resyncs
+        subscribers = self.channels.get(subscriber.channel)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.channels[subscriber.channel]
+
+    def deliver(self, payload):
+        for event in payload["events"]:
+            message = {key: value for key, value in event.items() if key != "channels"}
+            for channel in event["channels"]:
+                for subscriber in self.channels.get(channel, ()):
+                    subscriber.push(message)
+                    self.stats["delivered"] += 1
+
+    def summary(self):
+        return {
+            **self.stats,
+            "channels": len(self.channels),
+            "subscribers": sum(len(subs) for subs in self.channels.values()),
+        }
+
+
+hub = Hub()
+bus.subscribe("live.events", hub.deliver)
+
+# itinerary id -> agency id, so repeat events need no lookup
+_agency_of_itinerary = OrderedDict()
+_pending = set()
+
+
+def _remember(itinerary_id, agency_id):
+    _agency_of_itinerary[itinerary_id] = agency_id
+    _agency_of_itinerary.move_to_end(itinerary_id)
+    if len(_agency_of_itinerary) > AGENCY_CACHE_SIZE:
+        _agency_of_itinerary.popitem(last=False)
+
+
+async def resolve_agencies(change_list):
+    """Fill the itinerary -> agency map for every itinerary in ``change_list``"""
+    if shards.SHARDING:
+        # Sharded ids carry their agency; nothing to look up
+        for change in change_list:
+            data = change.data or {}
+            itinerary_id = change.id if change.table == "itineraries" else data.get("itinerary_id")
+            if itinerary_id is not None:
+                _remember(itinerary_id, shards.shard_of(itinerary_id))
+        return
+
+    itinerary_users = {}
+    unknown_itineraries = set()
+    for change in change_list:
+        data = change.data or {}
+        if change.table == "itineraries" and data.get("user_id") is not None:
+            # The owner may have changed, so always look it up again
+            itinerary_users[change.id] = data["user_id"]
+        elif data.get("itinerary_id") not in _agency_of_itinerary:
+            unknown_itineraries.add(data.get("itinerary_id"))
+    unknown_itineraries.discard(None)
+    if not itinerary_users and not unknown_itineraries:
+        return
+
+    async with get_session() as session:
+        if itinerary_users:
+            result = await session.execute(
+                select(User.id, User.travel_agency_id)
+                .filter(User.id.in_(set(itinerary_users.values())))
+            )
+            agency_of_user = dict(result.all())
+            for itinerary_id, user_id in itinerary_users.items():
+                if user_id in agency_of_user:
+                    _remember(itinerary_id, agency_of_user[user_id])
+        if unknown_itineraries:
+            result = await session.execute(
+                select(Itinerary.id, User.travel_agency_id)
+                .join(User, Itinerary.user_id == User.id)
+                .filter(Itinerary.id.in_(unknown_itineraries))
+            )
+            for itinerary_id, agency_id in result.all():
+                _remember(itinerary_id, agency_id)
+
+
+async def publish_changes(change_list):
+    try:
+        await resolve_agencies(change_list)
+    except Exception as e:
+        logger.error(f"Error resolving agencies for live events: {e}")
+
+    events = []
+    for change in change_list:
+        data = change.data or {}
+        itinerary_id = change.id if change.table == "itineraries" else data.get("itinerary_id")
+        channels = []
+        if itinerary_id is not None:
+            channels.append(f"itinerary:{itinerary_id}")
+            agency_id = _agency_of_itinerary.get(itinerary_id)
+            if agency_id is not None:
+                channels.append(f"agency:{agency_id}")
+        if channels:
+            events.append({
+                "type": "change",
+                "table": change.table,
+                "op": change.op,
+                "id": change.id,
+                "data": data,
+                "channels": channels,
+            })
+    if events:
+        bus.publish("live.events", {"events": events}, include_self=True)
+
+
+@changes.on_commit
+def publish_on_commit(change_list):
+    relevant = [change for change in change_list if change.table in LIVE_TABLES]
+    # Scripts like seed.py commit without a running server; nobody is listening
+    if not relevant or not bus.running():
+        return
+    task = asyncio.get_running_loop().create_task(publish_changes(relevant))
+    # Hold a reference until the task is done so it isn't garbage collected
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
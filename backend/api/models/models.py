@@ -1,5 +1,7 @@
 # backend/api/models/models.py
-from sqlalchemy import Column, Integer, String, Date, ForeignKey
+from sqlalchemy import (
+    Column, Integer, String, Date, Float, ForeignKey, LargeBinary, Text, DDL, Index, event
+)
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -10,11 +12,21 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False)
     email = Column(String(100), nullable=False, unique=True)
-    travel_agency_id = Column(Integer, ForeignKey('travel_agencies.id'), nullable=False)
+    travel_agency_id = Column(
+        Integer,
+        ForeignKey('travel_agencies.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True  # cascades look children up by this column
+    )
 
     # Relationships
     travel_agency = relationship("TravelAgency", back_populates="users")
-    itineraries = relationship("Itinerary", back_populates="user")
+    itineraries = relationship(
+        "Itinerary",
+        back_populates="user",
+        cascade="all, delete-orphan",
+        passive_deletes=True
+    )
 
     def to_dict(self, include_itineraries=False):
         """
@@ -47,7 +59,8 @@ class TravelAgency(Base):
     users = relationship(
         "User",
         back_populates="travel_agency",
-        cascade="all, delete-orphan"
+        cascade="all, delete-orphan",
+        passive_deletes=True
     )
 
 
@@ -72,16 +85,34 @@ class Itinerary(Base):
     tour_name = Column(String(100), nullable=False)
     date_start = Column(Date, nullable=False)
     date_end = Column(Date, nullable=False)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    user_id = Column(
+        Integer,
+        ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True  # cascades look children up by this column
+    )
+    # Set by the sync triggers on every insert/update; see SYNC_TABLES below
+    version = Column(Integer, index=True)
     
     # Add relationships to trips and lodgings
-    trips = relationship("Trip", back_populates="itinerary", cascade="all, delete-orphan")
-    lodgings = relationship("Lodging", back_populates="itinerary", cascade="all, delete-orphan")
+    # passive_deletes leaves child deletes to the database's ON DELETE CASCADE
+    trips = relationship(
+        "Trip",
+        back_populates="itinerary",
+        cascade="all, delete-orphan",
+        passive_deletes=True
+    )
+    lodgings = relationship(
+        "Lodging",
+        back_populates="itinerary",
+        cascade="all, delete-orphan",
+        passive_deletes=True
+    )
     
     # Existing user relationship
     user = relationship("User", back_populates="itineraries")
 
-    def to_dict(self, include_relationships=False):
+    def to_dict(self, include_relationships=False, include_user=False):
         data = {
             "id": self.id,
             "tour_name": self.tour_name,
@@ -94,11 +125,17 @@ class Itinerary(Base):
             data["trips"] = [trip.to_dict() for trip in self.trips]
         if include_relationships and 'lodgings' in self.__dict__:
             data["lodgings"] = [lodging.to_dict() for lodging in self.lodgings]
+        if include_user and 'user' in self.__dict__:
+            data["user"] = self.user.to_dict()
             
         return data
 
 class Trip(Base):
     __tablename__ = "trips"
+    __table_args__ = (
+        # Per-itinerary scans in date order, for /api/users/<id>/timeline
+        Index("ix_trips_itinerary_date", "itinerary_id", "date_start"),
+    )
     
     id = Column(Integer, primary_key=True)
     date_start = Column(Date, nullable=False)
@@ -109,13 +146,21 @@ class Trip(Base):
     location_end = Column(String(100), nullable=False)
     
     # Add foreign key to itinerary
-    itinerary_id = Column(Integer, ForeignKey('itineraries.id'), nullable=False)
+    itinerary_id = Column(
+        Integer,
+        ForeignKey('itineraries.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True  # cascades look children up by this column
+    )
     
+    # Set by the sync triggers on every insert/update; see SYNC_TABLES below
+    version = Column(Integer, index=True)
+
     # Add relationship to itinerary
     itinerary = relationship("Itinerary", back_populates="trips")
 
-    def to_dict(self):
-        return {
+    def to_dict(self, include_itinerary=False):
+        data = {
             "id": self.id,
             "date_start": str(self.date_start),
             "date_end": str(self.date_end),
@@ -126,8 +171,18 @@ class Trip(Base):
             "itinerary_id": self.itinerary_id
         }
 
+        # Only include the itinerary if explicitly requested and loaded
+        if include_itinerary and 'itinerary' in self.__dict__:
+            data["itinerary"] = self.itinerary.to_dict()
+
+        return data
+
 class Lodging(Base):
     __tablename__ = "lodgings"
+    __table_args__ = (
+        # Per-itinerary scans in date order, for /api/users/<id>/timeline
+        Index("ix_lodgings_itinerary_date", "itinerary_id", "date_start"),
+    )
     
     id = Column(Integer, primary_key=True)
     date_start = Column(Date, nullable=False)
@@ -138,13 +193,21 @@ class Lodging(Base):
     room_count = Column(Integer)
     
     # Add foreign key to itinerary
-    itinerary_id = Column(Integer, ForeignKey('itineraries.id'), nullable=False)
+    itinerary_id = Column(
+        Integer,
+        ForeignKey('itineraries.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True  # cascades look children up by this column
+    )
     
+    # Set by the sync triggers on every insert/update; see SYNC_TABLES below
+    version = Column(Integer, index=True)
+
     # Add relationship to itinerary
     itinerary = relationship("Itinerary", back_populates="lodgings")
 
-    def to_dict(self):
-        return {
+    def to_dict(self, include_itinerary=False):
+        data = {
             "id": self.id,
             "date_start": str(self.date_start),
             "date_end": str(self.date_end),
@@ -154,3 +217,92 @@ class Lodging(Base):
             "room_count": self.room_count,
             "itinerary_id": self.itinerary_id
         }
+
+        # Only include the itinerary if explicitly requested and loaded
+        if include_itinerary and 'itinerary' in self.__dict__:
+            data["itinerary"] = self.itinerary.to_dict()
+
+        return data
+
+
+class SyncState(Base):
+    """Single row holding the last change version handed out"""
+    __tablename__ = "sync_state"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class SyncTombstone(Base):
+    """A deleted row, kept so sync clients can drop their copy"""
+    __tablename__ = "sync_tombstones"
+
+    version = Column(Integer, primary_key=True)
+    table_name = Column(String(50), nullable=False)
+    row_id = Column(Integer, nullable=False)
+
+    def to_dict(self):
+        return {
+            "version": self.version,
+            "table": self.table_name,
+            "id": self.row_id
+        }
+
+
+class IdempotencyKey(Base):
+    """A POST's Idempotency-Key and, once it has finished, its response.
+
+    While the first request runs, ``status`` is NULL and ``expires_at`` is
+    its lock deadline; afterwards it is when the key may be reused.
+    """
+    __tablename__ = "idempotency_keys"
+
+    scope = Column(String(100), primary_key=True)  # route name
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)  # hash of method, path and body
+    status = Column(Integer)
+    headers = Column(Text)
+    content_type = Column(String(100))
+    body = Column(LargeBinary)
+    created_at = Column(Float, nullable=False)
+    expires_at = Column(Float, nullable=False, index=True)
+
+
+# Tables whose rows carry a change version for GET /api/sync. The versions
+# are assigned by triggers, so every write path (ORM, bulk statements, the
+# write coalescer and ON DELETE CASCADE) is covered.
+SYNC_TABLES = ("itineraries", "trips", "lodgings")
+# Columns a PUT body may not set: the id, and the version the triggers own
+# (setting it would make the update trigger skip the row)
+READ_ONLY_COLUMNS = ("id", "version")
+
+
+def sync_trigger_statements(table):
+    next_version = "UPDATE sync_state SET version = version + 1 WHERE id = 1;"
+    set_version = (
+        f"UPDATE {table} SET version = (SELECT version FROM sync_state WHERE id = 1) "
+        "WHERE id = NEW.id;"
+    )
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_insert AFTER INSERT ON {table} "
+        f"BEGIN {next_version} {set_version} END",
+        # The WHEN clause skips the trigger's own version update
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_update AFTER UPDATE ON {table} "
+        f"WHEN NEW.version IS OLD.version "
+        f"BEGIN {next_version} {set_version} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_delete AFTER DELETE ON {table} "
+        f"BEGIN {next_version} "
+        f"INSERT INTO sync_tombstones (version, table_name, row_id) "
+        f"SELECT version, '{table}', OLD.id FROM sync_state WHERE id = 1; END",
+    ]
+
+
+event.listen(
+    SyncState.__table__, "after_create",
+    DDL("INSERT INTO sync_state (id, version) VALUES (1, 0)")
+)
+# Per table, so only a table created with its version column gets them;
+# existing tables get theirs from migration 5c1d7e0a9b42
+for _table in SYNC_TABLES:
+    for _statement in sync_trigger_statements(_table):
+        event.listen(Base.metadata.tables[_table], "after_create", DDL(_statement))
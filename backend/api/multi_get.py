@@ -0,0 +1,60 @@
+# backend/api/multi_get.py
+"""
+Multi-get for the collection endpoints: GET /api/trips?ids=1,2,3.
+
+All the rows are fetched with a single IN query, replacing one
+GET /api/trips/<id> call per row. In sharded mode it is one IN query per
+shard the ids fall in.
+"""
+import os
+
+from sanic import json
+from sqlalchemy import select
+
+import shards
+
+MULTI_GET_MAX_IDS = int(os.getenv('MULTI_GET_MAX_IDS', 100))
+
+
+class InvalidIds(ValueError):
+    pass
+
+
+def parse_ids(request):
+    """The ids in ``?ids=``, de-duplicated in request order, or None if absent"""
+    raw = request.args.get('ids')
+    if raw is None:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(part) for part in raw.split(',') if part.strip()))
+    except ValueError:
+        raise InvalidIds("ids must be a comma-separated list of integers")
+    if not ids:
+        raise InvalidIds("ids must not be empty")
+    if len(ids) > MULTI_GET_MAX_IDS:
+        raise InvalidIds(f"At most {MULTI_GET_MAX_IDS} ids per request")
+    return ids
+
+
+async def get_many(session, model, ids, collection, options=(), **to_dict_kwargs):
+    """Response with the rows of ``model`` matching ``ids``, in the order asked for"""
+    if shards.SHARDING:
+        rows = await shards.get_by_ids(model, ids, options)
+    else:
+        result = await session.execute(
+            select(model).filter(model.id.in_(ids)).options(*options)
+        )
+        rows = {row.id: row for row in result.scalars()}
+    return json({
+        "data": [
+            rows[row_id].to_dict(**to_dict_kwargs) for row_id in ids if row_id in rows
+        ],
+        "_meta": {
+            "ids": ids,
+            "missing": [row_id for row_id in ids if row_id not in rows]
+        },
+        "_links": {
+            "self": f"/api/{collection}?ids={','.join(map(str, ids))}",
+            "collection": f"/api/{collection}"
+        }
+    })
@@ -0,0 +1,152 @@
+# backend/api/replica.py
+"""
+Per-worker in-memory copies of database tables (the route graph, the
+suggestion indexes), loaded at startup and kept current from committed
+writes announced on the worker bus.
+
+A Replica wraps a structure with apply(entries), stats and ready. Every
+commit that touches one of its tables is published as entries of
+[table, op, id, row dict], in messages kept under bus.MAX_MESSAGE_BYTES.
+Deleting an itinerary is passed on as such (its rows go with it);
+deleting a user or an agency cascades where the structure can't see it
+and triggers a reload.
+
+Bus delivery is best effort, so each message carries its sender's pid
+and a sequence number. A worker that sees a gap in a sender's sequence
+reloads. Every reload_seconds it reloads anyway, which also covers a lost
+last message.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+import bus
+import changes
+
+logger = logging.getLogger(__name__)
+
+# Tables whose deletes cascade to the replicated rows without change records
+RELOAD_ON_DELETE = ("users", "travel_agencies")
+
+
+def chunks(entries, max_bytes=bus.MAX_MESSAGE_BYTES):
+    """Split ``entries`` into lists whose JSON stays under ``max_bytes``;
+    None if one entry alone is too large"""
+    result, chunk, size = [], [], 0
+    for entry in entries:
+        entry_size = len(json.dumps(entry)) + 2
+        if entry_size > max_bytes:
+            return None
+        if chunk and size + entry_size > max_bytes:
+            result.append(chunk)
+            chunk, size = [], 0
+        chunk.append(entry)
+        size += entry_size
+    if chunk:
+        result.append(chunk)
+    return result
+
+
+class Replica:
+    def __init__(self, name, topic, tables, empty, build, reload_seconds):
+        """``empty()`` makes an unloaded structure; ``build()`` returns one
+        loaded from the database; ``tables`` are the tables it holds rows of"""
+        self.name = name
+        self.topic = topic
+        self.tables = tables
+        self.empty = empty
+        self.build = build
+        self.reload_seconds = reload_seconds
+        self.current = empty()
+        self.current.stats.update(missed_messages=0)
+        self._pending = []  # changes that arrived while a load was running
+        self._loading = None
+        self._reloader = None
+        self._sequence = 0
+        self._last_seen = {}  # sender pid -> last sequence number received
+        bus.subscribe(topic, self.on_bus_message)
+        changes.on_commit(self.publish_on_commit)
+
+    async def load(self):
+        """Rebuild the structure from the database"""
+        started = time.perf_counter()
+        self._pending.clear()
+        fresh = await self.build()
+        # Writes that committed during the read; applying them twice is harmless
+        fresh.apply(self._pending)
+        self._pending.clear()
+        fresh.stats = self.current.stats
+        fresh.stats["loads"] += 1
+        fresh.stats["load_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        fresh.ready, fresh.built_at = True, time.time()
+        self.current = fresh
+        logger.info(f"{self.name} loaded in {fresh.stats['load_ms']} ms: {fresh.summary()}")
+
+    def reload_soon(self):
+        """Start a load unless one is already running"""
+        if self._loading is None or self._loading.done():
+            self._loading = asyncio.ensure_future(self.load())
+
+    def on_bus_message(self, message):
+        if message == "reload":
+            self.reload_soon()
+            return
+        sender, sequence, entries = message["from"], message["seq"], message["entries"]
+        last = self._last_seen.get(sender)
+        self._last_seen[sender] = sequence
+        if last is not None and sequence != last + 1:
+            logger.warning(f"{self.name} missed {sequence - last - 1} message(s) from "
+                           f"worker {sender}; reloading")
+            self.current.stats["missed_messages"] += 1
+            self.reload_soon()
+        if self._loading is not None and not self._loading.done():
+            self._pending.extend(entries)
+        self.current.apply(entries)
+
+    def _publish(self, entries):
+        self._sequence += 1
+        bus.publish(self.topic, {
+            "from": os.getpid(), "seq": self._sequence, "entries": entries
+        }, include_self=True)
+
+    def publish_on_commit(self, change_list):
+        entries = []
+        reload = False
+        for change in change_list:
+            if change.table in self.tables:
+                entries.append([change.table, change.op, change.id, change.data])
+            elif change.table == "itineraries" and change.op == "delete":
+                entries.append([change.table, change.op, change.id, None])
+            elif change.table in RELOAD_ON_DELETE and change.op == "delete":
+                reload = True
+        # Scripts like seed.py commit without a running server
+        if not self.current.ready and self._loading is None:
+            return
+        messages = chunks(entries)
+        if messages is None:
+            # A row too large for the bus
+            messages, reload = [], True
+        for chunk in messages:
+            self._publish(chunk)
+        if reload:
+            bus.publish(self.topic, "reload", include_self=True)
+
+    async def _reload_periodically(self):
+        while True:
+            await asyncio.sleep(self.reload_seconds)
+            self.reload_soon()
+
+    async def start(self, app, loop):
+        self.reload_soon()
+        await self._loading
+        if self.reload_seconds:
+            self._reloader = asyncio.create_task(self._reload_periodically())
+
+    async def stop(self, app, loop):
+        if self._reloader is not None:
+            self._reloader.cancel()
+            self._reloader = None
+        if self._loading is not None:
+            self._loading.cancel()
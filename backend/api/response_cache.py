@@ -0,0 +1,52 @@
+# backend/api/response_cache.py
+"""
+Cache GET responses in the cross-worker shared cache (see shared_cache.py).
+
+Entries are grouped by namespace and dropped when a committed write touches
+a table the namespace depends on. Does nothing unless SHARED_CACHE=1.
+"""
+import json as jsonlib
+from functools import wraps
+
+from shared_cache import cache
+from api.single_flight import from_snapshot, request_key, snapshot
+
+
+def encode(snap):
+    body, status, headers, content_type = snap
+    meta = jsonlib.dumps([status, headers, content_type]).encode()
+    return meta + b"\0" + body
+
+
+def decode(value):
+    meta, _, body = value.partition(b"\0")
+    status, headers, content_type = jsonlib.loads(meta)
+    return body, status, headers, content_type
+
+
+def cached(namespace):
+    """Serve ``handler`` from the shared cache under ``namespace``"""
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request, *args, **kwargs):
+            if not cache.running:
+                return await handler(request, *args, **kwargs)
+
+            key = repr(request_key(request, kwargs))
+            value = await cache.get(namespace, key)
+            if value is not None:
+                response = from_snapshot(decode(value))
+                response.headers["X-Cache"] = "HIT"
+                return response
+
+            # Read the generation before the handler runs, so a write that
+            # commits meanwhile leaves this result stored under a dead key
+            generation = await cache.generation(namespace)
+            response = await handler(request, *args, **kwargs)
+            if response.status == 200 and response.body is not None:
+                await cache.set(namespace, key, encode(snapshot(response)), generation)
+            response.headers["X-Cache"] = "MISS"
+            return response
+
+        return wrapper
+    return decorator
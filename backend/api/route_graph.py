@@ -0,0 +1,280 @@
+# backend/api/route_graph.py
+"""
+In-memory graph of travel routes: locations are nodes, trips are edges
+from location_start to location_end.
+
+Location names are interned to small integers (case and surrounding
+spaces are ignored). Every origin keeps its departures in three parallel
+arrays sorted by start date (date, destination id, trip id), so the trips
+leaving a city in a date window are a binary search plus a slice.
+Per-route trip counts and in/out neighbour maps serve popular routes and
+path searches without touching the database.
+
+The graph is loaded from the trips table at startup. After that, each
+worker applies committed trip writes, announced on the worker bus, and
+reloads when it misses one or every ROUTE_GRAPH_RELOAD_SECONDS
+(api/replica.py).
+"""
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date
+
+from sqlalchemy import select
+
+import shards
+from database import get_session
+from api.models.models import Trip
+from api.replica import Replica
+
+# Full reload even without missed bus messages (0 = only when one is missed)
+ROUTE_GRAPH_RELOAD_SECONDS = float(os.getenv('ROUTE_GRAPH_RELOAD_SECONDS', 900))
+# Edges a path search may look at, so dense graphs can't stall a worker
+PATH_SEARCH_BUDGET = 20000
+
+
+def location_key(name):
+    return " ".join(name.split()).casefold()
+
+
+class Departures:
+    """One origin's departures, sorted by date"""
+    __slots__ = ("dates", "destinations", "trip_ids")
+
+    def __init__(self):
+        self.dates = array('i')
+        self.destinations = array('i')
+        self.trip_ids = array('q')
+
+    def add(self, day, destination, trip_id):
+        index = bisect_right(self.dates, day)
+        self.dates.insert(index, day)
+        self.destinations.insert(index, destination)
+        self.trip_ids.insert(index, trip_id)
+
+    def remove(self, day, trip_id):
+        index = bisect_left(self.dates, day)
+        while index < len(self.dates) and self.dates[index] == day:
+            if self.trip_ids[index] == trip_id:
+                del self.dates[index]
+                del self.destinations[index]
+                del self.trip_ids[index]
+                return
+            index += 1
+
+    def window(self, first_day, last_day):
+        """Slice bounds of the departures between the two days, inclusive"""
+        return bisect_left(self.dates, first_day), bisect_right(self.dates, last_day)
+
+
+class RouteGraph:
+    def __init__(self):
+        self.names = []  # location id -> name as first seen
+        self.ids = {}  # location key -> location id
+        self.trips = {}  # trip id -> (origin, destination, day, itinerary id)
+        self.itinerary_trips = defaultdict(set)
+        self.departures = defaultdict(Departures)
+        self.outbound = defaultdict(dict)  # origin -> {destination: trips}
+        self.inbound = defaultdict(dict)  # destination -> {origin: trips}
+        self.ready = False
+        self.built_at = None
+        self._top = None  # routes by trip count, rebuilt after changes
+        self.stats = {"loads": 0, "updates": 0, "load_ms": None}
+
+    def intern(self, name):
+        key = location_key(name)
+        location_id = self.ids.get(key)
+        if location_id is None:
+            location_id = self.ids[key] = len(self.names)
+            self.names.append(name.strip())
+        return location_id
+
+    def lookup(self, name):
+        """Location id for ``name``, or None if no trip touches it"""
+        return self.ids.get(location_key(name or ""))
+
+    def _count(self, origin, destination, delta):
+        count = self.outbound[origin].get(destination, 0) + delta
+        if count:
+            self.outbound[origin][destination] = count
+            self.inbound[destination][origin] = count
+        else:
+            self.outbound[origin].pop(destination, None)
+            self.inbound[destination].pop(origin, None)
+        self._top = None
+
+    def put_trip(self, trip_id, location_start, location_end, date_start, itinerary_id):
+        """Add or move a trip"""
+        self.remove_trip(trip_id)
+        origin, destination = self.intern(location_start), self.intern(location_end)
+        day = date.fromisoformat(str(date_start)).toordinal()
+        self.trips[trip_id] = (origin, destination, day, itinerary_id)
+        self.itinerary_trips[itinerary_id].add(trip_id)
+        self.departures[origin].add(day, destination, trip_id)
+        self._count(origin, destination, 1)
+
+    def remove_trip(self, trip_id):
+        trip = self.trips.pop(trip_id, None)
+        if trip is None:
+            return
+        origin, destination, day, itinerary_id = trip
+        self.itinerary_trips[itinerary_id].discard(trip_id)
+        if not self.itinerary_trips[itinerary_id]:
+            del self.itinerary_trips[itinerary_id]
+        self.departures[origin].remove(day, trip_id)
+        self._count(origin, destination, -1)
+
+    def remove_itinerary(self, itinerary_id):
+        for trip_id in list(self.itinerary_trips.get(itinerary_id, ())):
+            self.remove_trip(trip_id)
+
+    def popular(self, limit):
+        if self._top is None:
+            self._top = sorted(
+                (
+                    (-count, self.names[origin], self.names[destination])
+                    for origin, destinations in self.outbound.items()
+                    for destination, count in destinations.items()
+                )
+            )
+        return [
+            {"from": origin, "to": destination, "trips": -count}
+            for count, origin, destination in self._top[:limit]
+        ]
+
+    def connections(self, origin, first_day, last_day):
+        """Destinations reachable from ``origin`` by trips starting in the window"""
+        departures = self.departures.get(origin)
+        if departures is None:
+            return []
+        start, end = departures.window(first_day, last_day)
+        by_destination = {}
+        for index in range(start, end):
+            entry = by_destination.setdefault(departures.destinations[index], {
+                "to": self.names[departures.destinations[index]],
+                "trips": 0,
+                "first_departure": date.fromordinal(departures.dates[index]).isoformat(),
+                "trip_ids": []
+            })
+            entry["trips"] += 1
+            entry["trip_ids"].append(departures.trip_ids[index])
+        return sorted(by_destination.values(), key=lambda entry: (-entry["trips"], entry["to"]))
+
+    def _distances_to(self, target, max_legs):
+        """Legs from each location to ``target``, up to ``max_legs``"""
+        distances, frontier = {target: 0}, [target]
+        for legs in range(1, max_legs + 1):
+            next_frontier = []
+            for location in frontier:
+                for origin in self.inbound.get(location, ()):
+                    if origin not in distances:
+                        distances[origin] = legs
+                        next_frontier.append(origin)
+            frontier = next_frontier
+        return distances
+
+    def paths(self, origin, target, max_legs, limit):
+        """Up to ``limit`` simple paths from ``origin`` to ``target``, fewest legs first"""
+        distances = self._distances_to(target, max_legs)
+        if origin == target or origin not in distances:
+            return []
+        found = []
+        budget = [PATH_SEARCH_BUDGET]
+
+        def extend(path, legs_left):
+            location = path[-1]
+            if legs_left == 0:
+                found.append(list(path))
+                return
+            for destination in self.outbound.get(location, ()):
+                if budget[0] <= 0:
+                    return
+                budget[0] -= 1
+                # Follow only stops that can still reach the target in time,
+                # and reach the target only on the last leg
+                if (
+                    distances.get(destination, max_legs + 1) <= legs_left - 1
+                    and (destination != target or legs_left == 1)
+                    and destination not in path
+                ):
+                    path.append(destination)
+                    extend(path, legs_left - 1)
+                    path.pop()
+
+        # One leg count at a time, so the shortest paths are found first
+        for legs in range(distances[origin], max_legs + 1):
+            level = len(found)
+            extend([origin], legs)
+            # Within a leg count, prefer paths whose quietest leg is busiest
+            found[level:] = sorted(found[level:], key=lambda path: -min(
+                self.outbound[a][b] for a, b in zip(path, path[1:])
+            ))
+            if len(found) >= limit or budget[0] <= 0:
+                break
+        return [
+            {
+                "legs": len(path) - 1,
+                "route": [self.names[location] for location in path],
+                "trips_per_leg": [self.outbound[a][b] for a, b in zip(path, path[1:])]
+            }
+            for path in found[:limit]
+        ]
+
+    def apply(self, entries):
+        """Apply bus entries: [table, op, id, data]"""
+        self.stats["updates"] += len(entries)
+        for table, op, row_id, data in entries:
+            if table == "trips" and op == "delete":
+                self.remove_trip(row_id)
+            elif table == "trips":
+                self.put_trip(
+                    row_id, data["location_start"], data["location_end"],
+                    data["date_start"], data["itinerary_id"]
+                )
+            elif table == "itineraries":
+                self.remove_itinerary(row_id)
+
+    def summary(self):
+        return {
+            **self.stats,
+            "ready": self.ready,
+            "built_at": self.built_at,
+            "locations": len(self.names),
+            "routes": sum(len(destinations) for destinations in self.outbound.values()),
+            "trips": len(self.trips)
+        }
+
+
+async def _read_trips():
+    query = select(
+        Trip.id, Trip.location_start, Trip.location_end, Trip.date_start, Trip.itinerary_id
+    )
+    if shards.SHARDING:
+        async def read(session):
+            return (await session.execute(query)).all()
+        return [row for rows in await shards.gather(read) for row in rows]
+    async with get_session() as session:
+        return (await session.execute(query)).all()
+
+
+async def _build():
+    graph = RouteGraph()
+    for row in await _read_trips():
+        graph.put_trip(*row)
+    return graph
+
+
+replica = Replica(
+    "Route graph", "route_graph.changes", ("trips",), RouteGraph, _build,
+    ROUTE_GRAPH_RELOAD_SECONDS
+)
+start_route_graph = replica.start
+stop_route_graph = replica.stop
+
+
+def __getattr__(name):
+    # The graph is swapped on every load, so it's looked up at access time
+    if name == "graph":
+        return replica.current
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
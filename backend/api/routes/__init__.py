@@ -10,6 +10,12 @@ from .itineraries import itineraries_bp
 from .trips import trips_bp
 from .travel_agencies import agencies_bp
 from .lodgings import lodgings_bp   
+from .ws import ws_bp
+from .sync import sync_bp
+from .batch import batch_bp
+from .analytics import analytics_bp
+from .graph import graph_bp
+from .suggest import suggest_bp
 # Import other blueprints as you create them
 # from .auth import auth_bp
 # from .products import products_bp
@@ -22,5 +28,28 @@ api = Blueprint.group(
 	trips_bp,
     agencies_bp,
     lodgings_bp,
+    ws_bp,
+    sync_bp,
+    batch_bp,
+    analytics_bp,
+    graph_bp,
+    suggest_bp,
     url_prefix='/api'
-)
\ No newline at end of file
+)
+
+# Admission control (see api/admission.py): the concurrency pool each
+# blueprint's reads (GET/HEAD) and writes are admitted into. Blueprints not
+# listed here are not limited. Pool sizes come from ADMISSION_<POOL>_* env vars.
+ADMISSION_POOLS = {
+    users_bp.name: {"read": "reads", "write": "writes"},
+    lodgings_bp.name: {"read": "reads", "write": "writes"},
+    itineraries_bp.name: {"read": "reads", "write": "writes"},
+    trips_bp.name: {"read": "reads", "write": "writes"},
+    agencies_bp.name: {"read": "reads", "write": "writes"},
+    sync_bp.name: {"read": "reads", "write": "writes"},
+    batch_bp.name: {"read": "reads", "write": "writes"},
+    graph_bp.name: {"read": "reads", "write": "writes"},
+    suggest_bp.name: {"read": "reads", "write": "writes"},
+    # Reports run off the snapshot, but are heavy; keep them with exports
+    analytics_bp.name: {"read": "exports", "write": "exports"},
+}
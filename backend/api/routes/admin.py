@@ -0,0 +1,191 @@
+# backend/api/routes/admin.py
+from sanic import Blueprint, json, text
+import hmac
+import os
+import analytics
+import backups
+import compression
+import bus
+import maintenance
+import warmup
+import profiler
+import query_log
+from shared_cache import cache
+from api import admission, idempotency, single_flight
+from api.entity_cache import entity_cache
+from api.live import hub
+from api import route_graph, suggest
+
+# Operational endpoints; mounted at /admin, outside the /api group
+admin_bp = Blueprint('admin', url_prefix='/admin')
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+# Development only: serve /admin without a token when ADMIN_TOKEN isn't set
+ADMIN_OPEN = os.getenv('ADMIN_OPEN', '0') == '1'
+
+def has_admin_token(request):
+    """Whether ADMIN_TOKEN is set and the request carries it as a bearer token"""
+    return bool(ADMIN_TOKEN) and request.token is not None and hmac.compare_digest(
+        request.token.encode(), ADMIN_TOKEN.encode()
+    )
+
+def is_admin(request):
+    """Whether the request may use /admin: it has the token, or ADMIN_OPEN is on"""
+    return has_admin_token(request) or (ADMIN_OPEN and not ADMIN_TOKEN)
+
+@admin_bp.on_request
+async def require_admin_token(request):
+    """Require ADMIN_TOKEN as a bearer token; /admin is closed while it isn't set"""
+    if not is_admin(request):
+        if not ADMIN_TOKEN:
+            return json({"error": "Set ADMIN_TOKEN to use /admin"}, status=403)
+        return json({"error": "Unauthorized"}, status=401)
+
+@admin_bp.get("/metrics")
+async def get_metrics(request):
+    """Runtime metrics from the request-handling layers"""
+    return json({
+        "admission": admission.stats(),
+        "single_flight": single_flight.stats(),
+        "compression": compression.stats,
+        "shared_cache": cache.stats,
+        "entity_cache": entity_cache.summary(),
+        "bus": bus.stats,
+        "live": hub.summary(),
+        "profiler": profiler.stats,
+        "queries": query_log.stats,
+        "analytics": analytics.summary(),
+        "route_graph": route_graph.graph.summary(),
+        "suggest": suggest.suggestions.summary(),
+        "maintenance": maintenance.summary(),
+        "backups": backups.summary(),
+        "warmup": warmup.summary(),
+        "idempotency": idempotency.stats
+    })
+
+QUERY_SORTS = ("total", "max", "p95", "count")
+
+@admin_bp.get("/queries/top")
+async def get_top_queries(request):
+    """Query fingerprints ranked by total (or ?sort=max|p95|count) time"""
+    sort = request.args.get('sort', 'total')
+    if sort not in QUERY_SORTS:
+        return json({"error": f"sort must be one of {', '.join(QUERY_SORTS)}"}, status=400)
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return json({"error": "limit must be an integer"}, status=400)
+    return json({
+        "data": query_log.top(limit, sort),
+        "_meta": {
+            "pid": os.getpid(),
+            "sort": sort,
+            "slow_query_ms": query_log.SLOW_QUERY_MS,
+            **query_log.stats
+        },
+        "_links": {
+            "self": f"/admin/queries/top?sort={sort}&limit={limit}",
+            "slow": "/admin/queries/slow"
+        }
+    })
+
+@admin_bp.get("/queries/slow")
+async def get_slow_queries(request):
+    """Most recent statements over SLOW_QUERY_MS, newest first"""
+    return json({"data": list(reversed(query_log.slow_queries))})
+
+@admin_bp.delete("/queries")
+async def reset_queries(request):
+    """Start the query statistics over"""
+    query_log.reset()
+    return json({"message": "Query statistics reset"})
+
+@admin_bp.get("/profiles")
+async def get_profiles(request):
+    """Saved X-Profile request profiles, newest first"""
+    return json({
+        "data": [
+            {**profile, "_links": {"self": f"/admin/profiles/{profile['id']}"}}
+            for profile in profiler.list_profiles()
+        ]
+    })
+
+@admin_bp.get("/profiles/routes")
+async def get_route_profiles(request):
+    """This worker's background samples per route; ?format=collapsed&route= for flamegraph.pl"""
+    route = request.args.get('route')
+    if request.args.get('format') == 'collapsed':
+        if not route:
+            return json({"error": "route is required for the collapsed format"}, status=400)
+        return text(profiler.collapsed(route))
+    try:
+        top = int(request.args.get('top', 20))
+    except ValueError:
+        return json({"error": "top must be an integer"}, status=400)
+    return json({
+        "pid": os.getpid(),
+        "interval": profiler.PROFILE_SAMPLE_INTERVAL,
+        "routes": profiler.route_summary(route, top=top)
+    })
+
+@admin_bp.get("/profiles/<profile_id>")
+async def get_profile(request, profile_id):
+    """One request profile as a speedscope file"""
+    profile = profiler.load_profile(profile_id)
+    if profile is None:
+        return json({"error": "Profile not found"}, status=404)
+    return json(profile, headers={
+        "Content-Disposition": f'attachment; filename="{profile_id}.speedscope.json"'
+    })
+
+@admin_bp.post("/analytics/refresh")
+async def refresh_analytics(request):
+    """Rebuild this worker's analytics snapshot now"""
+    if not analytics.available():
+        return json({"error": analytics.unavailable_reason()}, status=503)
+    if not await analytics.refresh():
+        return json({"error": "Failed to build the analytics snapshot"}, status=500)
+    return json({"data": analytics.summary()})
+
+@admin_bp.get("/maintenance")
+async def get_maintenance(request):
+    """Schedules and last runs of the SQLite maintenance jobs"""
+    return json({
+        "data": maintenance.summary(),
+        "_links": {
+            "self": "/admin/maintenance",
+            "run": "/admin/maintenance/{job}"
+        }
+    })
+
+@admin_bp.post("/maintenance/<job>")
+async def run_maintenance(request, job):
+    """Run one maintenance job now"""
+    if job not in maintenance.JOBS:
+        return json({"error": f"job must be one of {', '.join(maintenance.JOBS)}"}, status=400)
+    if not maintenance.running():
+        return json({"error": "Maintenance is disabled (MAINTENANCE=0)"}, status=503)
+    results = await maintenance.run(job)
+    if results is None:
+        return json({"error": f"Maintenance job {job} failed"}, status=500)
+    return json({"data": maintenance.stats[job]})
+
+@admin_bp.get("/backups")
+async def get_backups(request):
+    """Finished backups, newest first"""
+    return json({
+        "data": backups.list_backups(),
+        "_meta": backups.summary(),
+        "_links": {"self": "/admin/backups"}
+    })
+
+@admin_bp.post("/backups")
+async def create_backup(request):
+    """Take an online backup of every database now"""
+    try:
+        manifest = await backups.run()
+    except Exception:
+        return json({"error": "Backup failed"}, status=500)
+    if manifest is None:
+        return json({"error": "A backup is already in progress"}, status=409)
+    return json({"data": manifest}, status=201)
@@ -0,0 +1,148 @@
+# backend/api/routes/analytics.py
+from sanic import Blueprint, json
+from datetime import datetime
+import analytics
+
+# Management reports, served from the columnar snapshot in analytics.py
+# rather than the live database
+analytics_bp = Blueprint('analytics', url_prefix='/analytics')
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 1000
+
+REPORTS = {
+    "trip_modes": "/api/analytics/trips/modes",
+    "trip_routes": "/api/analytics/trips/routes",
+    "itinerary_lengths": "/api/analytics/itineraries/lengths",
+    "lodging_nights": "/api/analytics/lodgings/nights",
+}
+
+# Itineraries of one agency, for the ?agency_id= filter
+AGENCY_ITINERARIES = (
+    "SELECT itineraries.id FROM itineraries "
+    "JOIN users ON users.id = itineraries.user_id WHERE users.travel_agency_id = ?"
+)
+
+class InvalidFilter(ValueError):
+    pass
+
+def parse_filters(request, itinerary_column="itinerary_id"):
+    """WHERE clause and parameters for ?from=, ?to= and ?agency_id="""
+    conditions, parameters = [], []
+    try:
+        if request.args.get('from'):
+            conditions.append("date_start >= ?")
+            parameters.append(datetime.strptime(request.args.get('from'), '%Y-%m-%d').date())
+        if request.args.get('to'):
+            conditions.append("date_start <= ?")
+            parameters.append(datetime.strptime(request.args.get('to'), '%Y-%m-%d').date())
+    except ValueError:
+        raise InvalidFilter("from and to must be dates (YYYY-MM-DD)")
+    if request.args.get('agency_id'):
+        if not request.args.get('agency_id').isdigit():
+            raise InvalidFilter("agency_id must be an integer")
+        conditions.append(f"{itinerary_column} IN ({AGENCY_ITINERARIES})")
+        parameters.append(int(request.args.get('agency_id')))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, parameters
+
+async def report(request, sql, parameters):
+    """Run a report and wrap its rows in the usual envelope"""
+    result = await analytics.run(sql, parameters)
+    if result is None:
+        return json({"error": analytics.unavailable_reason()}, status=503,
+                    headers={"Retry-After": "5"})
+    rows, meta = result
+    return json({
+        "data": rows,
+        "_meta": {**meta, "filters": dict(request.args)},
+        "_links": {
+            "self": request.path + (f"?{request.query_string}" if request.query_string else ""),
+            "collection": "/api/analytics"
+        }
+    })
+
+@analytics_bp.get("/")
+async def get_reports(request):
+    """Available reports and the state of the snapshot"""
+    return json({
+        "data": analytics.summary(),
+        "_links": {"self": "/api/analytics", **REPORTS}
+    })
+
+@analytics_bp.get("/trips/modes")
+async def trip_modes(request):
+    """Trips per mode per month"""
+    try:
+        where, parameters = parse_filters(request)
+    except InvalidFilter as e:
+        return json({"error": str(e)}, status=400)
+    return await report(request, f"""
+        SELECT strftime(date_trunc('month', date_start), '%Y-%m') AS month,
+               coalesce(mode, 'unknown') AS mode,
+               count(*) AS trips
+        FROM trips {where}
+        GROUP BY ALL
+        ORDER BY month, trips DESC, mode
+    """, parameters)
+
+@analytics_bp.get("/trips/routes")
+async def trip_routes(request):
+    """Busiest location_start -> location_end pairs"""
+    try:
+        where, parameters = parse_filters(request)
+        limit = min(int(request.args.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+    except InvalidFilter as e:
+        return json({"error": str(e)}, status=400)
+    except ValueError:
+        return json({"error": "limit must be an integer"}, status=400)
+    return await report(request, f"""
+        SELECT location_start, location_end,
+               count(*) AS trips,
+               count(DISTINCT itinerary_id) AS itineraries
+        FROM trips {where}
+        GROUP BY ALL
+        ORDER BY trips DESC, location_start, location_end
+        LIMIT ?
+    """, parameters + [max(limit, 1)])
+
+@analytics_bp.get("/itineraries/lengths")
+async def itinerary_lengths(request):
+    """Itinerary lengths in days, per agency"""
+    try:
+        where, parameters = parse_filters(request, itinerary_column="id")
+    except InvalidFilter as e:
+        return json({"error": str(e)}, status=400)
+    return await report(request, f"""
+        SELECT travel_agencies.id AS agency_id,
+               travel_agencies.name AS agency_name,
+               count(lengths.id) AS itineraries,
+               round(avg(lengths.days), 2) AS avg_days,
+               median(lengths.days) AS median_days,
+               min(lengths.days) AS min_days,
+               max(lengths.days) AS max_days
+        FROM (
+            SELECT id, user_id, date_diff('day', date_start, date_end) + 1 AS days
+            FROM itineraries {where}
+        ) AS lengths
+        JOIN users ON users.id = lengths.user_id
+        JOIN travel_agencies ON travel_agencies.id = users.travel_agency_id
+        GROUP BY ALL
+        ORDER BY itineraries DESC, agency_id
+    """, parameters)
+
+@analytics_bp.get("/lodgings/nights")
+async def lodging_nights(request):
+    """Room-nights booked per month"""
+    try:
+        where, parameters = parse_filters(request)
+    except InvalidFilter as e:
+        return json({"error": str(e)}, status=400)
+    return await report(request, f"""
+        SELECT strftime(date_trunc('month', date_start), '%Y-%m') AS month,
+               count(*) AS stays,
+               sum(date_diff('day', date_start, date_end) * coalesce(room_count, 1)) AS room_nights
+        FROM lodgings {where}
+        GROUP BY ALL
+        ORDER BY month
+    """, parameters)
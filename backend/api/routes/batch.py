@@ -0,0 +1,99 @@
+# backend/api/routes/batch.py
+from sanic import Blueprint, json
+from sanic.compat import Header
+from sanic.exceptions import SanicException
+from sanic.request import Request
+import json as jsonlib
+import logging
+import os
+from database import separate_sessions, shared_read_session, using_sessions
+import shards
+
+logger = logging.getLogger(__name__)
+
+# Several API calls in one round trip. Sub-requests go straight to the
+# route handlers; admission control and the other middleware apply to
+# the batch request as a whole.
+batch_bp = Blueprint('batch', url_prefix='/_batch')
+
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', 20))
+BATCH_METHODS = ("GET", "POST", "PUT", "DELETE")
+
+def build_request(request, method, path, body):
+    """A Request for ``path`` carrying the batch request's headers"""
+    headers = Header(request.headers)
+    headers["content-type"] = "application/json"
+    # The batch's key would otherwise be shared by every sub-request
+    headers.pop("idempotency-key", None)
+    sub = Request(path.encode(), headers, request.version, method,
+                  request.transport, request.app)
+    sub.body = jsonlib.dumps(body).encode() if body is not None else b""
+    return sub
+
+async def run_one(request, item):
+    """Dispatch one sub-request, returning (status, body)"""
+    method = str(item.get("method", "GET")).upper()
+    path = item.get("path")
+    if not isinstance(path, str) or not path.startswith("/api/"):
+        return 400, {"error": "path must start with /api/"}
+    if method not in BATCH_METHODS:
+        return 405, {"error": f"Method must be one of {', '.join(BATCH_METHODS)}"}
+
+    sub = build_request(request, method, path, item.get("body"))
+    try:
+        route, handler, kwargs = request.app.router.get(sub.path, method, None)
+        if (
+            route.extra.websocket
+            or getattr(route.ctx, 'streaming', False)
+            or route.name == request.route.name
+        ):
+            return 400, {"error": "Route can't be used in a batch"}
+        sub._match_info = {**kwargs}
+        sub.route = route
+        # Sharded: each sub-request goes to its own agency's database
+        factory = await shards.route(sub, kwargs) if shards.SHARDING else None
+        with using_sessions(factory):
+            response = await handler(sub, **kwargs)
+    except SanicException as e:
+        return e.status_code, {"error": str(e)}
+    except Exception as e:
+        logger.error(f"Error in batch sub-request {method} {path}: {e}")
+        return 500, {"error": "Sub-request failed"}
+
+    body = response.body or b""
+    if response.content_type and "json" in response.content_type and body:
+        return response.status, jsonlib.loads(body)
+    return response.status, body.decode(errors="replace") or None
+
+@batch_bp.post("/")
+async def batch(request):
+    """Run up to BATCH_MAX_REQUESTS sub-requests in order, reads sharing one session"""
+    items = (request.json or {}).get("requests") if isinstance(request.json, dict) else None
+    if not isinstance(items, list) or not items:
+        return json({"error": "Body must be {\"requests\": [...]}"}, status=400)
+    if len(items) > BATCH_MAX_REQUESTS:
+        return json({
+            "error": f"At most {BATCH_MAX_REQUESTS} requests per batch"
+        }, status=400)
+
+    results = []
+    async with shared_read_session() as session:
+        for item in items:
+            if not isinstance(item, dict):
+                results.append({"status": 400, "body": {"error": "Each request must be an object"}})
+                continue
+            if str(item.get("method", "GET")).upper() == "GET":
+                status, body = await run_one(request, item)
+            else:
+                # Writes commit in their own session; the reads that follow
+                # must not see the shared session's stale copies
+                with separate_sessions():
+                    status, body = await run_one(request, item)
+                session.expire_all()
+            results.append({"status": status, "body": body})
+
+    return json({
+        "data": results,
+        "_meta": {"count": len(results)},
+        "_links": {"self": "/api/_batch"}
+    })
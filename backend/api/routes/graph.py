@@ -0,0 +1,105 @@
+# backend/api/routes/graph.py
+from sanic import Blueprint, json
+from datetime import date, datetime
+from api import route_graph
+
+# Route queries answered from the in-memory graph in api/route_graph.py
+graph_bp = Blueprint('graph', url_prefix='/graph')
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+DEFAULT_MAX_LEGS = 3
+MAX_LEGS = 4
+
+def not_ready():
+    return json({"error": "The route graph is still loading"}, status=503,
+                headers={"Retry-After": "1"})
+
+def parse_day(value, default):
+    """Date argument as a day ordinal"""
+    if not value:
+        return default.toordinal()
+    return datetime.strptime(value, '%Y-%m-%d').date().toordinal()
+
+def parse_limit(request, name, default, maximum):
+    return max(1, min(int(request.args.get(name, default)), maximum))
+
+@graph_bp.get("/")
+async def get_graph(request):
+    """Size and freshness of the route graph"""
+    return json({
+        "data": route_graph.graph.summary(),
+        "_links": {
+            "self": "/api/graph",
+            "popular": "/api/graph/popular",
+            "connections": "/api/graph/connections?location={location}",
+            "paths": "/api/graph/paths?from={location}&to={location}"
+        }
+    })
+
+@graph_bp.get("/popular")
+async def get_popular_routes(request):
+    """The ``limit`` routes with the most trips"""
+    graph = route_graph.graph
+    if not graph.ready:
+        return not_ready()
+    try:
+        limit = parse_limit(request, 'limit', DEFAULT_LIMIT, MAX_LIMIT)
+    except ValueError:
+        return json({"error": "limit must be an integer"}, status=400)
+    return json({
+        "data": graph.popular(limit),
+        "_links": {"self": f"/api/graph/popular?limit={limit}"}
+    })
+
+@graph_bp.get("/connections")
+async def get_connections(request):
+    """Where trips leaving ``location`` between start_date and end_date go"""
+    graph = route_graph.graph
+    if not graph.ready:
+        return not_ready()
+    location = request.args.get('location')
+    if not location:
+        return json({"error": "location is required"}, status=400)
+    try:
+        first_day = parse_day(request.args.get('start_date'), date.min)
+        last_day = parse_day(request.args.get('end_date'), date.max)
+    except ValueError:
+        return json({"error": "Invalid date format. Use YYYY-MM-DD"}, status=400)
+
+    origin = graph.lookup(location)
+    if origin is None:
+        return json({"error": "No trips start or end at this location"}, status=404)
+    return json({
+        "data": graph.connections(origin, first_day, last_day),
+        "_meta": {"location": graph.names[origin]},
+        "_links": {"self": request.path + f"?{request.query_string}"}
+    })
+
+@graph_bp.get("/paths")
+async def get_paths(request):
+    """Routes of up to max_legs trips from ``from`` to ``to``, fewest legs first"""
+    graph = route_graph.graph
+    if not graph.ready:
+        return not_ready()
+    if not request.args.get('from') or not request.args.get('to'):
+        return json({"error": "from and to are required"}, status=400)
+    try:
+        max_legs = parse_limit(request, 'max_legs', DEFAULT_MAX_LEGS, MAX_LEGS)
+        limit = parse_limit(request, 'limit', DEFAULT_LIMIT, MAX_LIMIT)
+    except ValueError:
+        return json({"error": "max_legs and limit must be integers"}, status=400)
+
+    origin = graph.lookup(request.args.get('from'))
+    target = graph.lookup(request.args.get('to'))
+    if origin is None or target is None:
+        return json({"error": "No trips start or end at this location"}, status=404)
+    return json({
+        "data": graph.paths(origin, target, max_legs, limit),
+        "_meta": {
+            "from": graph.names[origin],
+            "to": graph.names[target],
+            "max_legs": max_legs
+        },
+        "_links": {"self": request.path + f"?{request.query_string}"}
+    })
@@ -1,69 +1,118 @@
 # backend/api/routes/itineraries.py
 from sanic import Blueprint, json
-from sqlalchemy import func, select
+from sqlalchemy import delete, func, select
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 from database import get_session
-from api.models.models import Itinerary
+import changes
+from api.idempotency import idempotent
+from api.exports import InvalidFormat, export, parse_format
+from api.includes import InvalidInclude, link_suffix, load_options, parse_include
+from api.multi_get import InvalidIds, get_many, parse_ids
+from api.response_cache import cached
+from api.single_flight import single_flight
+from api.models.models import READ_ONLY_COLUMNS, Itinerary
+import shards
 
 itineraries_bp = Blueprint('itineraries', url_prefix='/itineraries')
 
+# Relationships the list endpoint can expand with ?include=
+INCLUDES = ("trips", "lodgings", "user")
+
 def parse_date(date_str):
     """Convert string to date object"""
     return datetime.strptime(date_str, '%Y-%m-%d').date()
 
+def apply_filters(query, args):
+    """``query`` narrowed by the list filters in ``args`` (shared with the export)"""
+    tour_name = args.get('tour_name')
+    start_date = args.get('start_date')
+    
+    if tour_name:
+        query = query.filter(Itinerary.tour_name.ilike(f"%{tour_name}%"))
+    if start_date:
+        query = query.filter(Itinerary.date_start >= parse_date(start_date))
+    return query
+
 @itineraries_bp.get("/")
+@cached("itineraries")
+@single_flight
 async def get_itineraries(request):
     """Get all itineraries with pagination and filtering"""
+    try:
+        ids = parse_ids(request)
+        include = parse_include(request, INCLUDES)
+    except (InvalidIds, InvalidInclude) as e:
+        return json({"error": str(e)}, status=400)
+    to_dict_kwargs = {
+        "include_relationships": "trips" in include or "lodgings" in include,
+        "include_user": "user" in include
+    }
+
     # Parse query parameters
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 10))
-    tour_name = request.args.get('tour_name')
-    start_date = request.args.get('start_date')
     
     async with get_session() as session:
+        if ids is not None:
+            # ?ids=1,2,3 fetches exactly those rows in one IN query
+            return await get_many(
+                session, Itinerary, ids, "itineraries",
+                options=load_options(Itinerary, include), **to_dict_kwargs
+            )
+
         # Build base query
-        query = select(Itinerary)
-        count_query = select(func.count(Itinerary.id))
-        
-        # Apply filters if provided
-        if tour_name:
-            query = query.filter(Itinerary.tour_name.ilike(f"%{tour_name}%"))
-            count_query = count_query.filter(Itinerary.tour_name.ilike(f"%{tour_name}%"))
-        if start_date:
-            date_obj = parse_date(start_date)
-            query = query.filter(Itinerary.date_start >= date_obj)
-            count_query = count_query.filter(Itinerary.date_start >= date_obj)
-        
-        # Get total count
-        total_result = await session.execute(count_query)
-        total = total_result.scalar()
+        query = apply_filters(select(Itinerary), request.args)
+        count_query = apply_filters(select(func.count(Itinerary.id)), request.args)
         
-        # Apply pagination
-        query = query.offset((page - 1) * per_page).limit(per_page)
+        # One batched IN query per included relationship
+        query = query.options(*load_options(Itinerary, include))
         
-        # Execute query
-        result = await session.execute(query)
-        itineraries = result.scalars().all()
+        if shards.SHARDING:
+            # Each agency's itineraries are in their own database
+            total, itineraries = await shards.fetch_page(Itinerary, query, count_query, page, per_page)
+        else:
+            # Get total count
+            total_result = await session.execute(count_query)
+            total = total_result.scalar()
+            
+            # Apply pagination
+            query = query.offset((page - 1) * per_page).limit(per_page)
+            
+            # Execute query
+            result = await session.execute(query)
+            itineraries = result.scalars().all()
         
         # Build response with HATEOAS links
         response = {
-            "data": [itinerary.to_dict() for itinerary in itineraries],
+            "data": [itinerary.to_dict(**to_dict_kwargs) for itinerary in itineraries],
             "_meta": {
                 "page": page,
                 "per_page": per_page,
                 "total": total
             },
             "_links": {
-                "self": f"/api/itineraries?page={page}&per_page={per_page}",
-                "next": f"/api/itineraries?page={page+1}&per_page={per_page}" 
+                "self": f"/api/itineraries?page={page}&per_page={per_page}{link_suffix(include)}",
+                "next": f"/api/itineraries?page={page+1}&per_page={per_page}{link_suffix(include)}" 
                        if page * per_page < total else None,
-                "prev": f"/api/itineraries?page={page-1}&per_page={per_page}" 
+                "prev": f"/api/itineraries?page={page-1}&per_page={per_page}{link_suffix(include)}" 
                        if page > 1 else None
             }
         }
         return json(response)
 
+@itineraries_bp.get("/export", ctx_admission_pool="exports", ctx_streaming=True)
+async def export_itineraries(request):
+    """Every itinerary matching the list filters, as ?format=parquet or arrow"""
+    try:
+        export_format = parse_format(request)
+        query = apply_filters(select(Itinerary), request.args)
+    except InvalidFormat as e:
+        return json({"error": str(e)}, status=400)
+    except ValueError:
+        return json({"error": "Invalid filter value"}, status=400)
+    return await export(request, Itinerary, query, export_format, "itineraries")
+
 @itineraries_bp.get("/<itinerary_id:int>")
 async def get_itinerary(request, itinerary_id):
     """Get a specific itinerary"""
@@ -97,6 +146,7 @@ async def get_itinerary(request, itinerary_id):
         return json(response)
 
 @itineraries_bp.post("/")
+@idempotent
 async def create_itinerary(request):
     """Create a new itinerary"""
     data = request.json
@@ -163,7 +213,7 @@ async def update_itinerary(request, itinerary_id):
             
             # Update fields
             for key, value in data.items():
-                if hasattr(itinerary, key):
+                if hasattr(itinerary, key) and key not in READ_ONLY_COLUMNS:
                     setattr(itinerary, key, value)
             
             # Validate date range
@@ -187,15 +237,21 @@ async def update_itinerary(request, itinerary_id):
 async def delete_itinerary(request, itinerary_id):
     """Delete an itinerary"""
     async with get_session() as session:
+        # Trips and lodgings go with it via ON DELETE CASCADE
         result = await session.execute(
-            select(Itinerary).filter(Itinerary.id == itinerary_id)
+            delete(Itinerary)
+            .filter(Itinerary.id == itinerary_id)
+            .returning(Itinerary.user_id)
         )
-        itinerary = result.scalar_one_or_none()
+        user_id = result.scalar_one_or_none()
         
-        if not itinerary:
+        if user_id is None:
             return json({"error": "Itinerary not found"}, status=404)
         
-        await session.delete(itinerary)
+        changes.record(session, "itineraries", "delete", itinerary_id, {
+            "id": itinerary_id,
+            "user_id": user_id
+        })
         await session.commit()
         # 204 No Content for successful deletion
         return json({}, status=204)
\ No newline at end of file
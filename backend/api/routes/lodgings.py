@@ -4,70 +4,115 @@ from sqlalchemy import func, select
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 from database import get_session
-from api.models.models import Lodging
+from api.idempotency import idempotent
+from api.exports import InvalidFormat, export, parse_format
+from api.includes import InvalidInclude, link_suffix, load_options, parse_include
+from api.multi_get import InvalidIds, get_many, parse_ids
+from api.response_cache import cached
+from api.single_flight import single_flight
+from api.models.models import READ_ONLY_COLUMNS, Lodging
+import shards
+import write_coalescer
 
 lodgings_bp = Blueprint('lodgings', url_prefix='/lodgings')
 
+# Relationships the list endpoint can expand with ?include=
+INCLUDES = ("itinerary",)
+
 def parse_date(date_str):
     """Convert string to date object"""
     return datetime.strptime(date_str, '%Y-%m-%d').date()
 
+def apply_filters(query, args):
+    """``query`` narrowed by the list filters in ``args`` (shared with the export)"""
+    name = args.get('name')
+    start_date = args.get('start_date')
+    min_rooms = args.get('min_rooms')
+    
+    if name:
+        query = query.filter(Lodging.name.ilike(f"%{name}%"))
+    if start_date:
+        query = query.filter(Lodging.date_start >= parse_date(start_date))
+    if min_rooms:
+        query = query.filter(Lodging.room_count >= int(min_rooms))
+    return query
+
 @lodgings_bp.get("/")
+@cached("lodgings")
+@single_flight
 async def get_lodgings(request):
     """Get all lodgings with pagination and filtering"""
+    try:
+        ids = parse_ids(request)
+        include = parse_include(request, INCLUDES)
+    except (InvalidIds, InvalidInclude) as e:
+        return json({"error": str(e)}, status=400)
+    to_dict_kwargs = {"include_itinerary": "itinerary" in include}
+
     # Parse query parameters
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 10))
-    name = request.args.get('name')
-    start_date = request.args.get('start_date')
-    min_rooms = request.args.get('min_rooms')
     
     async with get_session() as session:
+        if ids is not None:
+            # ?ids=1,2,3 fetches exactly those rows in one IN query
+            return await get_many(
+                session, Lodging, ids, "lodgings",
+                options=load_options(Lodging, include), **to_dict_kwargs
+            )
+
         # Build base query
-        query = select(Lodging)
-        count_query = select(func.count(Lodging.id))
-        
-        # Apply filters if provided
-        if name:
-            query = query.filter(Lodging.name.ilike(f"%{name}%"))
-            count_query = count_query.filter(Lodging.name.ilike(f"%{name}%"))
-        if start_date:
-            date_obj = parse_date(start_date)
-            query = query.filter(Lodging.date_start >= date_obj)
-            count_query = count_query.filter(Lodging.date_start >= date_obj)
-        if min_rooms:
-            query = query.filter(Lodging.room_count >= int(min_rooms))
-            count_query = count_query.filter(Lodging.room_count >= int(min_rooms))
+        query = apply_filters(select(Lodging), request.args)
+        count_query = apply_filters(select(func.count(Lodging.id)), request.args)
         
-        # Get total count
-        total_result = await session.execute(count_query)
-        total = total_result.scalar()
+        # One batched IN query per included relationship
+        query = query.options(*load_options(Lodging, include))
         
-        # Apply pagination
-        query = query.offset((page - 1) * per_page).limit(per_page)
-        
-        # Execute query
-        result = await session.execute(query)
-        lodgings = result.scalars().all()
+        if shards.SHARDING:
+            # Each agency's lodgings are in their own database
+            total, lodgings = await shards.fetch_page(Lodging, query, count_query, page, per_page)
+        else:
+            # Get total count
+            total_result = await session.execute(count_query)
+            total = total_result.scalar()
+            
+            # Apply pagination
+            query = query.offset((page - 1) * per_page).limit(per_page)
+            
+            # Execute query
+            result = await session.execute(query)
+            lodgings = result.scalars().all()
         
         # Build response with HATEOAS links
         response = {
-            "data": [lodging.to_dict() for lodging in lodgings],
+            "data": [lodging.to_dict(**to_dict_kwargs) for lodging in lodgings],
             "_meta": {
                 "page": page,
                 "per_page": per_page,
                 "total": total
             },
             "_links": {
-                "self": f"/api/lodgings?page={page}&per_page={per_page}",
-                "next": f"/api/lodgings?page={page+1}&per_page={per_page}" 
+                "self": f"/api/lodgings?page={page}&per_page={per_page}{link_suffix(include)}",
+                "next": f"/api/lodgings?page={page+1}&per_page={per_page}{link_suffix(include)}" 
                        if page * per_page < total else None,
-                "prev": f"/api/lodgings?page={page-1}&per_page={per_page}" 
+                "prev": f"/api/lodgings?page={page-1}&per_page={per_page}{link_suffix(include)}" 
                        if page > 1 else None
             }
         }
         return json(response)
 
+@lodgings_bp.get("/export", ctx_admission_pool="exports", ctx_streaming=True)
+async def export_lodgings(request):
+    """Every lodging matching the list filters, as ?format=parquet or arrow"""
+    try:
+        export_format = parse_format(request)
+        query = apply_filters(select(Lodging), request.args)
+    except InvalidFormat as e:
+        return json({"error": str(e)}, status=400)
+    except ValueError:
+        return json({"error": "Invalid filter value"}, status=400)
+    return await export(request, Lodging, query, export_format, "lodgings")
+
 @lodgings_bp.get("/<lodging_id:int>")
 async def get_lodging(request, lodging_id):
     """Get a specific lodging"""
@@ -99,6 +144,7 @@ async def get_lodging(request, lodging_id):
         return json(response)
 
 @lodgings_bp.post("/")
+@idempotent
 async def create_lodging(request):
     """Create a new lodging"""
     data = request.json
@@ -128,22 +174,20 @@ async def create_lodging(request):
                 "error": "Room count must be at least 1"
             }, status=400)
         
-        async with get_session() as session:
-            lodging = Lodging(**data)
-            session.add(lodging)
-            await session.commit()
-            
-            response = {
-                "data": lodging.to_dict(),
-                "_links": {
-                    "self": f"/api/lodgings/{lodging.id}",
-                    "collection": "/api/lodgings"
-                }
+        # Batched with other concurrent writes when coalescing is enabled
+        lodging = await write_coalescer.insert(Lodging(**data))
+        
+        response = {
+            "data": lodging.to_dict(),
+            "_links": {
+                "self": f"/api/lodgings/{lodging.id}",
+                "collection": "/api/lodgings"
             }
-            # 201 Created for successful resource creation
-            return json(response, status=201, headers={
-                'Location': f"/api/lodgings/{lodging.id}"
-            })
+        }
+        # 201 Created for successful resource creation
+        return json(response, status=201, headers={
+            'Location': f"/api/lodgings/{lodging.id}"
+        })
     except ValueError as e:
         return json({"error": "Invalid date format. Use YYYY-MM-DD"}, status=400)
     except Exception as e:
@@ -177,7 +221,7 @@ async def update_lodging(request, lodging_id):
             
             # Update fields
             for key, value in data.items():
-                if hasattr(lodging, key):
+                if hasattr(lodging, key) and key not in READ_ONLY_COLUMNS:
                     setattr(lodging, key, value)
             
             # Validate date range
@@ -186,7 +230,14 @@ async def update_lodging(request, lodging_id):
                     "error": "Start date must be before end date"
                 }, status=400)
             
-            await session.commit()
+            if write_coalescer.enabled():
+                # Leave this session uncommitted; the change goes out in the next batch
+                await write_coalescer.update_by_id(Lodging, lodging.id, {
+                    key: value for key, value in data.items()
+                    if key in Lodging.__table__.columns.keys() and key not in READ_ONLY_COLUMNS
+                })
+            else:
+                await session.commit()
             return json({
                 "data": lodging.to_dict(),
                 "_links": {
@@ -194,6 +245,9 @@ async def update_lodging(request, lodging_id):
                     "collection": "/api/lodgings"
                 }
             })
+        except write_coalescer.RowNotFound:
+            # Deleted after it was read above
+            return json({"error": "Lodging not found"}, status=404)
         except ValueError as e:
             return json({"error": "Invalid date format. Use YYYY-MM-DD"}, status=400)
 
@@ -0,0 +1,40 @@
+# backend/api/routes/suggest.py
+from sanic import Blueprint, json
+from api import suggest
+
+# Autocomplete for the trip and lodging forms, from the prefix indexes in
+# api/suggest.py instead of ilike scans of the trips table
+suggest_bp = Blueprint('suggest', url_prefix='/suggest')
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+async def suggestions_for(request, index):
+    indexes = suggest.suggestions
+    if not indexes.ready:
+        return json({"error": "Suggestions are still loading"}, status=503,
+                    headers={"Retry-After": "1"})
+    prefix = request.args.get('prefix', '')
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+    except ValueError:
+        return json({"error": "limit must be an integer"}, status=400)
+    return json({
+        "data": indexes.indexes[index].suggest(prefix, limit),
+        "_meta": {"prefix": prefix, "limit": limit}
+    })
+
+@suggest_bp.get("/locations")
+async def suggest_locations(request):
+    """Trip start and end locations beginning with ``prefix``, most used first"""
+    return await suggestions_for(request, "locations")
+
+@suggest_bp.get("/transporters")
+async def suggest_transporters(request):
+    """Transporters beginning with ``prefix``, most used first"""
+    return await suggestions_for(request, "transporters")
+
+@suggest_bp.get("/lodgings")
+async def suggest_lodgings(request):
+    """Lodging names beginning with ``prefix``, most used first"""
+    return await suggestions_for(request, "lodgings")
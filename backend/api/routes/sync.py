@@ -0,0 +1,97 @@
+# backend/api/routes/sync.py
+from sanic import Blueprint, json
+from sqlalchemy import select
+import heapq
+import logging
+from database import get_session
+import shards
+from api.models.models import Itinerary, Trip, Lodging, SyncState, SyncTombstone
+
+logger = logging.getLogger(__name__)
+
+# Incremental sync: clients pass the cursor from their last response and
+# get back only the rows changed or deleted since then, in version order
+sync_bp = Blueprint('sync', url_prefix='/sync')
+
+SYNC_MODELS = (Itinerary, Trip, Lodging)
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+def upsert_entry(row):
+    return (row.version, {
+        "version": row.version,
+        "table": row.__tablename__,
+        "op": "upsert",
+        "id": row.id,
+        "data": row.to_dict()
+    })
+
+def delete_entry(tombstone):
+    return (tombstone.version, {**tombstone.to_dict(), "op": "delete"})
+
+@sync_bp.get("/")
+async def sync(request):
+    """Rows changed since ``since``, oldest first, at most ``limit`` of them"""
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(int(request.args.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+    except ValueError:
+        return json({"error": "since and limit must be integers"}, status=400)
+    if since < 0 or limit < 1:
+        return json({"error": "since must be >= 0 and limit >= 1"}, status=400)
+    if shards.SHARDING and not request.args.get('agency_id', '').isdigit():
+        # Versions are per database, so a cursor only means something per shard
+        return json({"error": "agency_id is required when sharding"}, status=400)
+
+    async with get_session() as session:
+        try:
+            # Everything up to this version is committed. Bounding the scans
+            # by it keeps the page consistent while writes carry on; rows
+            # updated past it show up again on the next call.
+            result = await session.execute(
+                select(SyncState.version).filter(SyncState.id == 1)
+            )
+            current = result.scalar_one()
+
+            entries = []
+            if since < current:
+                # One index range scan per table, each already in version order
+                streams = []
+                for model in SYNC_MODELS:
+                    result = await session.execute(
+                        select(model)
+                        .filter(model.version > since, model.version <= current)
+                        .order_by(model.version)
+                        .limit(limit + 1)
+                    )
+                    streams.append([upsert_entry(row) for row in result.scalars()])
+                result = await session.execute(
+                    select(SyncTombstone)
+                    .filter(SyncTombstone.version > since, SyncTombstone.version <= current)
+                    .order_by(SyncTombstone.version)
+                    .limit(limit + 1)
+                )
+                streams.append([delete_entry(row) for row in result.scalars()])
+                entries = list(heapq.merge(*streams, key=lambda entry: entry[0]))
+        except Exception as e:
+            logger.error(f"Error syncing changes: {e}")
+            return json({"error": "Failed to fetch changes"}, status=500)
+
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    # A full page resumes after its last row; otherwise the client is caught up
+    cursor = entries[-1][0] if has_more else current
+
+    return json({
+        "data": [entry for _, entry in entries],
+        "_meta": {
+            "since": since,
+            "cursor": cursor,
+            "limit": limit,
+            "has_more": has_more
+        },
+        "_links": {
+            "self": f"/api/sync?since={since}&limit={limit}",
+            "next": f"/api/sync?since={cursor}&limit={limit}"
+        }
+    })
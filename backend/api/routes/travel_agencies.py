@@ -1,15 +1,22 @@
 # backend/api/routes/travel_agencies.py
 from sanic import Blueprint, json
-from sqlalchemy import select
+from sqlalchemy import delete, select
 from sqlalchemy.orm import joinedload
 from api.models.models import TravelAgency
 from api.models.models import User
 from api.models.models import Itinerary
-from database import get_session
+from database import get_session, using_sessions
+import changes
+from api.entity_cache import entity_cache
+from api.response_cache import cached
+from api.single_flight import single_flight
+import shards
 
 agencies_bp = Blueprint('agencies', url_prefix='/agencies')
 
 @agencies_bp.get("/")
+@cached("agencies")
+@single_flight
 async def get_agencies(request):
     """List all travel agencies"""
     async with get_session() as session:
@@ -19,58 +26,103 @@ async def get_agencies(request):
         
         return json([agency.to_dict(include_users=False) for agency in agencies])
 
+@agencies_bp.delete("/<agency_id:int>")
+async def delete_agency(request, agency_id):
+    """Delete a travel agency along with its users and their itineraries"""
+    # Sharded: the agency row is in the catalog, its children in the shard
+    with using_sessions(None):
+        async with get_session() as session:
+            # A single DELETE; the database cascades to every child row
+            result = await session.execute(
+                delete(TravelAgency).filter(TravelAgency.id == agency_id)
+            )
+            
+            if result.rowcount == 0:
+                return json({"error": "Travel agency not found"}, status=404)
+            
+            changes.record(session, "travel_agencies", "delete", agency_id)
+            await session.commit()
+    if shards.SHARDING:
+        await shards.drop_shard(agency_id)
+    # 204 No Content for successful deletion
+    return json({}, status=204)
+
 @agencies_bp.get("/<agency_id:int>/users")
+@cached("agencies")
+@single_flight
 async def get_agency_users(request, agency_id):
     """List all users for a given travel agency"""
+    cached_users = entity_cache.agency_users(agency_id)
+    if cached_users is not None:
+        return json({"users": cached_users})
+
+    version = entity_cache.version
     async with get_session() as session:
-        # Verify agency exists
-        agency_result = await session.execute(
-            select(TravelAgency).filter(TravelAgency.id == agency_id)
-        )
-        agency = agency_result.scalar_one_or_none()
-        
-        if not agency:
-            return json({"error": "Travel agency not found"}, status=404)
-        
-        # Get users for agency without loading itineraries
+        # One query checks the agency exists and gets its users: the outer
+        # join returns the agency row even when it has no users
         query = (
-            select(User)
-            .filter(User.travel_agency_id == agency_id)
+            select(TravelAgency, User)
+            .outerjoin(User, User.travel_agency_id == TravelAgency.id)
+            .filter(TravelAgency.id == agency_id)
             .order_by(User.name)
         )
         result = await session.execute(query)
-        users = result.scalars().all()
+        rows = result.all()
+        
+        if not rows:
+            return json({"error": "Travel agency not found"}, status=404)
+        
+        users = [
+            user.to_dict(include_itineraries=False)
+            for _, user in rows if user is not None
+        ]
+        entity_cache.store_agency_users(rows[0][0].to_dict(), users, version)
         
         return json({
-            "users": [user.to_dict(include_itineraries=False) for user in users]
+            "users": users
         })
 
 @agencies_bp.get("/users/<user_id:int>/itineraries")
+@cached("agencies")
+@single_flight
 async def get_user_itineraries(request, user_id):
     """List all itineraries for a given user with their trips and lodgings"""
     async with get_session() as session:
-        # Verify user exists
-        user_result = await session.execute(
-            select(User).filter(User.id == user_id)
-        )
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            return json({"error": "User not found"}, status=404)
-        
-        # Get itineraries with eager loading of trips and lodgings
-        query = (
-            select(Itinerary)
-            .options(
-                joinedload(Itinerary.trips),
-                joinedload(Itinerary.lodgings)
+        if entity_cache.user(user_id) is not None:
+            # The user is known to exist, so only the itineraries are needed
+            query = (
+                select(Itinerary)
+                .options(
+                    joinedload(Itinerary.trips),
+                    joinedload(Itinerary.lodgings)
+                )
+                .filter(Itinerary.user_id == user_id)
+                .order_by(Itinerary.date_start)
             )
-            .filter(Itinerary.user_id == user_id)
-            .order_by(Itinerary.date_start)
-        )
-        
-        result = await session.execute(query)
-        itineraries = result.unique().scalars().all()
+            result = await session.execute(query)
+            itineraries = result.unique().scalars().all()
+        else:
+            # Check the user exists in the same query: the outer join returns
+            # the user row even when there are no itineraries
+            version = entity_cache.version
+            query = (
+                select(User, Itinerary)
+                .outerjoin(Itinerary, Itinerary.user_id == User.id)
+                .options(
+                    joinedload(Itinerary.trips),
+                    joinedload(Itinerary.lodgings)
+                )
+                .filter(User.id == user_id)
+                .order_by(Itinerary.date_start)
+            )
+            result = await session.execute(query)
+            rows = result.unique().all()
+            
+            if not rows:
+                return json({"error": "User not found"}, status=404)
+            
+            entity_cache.store_user(rows[0][0].to_dict(), version)
+            itineraries = [itinerary for _, itinerary in rows if itinerary is not None]
         
         return json({
             "itineraries": [
@@ -80,6 +132,8 @@ async def get_user_itineraries(request, user_id):
         })
 
 @agencies_bp.get("/itineraries/<itinerary_id:int>/details")
+@cached("agencies")
+@single_flight
 async def get_itinerary_details(request, itinerary_id):
     """List all lodging AND trips for a given itinerary"""
     async with get_session() as session:
@@ -4,81 +4,122 @@ from sqlalchemy import func, select
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 from database import get_session
-from api.models.models import Trip
+from api.idempotency import idempotent
+from api.exports import InvalidFormat, export, parse_format
+from api.includes import InvalidInclude, link_suffix, load_options, parse_include
+from api.multi_get import InvalidIds, get_many, parse_ids
+from api.response_cache import cached
+from api.single_flight import single_flight
+from api.models.models import READ_ONLY_COLUMNS, Trip
+import shards
+import write_coalescer
 
 trips_bp = Blueprint('trips', url_prefix='/trips')
 
+# Relationships the list endpoint can expand with ?include=
+INCLUDES = ("itinerary",)
+
 def parse_date(date_str):
     """Convert string to date object"""
     return datetime.strptime(date_str, '%Y-%m-%d').date()
 
+def apply_filters(query, args):
+    """``query`` narrowed by the list filters in ``args`` (shared with the export)"""
+    mode = args.get('mode')
+    transporter = args.get('transporter')
+    start_date = args.get('start_date')
+    location = args.get('location')  # Search in both start and end locations
+    
+    if mode:
+        query = query.filter(Trip.mode == mode)
+    if transporter:
+        query = query.filter(Trip.transporter.ilike(f"%{transporter}%"))
+    if start_date:
+        query = query.filter(Trip.date_start >= parse_date(start_date))
+    if location:
+        # Search in both start and end locations
+        query = query.filter(
+            (Trip.location_start.ilike(f"%{location}%")) |
+            (Trip.location_end.ilike(f"%{location}%"))
+        )
+    return query
+
 @trips_bp.get("/")
+@cached("trips")
+@single_flight
 async def get_trips(request):
     """Get all trips with pagination and filtering"""
+    try:
+        ids = parse_ids(request)
+        include = parse_include(request, INCLUDES)
+    except (InvalidIds, InvalidInclude) as e:
+        return json({"error": str(e)}, status=400)
+    to_dict_kwargs = {"include_itinerary": "itinerary" in include}
+
     # Parse query parameters
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 10))
-    mode = request.args.get('mode')
-    transporter = request.args.get('transporter')
-    start_date = request.args.get('start_date')
-    location = request.args.get('location')  # Search in both start and end locations
     
     async with get_session() as session:
-        # Build base query
-        query = select(Trip)
-        count_query = select(func.count(Trip.id))
-        
-        # Apply filters if provided
-        if mode:
-            query = query.filter(Trip.mode == mode)
-            count_query = count_query.filter(Trip.mode == mode)
-        if transporter:
-            query = query.filter(Trip.transporter.ilike(f"%{transporter}%"))
-            count_query = count_query.filter(Trip.transporter.ilike(f"%{transporter}%"))
-        if start_date:
-            date_obj = parse_date(start_date)
-            query = query.filter(Trip.date_start >= date_obj)
-            count_query = count_query.filter(Trip.date_start >= date_obj)
-        if location:
-            # Search in both start and end locations
-            query = query.filter(
-                (Trip.location_start.ilike(f"%{location}%")) |
-                (Trip.location_end.ilike(f"%{location}%"))
+        if ids is not None:
+            # ?ids=1,2,3 fetches exactly those rows in one IN query
+            return await get_many(
+                session, Trip, ids, "trips",
+                options=load_options(Trip, include), **to_dict_kwargs
             )
-            count_query = count_query.filter(
-                (Trip.location_start.ilike(f"%{location}%")) |
-                (Trip.location_end.ilike(f"%{location}%"))
-            )
-        
-        # Get total count
-        total_result = await session.execute(count_query)
-        total = total_result.scalar()
+
+        # Build base query
+        query = apply_filters(select(Trip), request.args)
+        count_query = apply_filters(select(func.count(Trip.id)), request.args)
         
-        # Apply pagination
-        query = query.offset((page - 1) * per_page).limit(per_page)
+        # One batched IN query per included relationship
+        query = query.options(*load_options(Trip, include))
         
-        # Execute query
-        result = await session.execute(query)
-        trips = result.scalars().all()
+        if shards.SHARDING:
+            # Each agency's trips are in their own database
+            total, trips = await shards.fetch_page(Trip, query, count_query, page, per_page)
+        else:
+            # Get total count
+            total_result = await session.execute(count_query)
+            total = total_result.scalar()
+            
+            # Apply pagination
+            query = query.offset((page - 1) * per_page).limit(per_page)
+            
+            # Execute query
+            result = await session.execute(query)
+            trips = result.scalars().all()
         
         # Build response with HATEOAS links
         response = {
-            "data": [trip.to_dict() for trip in trips],
+            "data": [trip.to_dict(**to_dict_kwargs) for trip in trips],
             "_meta": {
                 "page": page,
                 "per_page": per_page,
                 "total": total
             },
             "_links": {
-                "self": f"/api/trips?page={page}&per_page={per_page}",
-                "next": f"/api/trips?page={page+1}&per_page={per_page}" 
+                "self": f"/api/trips?page={page}&per_page={per_page}{link_suffix(include)}",
+                "next": f"/api/trips?page={page+1}&per_page={per_page}{link_suffix(include)}" 
                        if page * per_page < total else None,
-                "prev": f"/api/trips?page={page-1}&per_page={per_page}" 
+                "prev": f"/api/trips?page={page-1}&per_page={per_page}{link_suffix(include)}" 
                        if page > 1 else None
             }
         }
         return json(response)
 
+@trips_bp.get("/export", ctx_admission_pool="exports", ctx_streaming=True)
+async def export_trips(request):
+    """Every trip matching the list filters, as ?format=parquet or arrow"""
+    try:
+        export_format = parse_format(request)
+        query = apply_filters(select(Trip), request.args)
+    except InvalidFormat as e:
+        return json({"error": str(e)}, status=400)
+    except ValueError:
+        return json({"error": "Invalid filter value"}, status=400)
+    return await export(request, Trip, query, export_format, "trips")
+
 @trips_bp.get("/<trip_id:int>")
 async def get_trip(request, trip_id):
     """Get a specific trip"""
@@ -110,6 +151,7 @@ async def get_trip(request, trip_id):
         return json(response)
 
 @trips_bp.post("/")
+@idempotent
 async def create_trip(request):
     """Create a new trip"""
     data = request.json
@@ -139,22 +181,20 @@ async def create_trip(request):
                 "error": "Invalid mode of transport. Must be one of: flight, train, bus, car, ship"
             }, status=400)
         
-        async with get_session() as session:
-            trip = Trip(**data)
-            session.add(trip)
-            await session.commit()
-            
-            response = {
-                "data": trip.to_dict(),
-                "_links": {
-                    "self": f"/api/trips/{trip.id}",
-                    "collection": "/api/trips"
-                }
+        # Batched with other concurrent writes when coalescing is enabled
+        trip = await write_coalescer.insert(Trip(**data))
+        
+        response = {
+            "data": trip.to_dict(),
+            "_links": {
+                "self": f"/api/trips/{trip.id}",
+                "collection": "/api/trips"
             }
-            # 201 Created for successful resource creation
-            return json(response, status=201, headers={
-                'Location': f"/api/trips/{trip.id}"
-            })
+        }
+        # 201 Created for successful resource creation
+        return json(response, status=201, headers={
+            'Location': f"/api/trips/{trip.id}"
+        })
     except ValueError as e:
         return json({"error": "Invalid date format. Use YYYY-MM-DD"}, status=400)
     except Exception as e:
@@ -188,7 +228,7 @@ async def update_trip(request, trip_id):
             
             # Update fields
             for key, value in data.items():
-                if hasattr(trip, key):
+                if hasattr(trip, key) and key not in READ_ONLY_COLUMNS:
                     setattr(trip, key, value)
             
             # Validate date range
@@ -197,7 +237,14 @@ async def update_trip(request, trip_id):
                     "error": "Start date must be before end date"
                 }, status=400)
             
-            await session.commit()
+            if write_coalescer.enabled():
+                # Leave this session uncommitted; the change goes out in the next batch
+                await write_coalescer.update_by_id(Trip, trip.id, {
+                    key: value for key, value in data.items()
+                    if key in Trip.__table__.columns.keys() and key not in READ_ONLY_COLUMNS
+                })
+            else:
+                await session.commit()
             return json({
                 "data": trip.to_dict(),
                 "_links": {
@@ -205,6 +252,9 @@ async def update_trip(request, trip_id):
                     "collection": "/api/trips"
                 }
             })
+        except write_coalescer.RowNotFound:
+            # Deleted after it was read above
+            return json({"error": "Trip not found"}, status=404)
         except ValueError as e:
             return json({"error": "Invalid date format. Use YYYY-MM-DD"}, status=400)
 
@@ -1,8 +1,17 @@
 # backend/api/routes/users.py
+from datetime import datetime
 from sanic import Blueprint, json
+from sqlalchemy import delete
 from sqlalchemy.future import select
 from database import get_session
+import changes
+from api import timeline
+from api.entity_cache import entity_cache
+from api.exports import InvalidFormat, export, parse_format
+from api.response_cache import cached
+from api.single_flight import single_flight
 from api.models.models import User
+import shards
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,12 +19,20 @@ logger = logging.getLogger(__name__)
 # Create a Blueprint for user routes
 users_bp = Blueprint('users', url_prefix='/users')
 
+TIMELINE_DEFAULT_LIMIT = 100
+TIMELINE_MAX_LIMIT = 1000
+
 @users_bp.get("/")
+@cached("users")
+@single_flight
 async def get_users(request):
     async with get_session() as session:
         try:
-            result = await session.execute(select(User))
-            users = result.scalars().all()
+            if shards.SHARDING:
+                users = await shards.fetch_all(select(User))
+            else:
+                result = await session.execute(select(User))
+                users = result.scalars().all()
             return json([{
                 "id": user.id,
                 "name": user.name,
@@ -25,6 +42,44 @@ async def get_users(request):
             logger.error(f"Error getting users: {e}")
             return json({"error": "Failed to fetch users"}, status=500)
 
+@users_bp.get("/export", ctx_admission_pool="exports", ctx_streaming=True)
+async def export_users(request):
+    """Every user, as ?format=parquet or arrow"""
+    try:
+        export_format = parse_format(request)
+    except InvalidFormat as e:
+        return json({"error": str(e)}, status=400)
+    return await export(request, User, select(User), export_format, "users")
+
+@users_bp.get("/<user_id:int>/timeline", ctx_streaming=True)
+async def get_user_timeline(request, user_id):
+    """The user's trips and lodgings in date order, ``limit`` events per page"""
+    try:
+        first_day, last_day = (
+            datetime.strptime(request.args.get(name), '%Y-%m-%d').date()
+            if request.args.get(name) else None
+            for name in ('from', 'to')
+        )
+    except ValueError:
+        return json({"error": "Invalid date format. Use YYYY-MM-DD"}, status=400)
+    try:
+        cursor = request.args.get('cursor')
+        position = timeline.parse_cursor(cursor) if cursor else None
+        limit = max(1, min(int(request.args.get('limit', TIMELINE_DEFAULT_LIMIT)), TIMELINE_MAX_LIMIT))
+    except timeline.InvalidCursor as e:
+        return json({"error": str(e)}, status=400)
+    except ValueError:
+        return json({"error": "limit must be an integer"}, status=400)
+
+    async with get_session() as session:
+        if entity_cache.user(user_id) is None:
+            version = entity_cache.version
+            user = await session.get(User, user_id)
+            if user is None:
+                return json({"error": "User not found"}, status=404)
+            entity_cache.store_user(user.to_dict(), version)
+        await timeline.stream(request, session, user_id, first_day, last_day, position, limit)
+
 @users_bp.post("/")
 async def create_user(request): # Function is marked as async
     # The function is marked async because it contains operations that might take time (database operations)
@@ -32,6 +87,9 @@ async def create_user(request): # Function is marked as async
     user_data = request.json
     if not user_data or 'name' not in user_data or 'email' not in user_data:
         return json({"error": "Name and email are required"}, status=400)
+    if shards.SHARDING and not isinstance(user_data.get('travel_agency_id'), int):
+        # Users live in their agency's database
+        return json({"error": "travel_agency_id is required"}, status=400)
     
     # This starts an async context manager
     async with get_session() as session:
@@ -39,7 +97,8 @@ async def create_user(request): # Function is marked as async
             # These are synchronous operations:
             new_user = User(
                 name=user_data["name"],
-                email=user_data["email"]
+                email=user_data["email"],
+                travel_agency_id=user_data.get("travel_agency_id")
             )
             session.add(new_user)
 
@@ -61,15 +120,15 @@ async def create_user(request): # Function is marked as async
 async def delete_user(request, user_id):
     async with get_session() as session:
         try:
+            # Itineraries (and their trips/lodgings) go with it via ON DELETE CASCADE
             result = await session.execute(
-                select(User).filter(User.id == user_id)
+                delete(User).filter(User.id == user_id)
             )
-            user = result.scalar_one_or_none()
             
-            if user is None:
+            if result.rowcount == 0:
                 return json({"error": "User not found"}, status=404)
                 
-            await session.delete(user)
+            changes.record(session, "users", "delete", user_id)
             await session.commit()
             return json({"message": "User deleted successfully"})
         except Exception as e:
@@ -0,0 +1,61 @@
+# backend/api/routes/ws.py
+from sanic import Blueprint
+from sqlalchemy import select
+from websockets.exceptions import ConnectionClosed
+import asyncio
+import json
+from database import get_session
+from api.live import hub
+from api.models.models import Itinerary, TravelAgency
+
+# Live change feeds, replacing polling of the details endpoints
+ws_bp = Blueprint('ws', url_prefix='/ws')
+
+async def stream(ws, channel):
+    """Send channel events to the client until either side closes"""
+    subscriber = hub.subscribe(channel)
+
+    async def send_events():
+        while True:
+            await ws.send(json.dumps(await subscriber.get()))
+
+    async def wait_for_close():
+        # Clients don't send anything; recv() raises once they disconnect
+        while True:
+            await ws.recv()
+
+    sender = asyncio.create_task(send_events())
+    receiver = asyncio.create_task(wait_for_close())
+    try:
+        await ws.send(json.dumps({"type": "subscribed", "channel": channel}))
+        await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    except ConnectionClosed:
+        pass
+    finally:
+        sender.cancel()
+        receiver.cancel()
+        hub.unsubscribe(subscriber)
+
+@ws_bp.websocket("/itineraries/<itinerary_id:int>")
+async def itinerary_feed(request, ws, itinerary_id):
+    """Push trip, lodging and itinerary changes for one itinerary"""
+    async with get_session() as session:
+        result = await session.execute(
+            select(Itinerary.id).filter(Itinerary.id == itinerary_id)
+        )
+        if result.scalar_one_or_none() is None:
+            await ws.close(code=4404, reason="Itinerary not found")
+            return
+    await stream(ws, f"itinerary:{itinerary_id}")
+
+@ws_bp.websocket("/agencies/<agency_id:int>")
+async def agency_feed(request, ws, agency_id):
+    """Push trip, lodging and itinerary changes for all of an agency's users"""
+    async with get_session() as session:
+        result = await session.execute(
+            select(TravelAgency.id).filter(TravelAgency.id == agency_id)
+        )
+        if result.scalar_one_or_none() is None:
+            await ws.close(code=4404, reason="Travel agency not found")
+            return
+    await stream(ws, f"agency:{agency_id}")
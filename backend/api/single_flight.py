@@ -0,0 +1,90 @@
+# backend/api/single_flight.py
+"""
+Single-flight request coalescing.
+
+While a request for a given route + path args + query string is being
+handled, identical requests arriving on the same worker wait for that
+result instead of running the same queries and serialization again.
+Each caller gets its own copy of the response, since middleware may
+modify headers.
+"""
+import asyncio
+from collections import defaultdict
+from functools import wraps
+
+from sanic.response import HTTPResponse
+
+_in_flight = {}
+_stats = defaultdict(lambda: {"leaders": 0, "followers": 0})
+
+
+def request_key(request, kwargs):
+    """Normalize a request into a key: route, path args and sorted query args"""
+    query = tuple(sorted((name, tuple(values)) for name, values in request.args.items()))
+    return (request.name, tuple(sorted(kwargs.items())), query)
+
+
+def snapshot(response):
+    return (response.body, response.status, dict(response.headers), response.content_type)
+
+
+def from_snapshot(snap):
+    body, status, headers, content_type = snap
+    return HTTPResponse(body, status=status, headers=headers, content_type=content_type)
+
+
+def single_flight(handler):
+    """Coalesce identical concurrent GETs to ``handler`` into one execution"""
+    @wraps(handler)
+    async def wrapper(request, *args, **kwargs):
+        key = request_key(request, kwargs)
+        route_stats = _stats[request.name]
+
+        future = _in_flight.get(key)
+        if future is not None:
+            route_stats["followers"] += 1
+            try:
+                return from_snapshot(await asyncio.shield(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leader was cancelled, not us; run the handler ourselves
+                return await handler(request, *args, **kwargs)
+
+        route_stats["leaders"] += 1
+        future = asyncio.get_running_loop().create_future()
+        _in_flight[key] = future
+        try:
+            response = await handler(request, *args, **kwargs)
+            future.set_result(snapshot(response))
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark as retrieved so an unshared failure isn't logged twice
+            future.exception()
+            raise
+        finally:
+            _in_flight.pop(key, None)
+
+    return wrapper
+
+
+def stats():
+    """Leader/follower counts and coalescing hit rate, per route and overall"""
+    routes = {}
+    leaders = followers = 0
+    for name, counts in _stats.items():
+        total = counts["leaders"] + counts["followers"]
+        routes[name] = {**counts, "hit_rate": counts["followers"] / total if total else 0.0}
+        leaders += counts["leaders"]
+        followers += counts["followers"]
+    total = leaders + followers
+    return {
+        "leaders": leaders,
+        "followers": followers,
+        "hit_rate": followers / total if total else 0.0,
+        "routes": routes,
+    }
@@ -0,0 +1,201 @@
+# backend/api/suggest.py
+"""
+Autocomplete indexes for /api/suggest: trip locations (start and end),
+transporters, and lodging names.
+
+Each index keeps its distinct values, case-folded, in a sorted list next
+to a count of the rows using them. A prefix is two binary searches, and
+the matches are ranked by count. Rankings are cached per prefix, and a
+count going up is patched into the cached rankings of its prefixes rather
+than throwing them away, so keystrokes are mostly a dict lookup.
+
+Loaded from the trips and lodgings tables at startup, then kept current
+from committed writes on the worker bus, the same way as the route graph
+(api/replica.py): rows remember the values they contributed, so updates
+and deletes take back the old ones.
+"""
+import heapq
+import os
+from bisect import bisect_left, insort
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import select
+
+import shards
+from database import get_session
+from api.models.models import Lodging, Trip
+from api.replica import Replica
+
+# table -> {column: index the column's values go into}
+INDEXED_COLUMNS = {
+    "trips": {
+        "location_start": "locations",
+        "location_end": "locations",
+        "transporter": "transporters"
+    },
+    "lodgings": {"name": "lodgings"},
+}
+MODELS = {"trips": Trip, "lodgings": Lodging}
+# Full reload even without missed bus messages (0 = only when one is missed)
+SUGGEST_RELOAD_SECONDS = float(os.getenv('SUGGEST_RELOAD_SECONDS', 900))
+# Prefixes whose rankings are cached per index (least recently used go first)
+CACHE_SIZE = 2048
+
+
+def normalize(value):
+    return " ".join(value.split()).casefold()
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.keys = []  # sorted normalized values
+        self.counts = {}  # normalized value -> rows using it
+        self.display = {}  # normalized value -> spelling as first seen
+        self._cache = OrderedDict()  # prefix -> {limit: [(-count, value)]}, LRU
+
+    def add(self, value, delta):
+        key = normalize(value)
+        if not key:
+            return
+        count = self.counts.get(key, 0) + delta
+        if count > 0:
+            if key not in self.counts:
+                insort(self.keys, key)
+                self.display[key] = " ".join(value.split())
+            self.counts[key] = count
+        elif key in self.counts:
+            del self.counts[key]
+            del self.display[key]
+            del self.keys[bisect_left(self.keys, key)]
+        # Only the cached answers for this value's prefixes can change
+        for end in range(len(key) + 1):
+            self._update_cached(key[:end], key, count, delta)
+
+    def _update_cached(self, prefix, key, count, delta):
+        cached = self._cache.get(prefix)
+        if cached is None:
+            return
+        for limit, ranked in list(cached.items()):
+            entries = [entry for entry in ranked if entry[1] != key]
+            if delta < 0 and len(entries) < len(ranked):
+                # A value outside the list may now outrank this one
+                del cached[limit]
+                continue
+            if count > 0 and (len(ranked) < limit or (-count, key) < ranked[-1]):
+                insort(entries, (-count, key))
+                cached[limit] = entries[:limit]
+
+    def suggest(self, prefix, limit):
+        """The ``limit`` most used values starting with ``prefix``"""
+        prefix = normalize(prefix)
+        cached = self._cache.get(prefix)
+        if cached is None:
+            cached = self._cache[prefix] = {}
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        self._cache.move_to_end(prefix)
+        ranked = cached.get(limit)
+        if ranked is None:
+            counts = self.counts
+            start = bisect_left(self.keys, prefix)
+            end = bisect_left(self.keys, prefix + "\U0010ffff")
+            ranked = cached[limit] = heapq.nsmallest(
+                limit, ((-counts[key], key) for key in self.keys[start:end])
+            )
+        return [
+            {"value": self.display[key], "count": -negative_count}
+            for negative_count, key in ranked
+        ]
+
+
+class Suggestions:
+    def __init__(self):
+        self.indexes = {name: PrefixIndex() for name in self.index_names()}
+        self.rows = {}  # (table, id) -> (itinerary id, [(index, value)])
+        self.itinerary_rows = defaultdict(set)
+        self.ready = False
+        self.built_at = None
+        self.stats = {"loads": 0, "updates": 0, "load_ms": None}
+
+    @staticmethod
+    def index_names():
+        return sorted({name for columns in INDEXED_COLUMNS.values() for name in columns.values()})
+
+    def put_row(self, table, row_id, data):
+        self.remove_row(table, row_id)
+        values = [
+            (index, data[column]) for column, index in INDEXED_COLUMNS[table].items()
+            if data.get(column)
+        ]
+        for index, value in values:
+            self.indexes[index].add(value, 1)
+        self.rows[(table, row_id)] = (data["itinerary_id"], values)
+        self.itinerary_rows[data["itinerary_id"]].add((table, row_id))
+
+    def remove_row(self, table, row_id):
+        row = self.rows.pop((table, row_id), None)
+        if row is None:
+            return
+        itinerary_id, values = row
+        for index, value in values:
+            self.indexes[index].add(value, -1)
+        self.itinerary_rows[itinerary_id].discard((table, row_id))
+        if not self.itinerary_rows[itinerary_id]:
+            del self.itinerary_rows[itinerary_id]
+
+    def apply(self, entries):
+        """Apply bus entries: [table, op, id, data]"""
+        self.stats["updates"] += len(entries)
+        for table, op, row_id, data in entries:
+            if table == "itineraries":
+                for key in list(self.itinerary_rows.get(row_id, ())):
+                    self.remove_row(*key)
+            elif op == "delete":
+                self.remove_row(table, row_id)
+            else:
+                self.put_row(table, row_id, data)
+
+    def summary(self):
+        return {
+            **self.stats,
+            "ready": self.ready,
+            "built_at": self.built_at,
+            "values": {name: len(index.keys) for name, index in self.indexes.items()}
+        }
+
+
+async def _read_rows(model, table):
+    columns = [model.id, model.itinerary_id] + [
+        getattr(model, column) for column in INDEXED_COLUMNS[table]
+    ]
+    query = select(*columns)
+
+    async def read(session):
+        return (await session.execute(query)).mappings().all()
+
+    if shards.SHARDING:
+        return [row for rows in await shards.gather(read) for row in rows]
+    async with get_session() as session:
+        return await read(session)
+
+
+async def _build():
+    suggestions = Suggestions()
+    for table, model in MODELS.items():
+        for row in await _read_rows(model, table):
+            suggestions.put_row(table, row["id"], row)
+    return suggestions
+
+
+replica = Replica(
+    "Suggestion indexes", "suggest.changes", tuple(INDEXED_COLUMNS), Suggestions, _build,
+    SUGGEST_RELOAD_SECONDS
+)
+start_suggest = replica.start
+stop_suggest = replica.stop
+
+
+def __getattr__(name):
+    if name == "suggestions":
+        return replica.current
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,163 @@
+# backend/api/timeline.py
+"""
+A traveler's trips and lodgings as one chronological stream:
+GET /api/users/<id>/timeline?from=&to=&cursor=&limit=.
+
+Trips and lodgings are each read in (date_start, id) order, in keyset
+batches of TIMELINE_BATCH_ROWS, and the two sorted streams are merged as
+they arrive. The (itinerary_id, date_start) indexes find the user's rows
+after the cursor, one itinerary at a time. The order spans all of the
+user's itineraries, though, so SQLite sorts those rows for every batch.
+The index doesn't provide it. Events are written to the response as they
+come out of the merge, so a page never holds more than a batch per
+source, however many years of itineraries the user has.
+
+Events on the same day are ordered trips first, then by id. A page ends
+with a cursor naming its last event (``2024-05-01:trip:123``); passing it
+back as ?cursor= continues right after that event.
+"""
+import heapq
+import json as jsonlib
+import logging
+import os
+from datetime import date
+
+from sqlalchemy import and_, or_, select
+
+from api import admission
+from api.models.models import Itinerary, Lodging, Trip
+
+logger = logging.getLogger(__name__)
+
+TIMELINE_BATCH_ROWS = int(os.getenv('TIMELINE_BATCH_ROWS', 200))
+
+# Event type -> model, in the order same-day events are listed
+SOURCES = {"trip": Trip, "lodging": Lodging}
+RANKS = {kind: rank for rank, kind in enumerate(SOURCES)}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def parse_cursor(value):
+    """``date:type:id`` -> (date, rank, id)"""
+    try:
+        day, kind, row_id = value.split(":")
+        return date.fromisoformat(day), RANKS[kind], int(row_id)
+    except (ValueError, KeyError):
+        raise InvalidCursor("cursor must look like YYYY-MM-DD:trip:<id>")
+
+
+def format_cursor(event):
+    return f"{event['date']}:{event['type']}:{event['data']['id']}"
+
+
+def _after(model, rank, position):
+    """Rows of ``model`` that sort after ``position`` = (date, rank, id)"""
+    day, position_rank, row_id = position
+    if rank < position_rank:
+        return model.date_start > day
+    if rank > position_rank:
+        return model.date_start >= day
+    return or_(model.date_start > day, and_(model.date_start == day, model.id > row_id))
+
+
+async def _events(session, kind, user_id, first_day, last_day, position):
+    """One source's events in date order, read a batch at a time"""
+    model, rank = SOURCES[kind], RANKS[kind]
+    query = (
+        select(model, Itinerary.tour_name)
+        .join(Itinerary, model.itinerary_id == Itinerary.id)
+        .filter(Itinerary.user_id == user_id)
+        .order_by(model.date_start, model.id)
+        .limit(TIMELINE_BATCH_ROWS)
+    )
+    if first_day:
+        query = query.filter(model.date_start >= first_day)
+    if last_day:
+        query = query.filter(model.date_start <= last_day)
+    while True:
+        batch_query = query if position is None else query.filter(_after(model, rank, position))
+        rows = (await session.execute(batch_query)).all()
+        for row, tour_name in rows:
+            yield (row.date_start, rank, row.id), {
+                "type": kind,
+                "date": str(row.date_start),
+                "tour_name": tour_name,
+                "data": row.to_dict()
+            }
+        if len(rows) < TIMELINE_BATCH_ROWS:
+            return
+        position = (rows[-1][0].date_start, rank, rows[-1][0].id)
+
+
+async def merge(sources):
+    """k-way merge of async iterators of (sort key, event), each already sorted"""
+    heap = []
+    for index, source in enumerate(sources):
+        head = await anext(source, None)
+        if head is not None:
+            heap.append((head[0], index, head[1]))
+    heapq.heapify(heap)
+    while heap:
+        key, index, event = heap[0]
+        yield event
+        head = await anext(sources[index], None)
+        if head is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (head[0], index, head[1]))
+
+
+def _links(request, user_id, limit, next_cursor):
+    base = f"/api/users/{user_id}/timeline?limit={limit}" + "".join(
+        f"&{name}={request.args.get(name)}" for name in ("from", "to")
+        if request.args.get(name)
+    )
+    cursor = request.args.get('cursor')
+    return {
+        "self": base + (f"&cursor={cursor}" if cursor else ""),
+        "next": base + f"&cursor={next_cursor}" if next_cursor else None
+    }
+
+
+async def stream(request, session, user_id, first_day, last_day, position, limit):
+    """Write one page of the user's timeline to the response as it's merged"""
+    sources = [
+        _events(session, kind, user_id, first_day, last_day, position) for kind in SOURCES
+    ]
+    response = await request.respond(content_type="application/json")
+    # Response middleware ran in respond(); keep the reads slot until the end
+    release = admission.hold_slot(request)
+    try:
+        await response.send('{"data":[')
+        chunk, count, last, more = [], 0, None, False
+        events = merge(sources)
+        async for event in events:
+            if count == limit:
+                # One event past the page: there is a next page
+                more = True
+                break
+            chunk.append(jsonlib.dumps(event))
+            count, last = count + 1, event
+            if len(chunk) == TIMELINE_BATCH_ROWS:
+                await response.send(("," if count > len(chunk) else "") + ",".join(chunk))
+                chunk = []
+        if chunk:
+            await response.send(("," if count > len(chunk) else "") + ",".join(chunk))
+        for iterator in (events, *sources):
+            await iterator.aclose()
+
+        next_cursor = format_cursor(last) if more else None
+        await response.send("]," + jsonlib.dumps({
+            "_meta": {"count": count, "next_cursor": next_cursor},
+            "_links": _links(request, user_id, limit, next_cursor)
+        })[1:])
+        await response.eof()
+    except Exception as e:
+        # The status line is long gone; the client sees a truncated body
+        logger.error(f"Error streaming the timeline of user {user_id}: {e}")
+        raise
+    finally:
+        release()
@@ -0,0 +1,315 @@
+# backend/backfill.py
+"""
+Chunked backfills: fill in or rewrite a column of a large table while the
+app keeps serving.
+
+A single `UPDATE trips SET ...` holds SQLite's write lock until every row
+is done. A backfill instead walks the table in primary key order,
+BACKFILL_BATCH_ROWS rows per transaction, and sleeps BACKFILL_SLEEP_MS
+between chunks so request writes get the lock in between. Each chunk
+saves its position in the backfill_progress table in the same
+transaction as its rows, so a backfill that is stopped (Ctrl-C, deploy,
+crash) resumes after the last committed chunk when run again. A chunk
+that finds the database busy waits and retries instead of failing.
+
+A backfill is named, and defined by a table, a SET clause and an
+optional WHERE clause selecting the rows still to do. Running a name
+again with another definition is an error, unless restarted. With
+sharding, the main database and every shard are backfilled one after
+another, each with its own checkpoint.
+
+Schema changes that need a backfill are done in three steps, so no step
+locks the table for long:
+
+1. A migration adds the column as nullable (instant in SQLite).
+2. The app starts writing the column for new and updated rows, and the
+   backfill fills in the old ones: from the migration itself with
+   run_in_migration(), or afterwards with
+   `python -m utils.backfill run <name> --table ... --set ...`.
+3. A later migration adds the index or NOT NULL constraint.
+
+Running workers don't see writes made here, so once a database is done
+(or a backfill stops partway) notify_workers() bumps the shared cache
+namespaces that depend on the table and tells the workers over the bus
+to clear their entity caches or reload the route graph and suggestion
+indexes, as the table requires. The sync triggers give every backfilled
+row a new version, so sync clients download it again.
+"""
+import logging
+import os
+import sqlite3
+import time
+
+import bus
+import shards
+from changes import Change
+from database import DATABASE_DIR, DATABASE_PATH
+from shared_cache import affected_namespaces, announce_invalidation
+from api import suggest
+from api.entity_cache import ENTITY_TABLES
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_ROWS = int(os.getenv('BACKFILL_BATCH_ROWS', 1000))
+# Pause between chunks, so request writes get the lock
+BACKFILL_SLEEP_MS = float(os.getenv('BACKFILL_SLEEP_MS', 50))
+BACKFILL_BUSY_TIMEOUT_MS = int(os.getenv('BACKFILL_BUSY_TIMEOUT_MS', 1000))
+# Times a chunk is retried while the database stays busy
+BACKFILL_MAX_RETRIES = int(os.getenv('BACKFILL_MAX_RETRIES', 20))
+BACKFILL_PROGRESS_SECONDS = float(os.getenv('BACKFILL_PROGRESS_SECONDS', 5))
+
+PROGRESS_TABLE = "backfill_progress"
+CREATE_PROGRESS_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} (
+    name VARCHAR(100) PRIMARY KEY,
+    definition TEXT NOT NULL,
+    last_id INTEGER,
+    rows INTEGER NOT NULL DEFAULT 0,
+    started_at FLOAT NOT NULL,
+    updated_at FLOAT NOT NULL,
+    finished_at FLOAT
+)"""
+
+
+class BackfillError(Exception):
+    pass
+
+
+def definition(table, set_sql, where=None):
+    return f'UPDATE "{table}" SET {set_sql}' + (f" WHERE {where}" if where else "")
+
+
+def databases():
+    """Paths of the databases a backfill runs on"""
+    paths = [DATABASE_PATH]
+    if shards.SHARDING:
+        paths += [shards.shard_path(agency_id) for agency_id in shards.shard_ids()]
+    return paths
+
+
+def notify_workers(table):
+    """Make running workers drop what they hold of ``table``; returns what was done"""
+    done = []
+    bumped = announce_invalidation(affected_namespaces([Change(table, "update", None)]))
+    if bumped:
+        done.append(f"shared cache namespaces {', '.join(sorted(bumped))}")
+    if table in ENTITY_TABLES:
+        bus.announce("entities.clear", None)
+        done.append("entity caches")
+    if table == "trips":
+        bus.announce("route_graph.changes", "reload")
+        done.append("route graph")
+    if table in suggest.INDEXED_COLUMNS:
+        bus.announce("suggest.changes", "reload")
+        done.append("suggestion indexes")
+    if done:
+        logger.info(f"Backfill of {table}: told running workers to refresh their {'; '.join(done)}")
+    return done
+
+
+def _connect(path):
+    # isolation_level=None: transactions are only the ones begun below
+    return sqlite3.connect(path, timeout=BACKFILL_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+
+
+def _is_busy(error):
+    return "locked" in str(error) or "busy" in str(error)
+
+
+def _retrying(progress, sleep_ms, write, *args):
+    """write(*args), retried with backoff while requests hold the write lock"""
+    retries = 0
+    while True:
+        try:
+            return write(*args)
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e) or retries >= BACKFILL_MAX_RETRIES:
+                raise
+            retries += 1
+            progress["retries"] += 1
+            time.sleep(min(2 ** retries, 100) * max(sleep_ms, 10) / 1000)
+
+
+def _finish(connection, name):
+    now = time.time()
+    connection.execute(
+        f"UPDATE {PROGRESS_TABLE} SET finished_at = ?, updated_at = ? WHERE name = ?",
+        (now, now, name)
+    )
+
+
+def _checkpoint(connection, name, definition_sql, restart):
+    """The backfill's saved progress row, created or reset as needed"""
+    connection.execute(CREATE_PROGRESS_TABLE)
+    row = connection.execute(
+        f"SELECT definition, last_id, rows, finished_at FROM {PROGRESS_TABLE} WHERE name = ?",
+        (name,)
+    ).fetchone()
+    if row is not None and not restart:
+        if row[0] != definition_sql:
+            raise BackfillError(
+                f"Backfill {name} was started as `{row[0]}`; restart it to run `{definition_sql}`"
+            )
+        return {"last_id": row[1], "rows": row[2], "finished_at": row[3]}
+    now = time.time()
+    connection.execute(
+        f"INSERT OR REPLACE INTO {PROGRESS_TABLE} "
+        "(name, definition, last_id, rows, started_at, updated_at, finished_at) "
+        "VALUES (?, ?, NULL, 0, ?, ?, NULL)",
+        (name, definition_sql, now, now)
+    )
+    return {"last_id": None, "rows": 0, "finished_at": None}
+
+
+def _chunk(connection, name, table, set_sql, where, key, last_id, batch_rows):
+    """Update the next ``batch_rows`` keys after ``last_id`` in one short
+    transaction; returns (last key done, rows changed), or (None, 0) at the end"""
+    after = f'"{key}" > ?' if last_id is not None else "1"
+    params = (last_id,) if last_id is not None else ()
+    upper = connection.execute(
+        f'SELECT max("{key}") FROM (SELECT "{key}" FROM "{table}" WHERE {after} '
+        f'ORDER BY "{key}" LIMIT ?)',
+        params + (batch_rows,)
+    ).fetchone()[0]
+    if upper is None:
+        return None, 0
+    # IMMEDIATE takes the write lock up front, so the busy timeout applies
+    # here rather than as a deadlock halfway through
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        changed = connection.execute(
+            f'UPDATE "{table}" SET {set_sql} WHERE {after} AND "{key}" <= ?'
+            + (f" AND ({where})" if where else ""),
+            params + (upper,)
+        ).rowcount
+        connection.execute(
+            f"UPDATE {PROGRESS_TABLE} SET last_id = ?, rows = rows + ?, updated_at = ? "
+            "WHERE name = ?",
+            (upper, changed, time.time(), name)
+        )
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return upper, changed
+
+
+def run(path, name, table, set_sql, where=None, key="id", batch_rows=BACKFILL_BATCH_ROWS,
+        sleep_ms=BACKFILL_SLEEP_MS, restart=False, on_progress=None):
+    """Backfill one database file, resuming from its checkpoint; blocking.
+    Returns the backfill's progress; on_progress(progress) is called every
+    BACKFILL_PROGRESS_SECONDS and at the end."""
+    definition_sql = definition(table, set_sql, where)
+    connection = _connect(path)
+    progress = None
+    try:
+        if not connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone():
+            raise BackfillError(f"No table {table} in {path}")
+        min_id, max_id = connection.execute(
+            f'SELECT min("{key}"), max("{key}") FROM "{table}"'
+        ).fetchone()
+        progress = {
+            "database": os.path.relpath(path, DATABASE_DIR), "name": name,
+            "last_id": None, "max_id": max_id, "percent": None, "rows": 0,
+            "chunks": 0, "retries": 0, "rows_per_second": None, "done": False
+        }
+        saved = _retrying(
+            progress, sleep_ms, _checkpoint, connection, name, definition_sql, restart
+        )
+        last_id, rows = saved["last_id"], saved["rows"]
+        progress.update(last_id=last_id, rows=rows)
+        if saved["finished_at"] is not None:
+            progress["percent"], progress["done"] = 100.0, True
+            if on_progress is not None:
+                on_progress(progress)
+            return progress
+
+        started = last_report = time.monotonic()
+        rows_at_start = rows
+        while True:
+            upper, changed = _retrying(
+                progress, sleep_ms, _chunk,
+                connection, name, table, set_sql, where, key, last_id, batch_rows
+            )
+            if upper is None:
+                break
+            last_id, rows = upper, rows + changed
+            progress["chunks"] += 1
+            progress.update(last_id=last_id, rows=rows)
+            now = time.monotonic()
+            if now - last_report >= BACKFILL_PROGRESS_SECONDS:
+                last_report = now
+                progress["rows_per_second"] = round((rows - rows_at_start) / (now - started), 1)
+                # By key rather than row count, which would need a full scan
+                progress["percent"] = round(
+                    100 * (last_id - min_id) / max(max_id - min_id, 1), 1
+                ) if last_id <= max_id else 100.0
+                logger.info(f"Backfill {name} on {progress['database']}: {rows} rows, "
+                            f"{progress['percent']}% of the keys")
+                if on_progress is not None:
+                    on_progress(progress)
+            if sleep_ms:
+                time.sleep(sleep_ms / 1000)
+
+        _retrying(progress, sleep_ms, _finish, connection, name)
+        elapsed = time.monotonic() - started
+        progress["rows_per_second"] = round((rows - rows_at_start) / elapsed, 1) if elapsed else None
+        progress["percent"], progress["done"] = 100.0, True
+        logger.info(f"Backfill {name} on {progress['database']} done: {rows} rows")
+        if on_progress is not None:
+            on_progress(progress)
+        return progress
+    finally:
+        connection.close()
+        # Also when stopped partway: the chunks done so far are committed
+        if progress is not None and progress["chunks"]:
+            try:
+                progress["notified"] = notify_workers(table)
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Couldn't notify running workers of the backfill: {e}; "
+                               "restart them to drop stale cached data")
+
+
+def run_all(name, table, set_sql, where=None, **options):
+    """run() on every database (see databases()); returns their progress"""
+    return [run(path, name, table, set_sql, where, **options) for path in databases()]
+
+
+def status():
+    """Saved progress of every backfill, in every database"""
+    backfills = []
+    for path in databases():
+        connection = _connect(path)
+        try:
+            if not connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                (PROGRESS_TABLE,)
+            ).fetchone():
+                continue
+            for row in connection.execute(
+                f"SELECT name, definition, last_id, rows, started_at, updated_at, finished_at "
+                f"FROM {PROGRESS_TABLE} ORDER BY started_at"
+            ):
+                backfills.append({
+                    "database": os.path.relpath(path, DATABASE_DIR),
+                    **dict(zip(("name", "definition", "last_id", "rows", "started_at",
+                                "updated_at", "finished_at"), row))
+                })
+        finally:
+            connection.close()
+    return backfills
+
+
+def run_in_migration(name, table, set_sql, where=None, **options):
+    """Backfill from an Alembic migration, on the database being migrated.
+
+    The migration's transaction is committed before the backfill starts,
+    so give the backfill a migration of its own: running a stopped one
+    again then only resumes the backfill."""
+    from alembic import op
+
+    with op.get_context().autocommit_block():
+        path = op.get_bind().engine.url.database
+        return run(path, name, table, set_sql, where, **options)
@@ -0,0 +1,286 @@
+# backend/backups.py
+"""
+Online backups through SQLite's backup API, taken while the app serves.
+
+A backup copies each database file (the main one, plus every shard when
+sharding) BACKUP_PAGES_PER_STEP pages at a time, sleeping
+BACKUP_STEP_SLEEP_MS between steps. Each step holds the source's read
+lock only briefly, so writers are never locked out for the length of the
+copy, and the sleeps cap the I/O a backup takes. A write from another
+connection makes SQLite start the copy over; after BACKUP_MAX_RESTARTS
+restarts the copy is done in one step, holding the read lock throughout.
+
+Backups land in BACKUP_DIR/<UTC timestamp>/, with the same layout as
+DATABASE_DIR (users.db, shards/agency_<id>.db) and a manifest.json. Each
+file is a consistent point-in-time copy and passes PRAGMA quick_check
+before the backup is published. Shards are copied one after another, so
+with sharding each file has its own point in time. Open backups with
+connect_readonly(); `python -m utils.backup restore` puts one back.
+
+Taken on demand (POST /admin/backups, `python -m utils.backup create`)
+or every BACKUP_SECONDS, one at a time under BACKUP_DIR/backup.lock. The
+newest BACKUP_KEEP are kept.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import shards
+from database import DATABASE_DIR, DATABASE_PATH
+from maintenance import lower_thread_priority
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = os.path.join(DATABASE_DIR, os.getenv('BACKUP_DIR', 'backups'))
+BACKUP_LOCK_PATH = os.path.join(BACKUP_DIR, 'backup.lock')
+# Seconds between scheduled backups; 0 = only on demand
+BACKUP_SECONDS = float(os.getenv('BACKUP_SECONDS', 0))
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', 7))
+BACKUP_PAGES_PER_STEP = int(os.getenv('BACKUP_PAGES_PER_STEP', 256))
+BACKUP_STEP_SLEEP_MS = float(os.getenv('BACKUP_STEP_SLEEP_MS', 20))
+BACKUP_MAX_RESTARTS = int(os.getenv('BACKUP_MAX_RESTARTS', 3))
+
+MANIFEST = "manifest.json"
+PARTIAL = ".partial"
+
+
+class BackupError(Exception):
+    pass
+
+
+def connect_readonly(path):
+    """Read-only connection to a backed-up database file"""
+    # immutable: backups never change, so SQLite can skip locking entirely
+    return sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+
+
+def database_files():
+    """Paths of the live databases, relative to DATABASE_DIR"""
+    paths = [DATABASE_PATH]
+    if shards.SHARDING:
+        paths += [shards.shard_path(agency_id) for agency_id in shards.shard_ids()]
+    return [os.path.relpath(path, DATABASE_DIR) for path in paths]
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def copy_database(source_path, target_path, pages=BACKUP_PAGES_PER_STEP,
+                  sleep_ms=BACKUP_STEP_SLEEP_MS):
+    """Copy one database with the backup API; returns stats about the copy"""
+    started = time.perf_counter()
+    progress = {"steps": 0, "restarts": 0, "remaining": None}
+
+    def on_step(status, remaining, total):
+        if progress["remaining"] is not None and remaining > progress["remaining"]:
+            # The source changed under us and the copy started over
+            progress["restarts"] += 1
+            if progress["restarts"] > BACKUP_MAX_RESTARTS:
+                raise _TooManyRestarts()
+        progress["steps"] += 1
+        progress["remaining"] = remaining
+        if remaining and sleep_ms:
+            time.sleep(sleep_ms / 1000)
+
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    target = sqlite3.connect(target_path)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=on_step)
+        except _TooManyRestarts:
+            # Writes outpace the throttled copy: copy the rest in one step
+            logger.warning(f"Backup of {source_path} restarted {progress['restarts']} times; "
+                           "finishing it unthrottled")
+            source.backup(target, pages=-1)
+        check = target.execute("PRAGMA quick_check").fetchone()[0]
+        if check != "ok":
+            raise BackupError(f"Backup of {source_path} failed quick_check: {check}")
+        page_count = target.execute("PRAGMA page_count").fetchone()[0]
+        # A self-contained file, whatever journal mode the source uses
+        target.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        target.close()
+        source.close()
+    return {
+        "bytes": os.path.getsize(target_path),
+        "pages": page_count,
+        "steps": progress["steps"],
+        "restarts": progress["restarts"],
+        "ms": round((time.perf_counter() - started) * 1000, 3)
+    }
+
+
+def create_backup():
+    """Back up every database into a new BACKUP_DIR/<timestamp>; blocking"""
+    created_at = datetime.now(timezone.utc)
+    name = created_at.strftime("%Y%m%dT%H%M%S.%fZ")
+    partial_dir = os.path.join(BACKUP_DIR, name + PARTIAL)
+    started = time.perf_counter()
+    files = {}
+    try:
+        for relative_path in database_files():
+            target_path = os.path.join(partial_dir, relative_path)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            files[relative_path] = copy_database(
+                os.path.join(DATABASE_DIR, relative_path), target_path
+            )
+        manifest = {
+            "name": name,
+            "created_at": created_at.isoformat(),
+            "sharding": shards.SHARDING,
+            "ms": round((time.perf_counter() - started) * 1000, 3),
+            "files": files
+        }
+        with open(os.path.join(partial_dir, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+        # Published only once complete; readers never see a half-written backup
+        os.rename(partial_dir, os.path.join(BACKUP_DIR, name))
+    except BaseException:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        raise
+    prune()
+    logger.info(f"Backup {name} written in {manifest['ms']} ms ({len(files)} files)")
+    return manifest
+
+
+def list_backups():
+    """Manifests of the finished backups, newest first"""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    manifests = []
+    for name in sorted(os.listdir(BACKUP_DIR), reverse=True):
+        path = os.path.join(BACKUP_DIR, name, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as f:
+                manifests.append(json.load(f))
+    return manifests
+
+
+def backup_path(name, relative_path=None):
+    """Directory of backup ``name`` (or one of its files); BackupError if missing"""
+    if os.sep in name or name.startswith(".") or not os.path.exists(
+        os.path.join(BACKUP_DIR, name, MANIFEST)
+    ):
+        raise BackupError(f"No backup named {name}")
+    path = os.path.join(BACKUP_DIR, name)
+    return os.path.join(path, relative_path) if relative_path else path
+
+
+def prune(keep=BACKUP_KEEP):
+    """Delete all but the newest ``keep`` backups, and any left half-written.
+    Call it holding the backup lock, when no other backup can be in progress."""
+    for manifest in list_backups()[keep:]:
+        shutil.rmtree(os.path.join(BACKUP_DIR, manifest["name"]), ignore_errors=True)
+    for name in os.listdir(BACKUP_DIR):
+        if name.endswith(PARTIAL):
+            shutil.rmtree(os.path.join(BACKUP_DIR, name), ignore_errors=True)
+
+
+@contextmanager
+def backup_lock():
+    """Hold BACKUP_DIR/backup.lock, which every backup is taken under.
+    Yields False (without waiting) if another process holds it."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    with open(BACKUP_LOCK_PATH, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+
+
+def take_backup():
+    """create_backup() under the backup lock; None if another is in progress"""
+    with backup_lock() as locked:
+        return create_backup() if locked else None
+
+
+_executor = None
+_scheduler = None
+_running = asyncio.Lock()
+stats = {
+    "every_seconds": BACKUP_SECONDS or None, "runs": 0, "errors": 0,
+    "last_run_at": None, "last_ms": None, "last_backup": None, "last_error": None
+}
+
+
+async def run():
+    """Take a backup now on the backup thread; None if one is already running"""
+    if _running.locked():
+        return None
+    async with _running:
+        started = time.perf_counter()
+        try:
+            manifest = await asyncio.get_running_loop().run_in_executor(
+                _executor, take_backup
+            )
+        except Exception as e:
+            stats["errors"] += 1
+            stats["last_error"] = str(e)
+            logger.error(f"Backup failed: {e}")
+            raise
+        if manifest is None:
+            return None
+        stats["runs"] += 1
+        stats["last_run_at"] = time.time()
+        stats["last_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        stats["last_backup"] = manifest["name"]
+        return manifest
+
+
+def running():
+    return _running.locked()
+
+
+def summary():
+    return {**stats, "running": running(), "backups": len(list_backups())}
+
+
+def _latest_age():
+    backups = list_backups()
+    if not backups:
+        return None
+    return time.time() - datetime.fromisoformat(backups[0]["created_at"]).timestamp()
+
+
+async def _run_periodically():
+    while True:
+        await asyncio.sleep(BACKUP_SECONDS)
+        age = _latest_age()
+        # Every worker runs this schedule; the first to wake takes the backup
+        if age is not None and age < BACKUP_SECONDS / 2:
+            continue
+        try:
+            await run()
+        except Exception:
+            pass  # logged by run(); try again next time
+
+
+async def start_backups(app, loop):
+    global _executor, _scheduler
+    _executor = ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix="backup", initializer=lower_thread_priority
+    )
+    if BACKUP_SECONDS:
+        _scheduler = asyncio.create_task(_run_periodically())
+
+
+async def stop_backups(app, loop):
+    global _executor, _scheduler
+    if _scheduler is not None:
+        _scheduler.cancel()
+        _scheduler = None
+    if _executor is not None:
+        # A backup in progress finishes on its own; don't hold up shutdown for it
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -0,0 +1,126 @@
+# backend/bus.py
+"""
+Host-local pub/sub between Sanic workers.
+
+Each worker binds a Unix datagram socket in BUS_DIR named after its pid.
+publish() sends a small JSON message to every other worker's socket (and,
+with include_self, delivers it locally too); receivers dispatch it to the
+callbacks subscribed to its topic. Delivery is best effort: sockets left by
+dead workers are removed, and a full receive buffer drops the message, so
+subscribers that can't afford to miss one must notice and recover (see
+api/replica.py).
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+from collections import defaultdict
+
+from database import DATABASE_DIR
+
+logger = logging.getLogger(__name__)
+
+BUS_DIR = os.path.join(DATABASE_DIR, os.getenv('BUS_DIR', 'bus'))
+# Largest payload publishers should send; the receive buffer is four times this
+MAX_MESSAGE_BYTES = 64 * 1024
+
+_subscribers = defaultdict(list)
+_sock = None
+_sock_path = None
+stats = {"published": 0, "received": 0, "dropped": 0}
+
+
+def running():
+    return _sock is not None
+
+
+def subscribe(topic, callback):
+    """Call ``callback(payload)`` for every message published on ``topic``"""
+    _subscribers[topic].append(callback)
+
+
+def _deliver(topic, payload):
+    for callback in _subscribers.get(topic, []):
+        try:
+            callback(payload)
+        except Exception as e:
+            logger.error(f"Error in bus subscriber for {topic}: {e}")
+
+
+def publish(topic, payload, include_self=False):
+    """Send ``payload`` to the other workers; optionally deliver it here as well"""
+    stats["published"] += 1
+    # Serialize first so local subscribers can't alter what the others get
+    message = json.dumps({"topic": topic, "payload": payload}).encode()
+    if include_self:
+        _deliver(topic, payload)
+    if _sock is None:
+        return
+    _send(_sock, message)
+
+
+def announce(topic, payload):
+    """publish() from a process that isn't a worker, e.g. a CLI script"""
+    if not os.path.isdir(BUS_DIR):
+        return
+    message = json.dumps({"topic": topic, "payload": payload}).encode()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        _send(sock, message)
+
+
+def _send(sock, message):
+    for name in os.listdir(BUS_DIR):
+        path = os.path.join(BUS_DIR, name)
+        if path == _sock_path or not name.endswith(".sock"):
+            continue
+        try:
+            sock.sendto(message, path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Socket left behind by a worker that has exited
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        except (BlockingIOError, OSError) as e:
+            stats["dropped"] += 1
+            logger.warning(f"Dropped bus message to {name}: {e}")
+
+
+def _receive():
+    while True:
+        try:
+            message = _sock.recv(4 * MAX_MESSAGE_BYTES)
+        except BlockingIOError:
+            return
+        stats["received"] += 1
+        try:
+            envelope = json.loads(message)
+        except ValueError:
+            continue
+        _deliver(envelope["topic"], envelope["payload"])
+
+
+async def start_bus(app, loop):
+    global _sock, _sock_path
+    os.makedirs(BUS_DIR, exist_ok=True)
+    _sock_path = os.path.join(BUS_DIR, f"{os.getpid()}.sock")
+    if os.path.exists(_sock_path):
+        os.unlink(_sock_path)
+    _sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    _sock.setblocking(False)
+    _sock.bind(_sock_path)
+    asyncio.get_running_loop().add_reader(_sock.fileno(), _receive)
+    logger.info(f"Worker bus listening on {_sock_path}")
+
+
+async def stop_bus(app, loop):
+    global _sock
+    if _sock is None:
+        return
+    asyncio.get_running_loop().remove_reader(_sock.fileno())
+    _sock.close()
+    _sock = None
+    if os.path.exists(_sock_path):
+        os.unlink(_sock_path)
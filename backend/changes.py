@@ -0,0 +1,73 @@
+# backend/changes.py
+"""
+Commit-time change capture.
+
+Rows inserted, updated or deleted through an ORM flush are collected per
+session and handed to the registered listeners once the transaction
+commits (never on rollback). Writes issued as plain statements (bulk
+DELETE/UPDATE) aren't seen by the flush, so those call record() themselves.
+
+Listeners are plain callables taking a list of Change tuples. They run
+inside the commit, so anything slow should be scheduled, not awaited.
+"""
+import logging
+from typing import NamedTuple, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+_listeners = []
+
+
+class Change(NamedTuple):
+    table: str
+    op: str  # "insert", "update" or "delete"
+    id: int
+    data: Optional[dict] = None
+
+
+def on_commit(listener):
+    """Register ``listener`` to receive each committed batch of changes"""
+    _listeners.append(listener)
+    return listener
+
+
+def record(session, table, op, row_id, data=None):
+    """Record a change made outside the ORM flush, e.g. by a DELETE statement"""
+    session.info.setdefault('pending_changes', []).append(
+        Change(table, op, row_id, data)
+    )
+
+
+def _snapshot(obj):
+    return obj.to_dict() if hasattr(obj, 'to_dict') else None
+
+
+@event.listens_for(Session, "after_flush")
+def _collect(session, flush_context):
+    for obj in session.new:
+        record(session, obj.__tablename__, "insert", obj.id, _snapshot(obj))
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            record(session, obj.__tablename__, "update", obj.id, _snapshot(obj))
+    for obj in session.deleted:
+        record(session, obj.__tablename__, "delete", obj.id, _snapshot(obj))
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch(session):
+    pending = session.info.pop('pending_changes', None)
+    if not pending:
+        return
+    for listener in _listeners:
+        try:
+            listener(pending)
+        except Exception as e:
+            logger.error(f"Error in change listener {listener.__name__}: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop('pending_changes', None)
@@ -0,0 +1,147 @@
+# backend/compression.py
+"""
+Content-negotiated response compression (zstd, brotli, gzip).
+
+Responses at least COMPRESSION_MIN_SIZE bytes long are compressed with the
+best encoding the client accepts. Bodies over COMPRESSION_THREAD_THRESHOLD
+are compressed in the default thread pool to keep the event loop free.
+
+Compressed variants are kept in a small LRU keyed by a digest of the body,
+so a hot response that is served repeatedly is compressed only once per
+encoding.
+
+brotli and zstd are used only if the `brotli` / `zstandard` packages are
+installed; gzip is always available.
+"""
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION = os.getenv('COMPRESSION', '1') == '1'
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_THREAD_THRESHOLD = int(os.getenv('COMPRESSION_THREAD_THRESHOLD', 64 * 1024))
+COMPRESSION_CACHE_SIZE = int(os.getenv('COMPRESSION_CACHE_SIZE', 256))
+GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))
+BROTLI_LEVEL = int(os.getenv('COMPRESSION_BROTLI_LEVEL', 5))
+ZSTD_LEVEL = int(os.getenv('COMPRESSION_ZSTD_LEVEL', 3))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+def _gzip(body):
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def _brotli(body):
+    return brotli.compress(body, quality=BROTLI_LEVEL)
+
+
+def _zstd(body):
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+
+
+# Server preference order, best first
+CODECS = OrderedDict()
+if zstandard is not None:
+    CODECS["zstd"] = _zstd
+if brotli is not None:
+    CODECS["br"] = _brotli
+CODECS["gzip"] = _gzip
+
+_cache = OrderedDict()
+stats = {"compressed": 0, "cache_hits": 0, "threaded": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def parse_accept_encoding(header):
+    """Map each accepted encoding to its q-value"""
+    accepted = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(header):
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+    candidates = [
+        (accepted.get(name, wildcard), -rank, name)
+        for rank, name in enumerate(CODECS)
+    ]
+    q, _, name = max(candidates)
+    return name if q > 0 else None
+
+
+async def compress(body, encoding):
+    key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+    cached = _cache.get(key)
+    if cached is not None:
+        _cache.move_to_end(key)
+        stats["cache_hits"] += 1
+        return cached
+
+    codec = CODECS[encoding]
+    if len(body) >= COMPRESSION_THREAD_THRESHOLD:
+        stats["threaded"] += 1
+        compressed = await asyncio.get_running_loop().run_in_executor(None, codec, body)
+    else:
+        compressed = codec(body)
+
+    stats["compressed"] += 1
+    stats["bytes_in"] += len(body)
+    stats["bytes_out"] += len(compressed)
+    _cache[key] = compressed
+    if len(_cache) > COMPRESSION_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return compressed
+
+
+def install(app):
+    if not COMPRESSION:
+        return
+    logger.info(f"Response compression enabled: {', '.join(CODECS)}")
+
+    @app.on_response(priority=-100)
+    async def compress_response(request, response):
+        body = response.body
+        if (
+            body is None
+            or len(body) < COMPRESSION_MIN_SIZE
+            or response.status < 200 or response.status == 204
+            or "content-encoding" in response.headers
+            or not (response.content_type or "").startswith(COMPRESSIBLE_TYPES)
+        ):
+            return
+
+        response.headers.add("Vary", "Accept-Encoding")
+        encoding = choose_encoding(request.headers.get("accept-encoding"))
+        if encoding is None:
+            return
+
+        response.body = await compress(body, encoding)
+        response.headers["Content-Encoding"] = encoding
+        response.headers.pop("content-length", None)
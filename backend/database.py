@@ -1,9 +1,12 @@
 # backend/database.py
 import os
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import sessionmaker, declarative_base
 import logging
 from dotenv import load_dotenv
+import query_log
 
 # Load environment variables
 load_dotenv()
@@ -14,44 +17,185 @@ logger = logging.getLogger(__name__)
 
 # Get the absolute path to your project's root directory
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
 
 # Get database configuration from environment variables
 DATABASE_DIR = os.path.join(BASE_DIR, os.getenv('DATABASE_DIR', 'data'))
 DATABASE_NAME = os.getenv('DATABASE_NAME', 'users.db')
 DATABASE_PATH = os.path.join(DATABASE_DIR, DATABASE_NAME)
 
-# Ensure data directory exists
-os.makedirs(DATABASE_DIR, exist_ok=True)
-
 # Construct database URL
 DATABASE_URL = f"sqlite+aiosqlite:///{DATABASE_PATH}"
 
-logger.info(f"Database path: {DATABASE_PATH}")
-logger.info(f"Database URL: {DATABASE_URL}")
-
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=True,
-    future=True
-)
+# WAL lets readers and the writer work concurrently; DELETE is SQLite's default
+DATABASE_JOURNAL_MODE = os.getenv('DATABASE_JOURNAL_MODE', 'WAL')
 
-async_session = sessionmaker(
-    engine,
-    class_=AsyncSession,
-    expire_on_commit=False
-)
+# Log every statement; query_log.py records timings without this
+SQL_ECHO = os.getenv('SQL_ECHO', '0') == '1'
 
 Base = declarative_base()
 
+# The engine and session factory are created on first use rather than at
+# import time, so importing models or routes stays cheap.
+_engine = None
+_async_session = None
+# Session that get_session() hands out inside shared_read_session()
+_shared_session = ContextVar('shared_session', default=None)
+# Session factory get_session() uses instead of the main database's; set
+# by shards.py to send a request to its agency's database
+_session_factory = ContextVar('session_factory', default=None)
+
+def enable_foreign_keys(dbapi_connection, connection_record):
+    """SQLite ignores FOREIGN KEY (and ON DELETE CASCADE) unless enabled per connection"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+def enable_wal(dbapi_connection, connection_record):
+    """Readers and the writer don't block each other in WAL mode, so a long
+    read (a streamed export, an analytics snapshot) doesn't lock out writes.
+    The mode is stored in the file; this only changes it the first time.
+    Run it after prefer_incremental_vacuum, which a new file must get first."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={DATABASE_JOURNAL_MODE}")
+    cursor.close()
+
+def prefer_incremental_vacuum(dbapi_connection, connection_record):
+    """New database files free deleted pages with PRAGMA incremental_vacuum
+    (see maintenance.py); existing files keep their mode until a VACUUM"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.close()
+
+def get_engine():
+    global _engine, _async_session
+    if _engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+        # Ensure data directory exists
+        os.makedirs(DATABASE_DIR, exist_ok=True)
+
+        logger.info(f"Database path: {DATABASE_PATH}")
+        logger.info(f"Database URL: {DATABASE_URL}")
+
+        _engine = create_async_engine(
+            DATABASE_URL,
+            echo=SQL_ECHO,
+            future=True
+        )
+        event.listen(_engine.sync_engine, "connect", enable_foreign_keys)
+        # auto_vacuum first: switching a new file to WAL fixes its header
+        event.listen(_engine.sync_engine, "connect", prefer_incremental_vacuum)
+        event.listen(_engine.sync_engine, "connect", enable_wal)
+        query_log.attach(_engine.sync_engine)
+
+        _async_session = sessionmaker(
+            _engine,
+            class_=AsyncSession,
+            expire_on_commit=False
+        )
+    return _engine
+
+def __getattr__(name):
+    # Keep `from database import engine` working without creating it at import
+    if name == 'engine':
+        return get_engine()
+    if name == 'async_session':
+        get_engine()
+        return _async_session
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def get_head_revision():
+    """Latest revision in migrations/versions"""
+    from alembic.script import ScriptDirectory
+    return ScriptDirectory(MIGRATIONS_DIR).get_current_head()
+
+class SchemaOutOfDate(RuntimeError):
+    """The database needs `alembic upgrade head` before the app can use it"""
+
+def sync_schema(connection, head):
+    """Create the schema in a new database file, or check an existing one
+    is at ``head``; create_all never touches a database that has tables"""
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    # Registers the tables on Base.metadata, for callers that haven't
+    import api.models.models  # noqa: F401
+
+    context = MigrationContext.configure(connection)
+    current = context.get_current_revision()
+    # By the model tables rather than the stamp alone: drop_all (see
+    # utils/reset_db.py) leaves alembic_version behind
+    existing = set(Base.metadata.tables) & set(inspect(connection).get_table_names())
+    if current == head and existing == set(Base.metadata.tables):
+        logger.info(f"Schema is at Alembic head ({head}); skipping create_all")
+        return
+    if existing:
+        # create_all would only add the missing tables (and their triggers)
+        # to tables that lack the columns those expect
+        path = connection.engine.url.database
+        raise SchemaOutOfDate(
+            f"Database {path} is at revision {current}, not head ({head}). "
+            f"Run `alembic -x db={path} upgrade head` from ./backend."
+        )
+
+    logger.info("Creating database tables...")
+    Base.metadata.create_all(connection)
+    logger.info("Database tables created successfully!")
+    # create_all just built the head schema, so record it as such
+    context.stamp(ScriptDirectory(MIGRATIONS_DIR), head)
+    logger.info(f"Stamped new database at Alembic head ({head})")
+
 async def init_db():
     try:
-        logger.info("Creating database tables...")
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
-        logger.info("Database tables created successfully!")
+        head = get_head_revision()
+        async with get_engine().begin() as conn:
+            await conn.run_sync(sync_schema, head)
     except Exception as e:
         logger.error(f"Error creating database tables: {e}")
         raise
 
+@asynccontextmanager
+async def _borrow(session):
+    # The owner of a shared session closes it, not the borrower
+    yield session
+
 def get_session():
-    return async_session()
\ No newline at end of file
+    factory = _session_factory.get()
+    if factory is not None:
+        return factory()
+    shared = _shared_session.get()
+    if shared is not None:
+        return _borrow(shared)
+    get_engine()
+    return _async_session()
+
+@asynccontextmanager
+async def shared_read_session():
+    """Serve every get_session() in this block (and this task) from one session.
+
+    Only for reads: handlers that commit should run outside the block.
+    """
+    async with get_session() as session:
+        token = _shared_session.set(session)
+        try:
+            yield session
+        finally:
+            _shared_session.reset(token)
+
+@contextmanager
+def separate_sessions():
+    """Opt out of an enclosing shared_read_session(), e.g. to commit"""
+    token = _shared_session.set(None)
+    try:
+        yield
+    finally:
+        _shared_session.reset(token)
+
+@contextmanager
+def using_sessions(factory):
+    """Make get_session() in this block open its sessions with ``factory``"""
+    token = _session_factory.set(factory)
+    try:
+        yield
+    finally:
+        _session_factory.reset(token)
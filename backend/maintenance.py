@@ -0,0 +1,288 @@
+# backend/maintenance.py
+"""
+Background SQLite maintenance (opt-out via MAINTENANCE=0).
+
+Five jobs, each on its own schedule:
+
+- optimize: PRAGMA optimize, SQLite's own check for stale planner stats.
+- analyze: ANALYZE on each table whose row count has drifted more than
+  MAINTENANCE_ANALYZE_DRIFT from what sqlite_stat1 last recorded.
+- vacuum: PRAGMA incremental_vacuum, handing free pages left by deletes
+  back to the filesystem MAINTENANCE_VACUUM_PAGES at a time. Databases
+  created by this app use auto_vacuum=INCREMENTAL (see database.py);
+  older files need one `VACUUM` after `PRAGMA auto_vacuum=INCREMENTAL`.
+- checkpoint: PRAGMA wal_checkpoint(PASSIVE) on databases in WAL mode,
+  TRUNCATE once the WAL is over MAINTENANCE_WAL_TRUNCATE_MB.
+- idempotency: deletes expired Idempotency-Keys (api/idempotency.py).
+
+Jobs run one at a time on a single thread of their own, at a lower OS
+priority, with their own sqlite3 connections and a short busy timeout:
+a job that finds the database locked gives up and counts as busy rather
+than making requests wait behind it. Only one worker runs them, the one
+holding DATABASE_DIR/maintenance.lock. The maintained databases are the
+main one, every shard when sharding, and (for checkpoints) the shared
+cache.
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import shards
+from database import DATABASE_DIR, DATABASE_PATH
+from shared_cache import SHARED_CACHE_PATH
+from api.idempotency import purge_expired
+
+logger = logging.getLogger(__name__)
+
+MAINTENANCE = os.getenv('MAINTENANCE', '1') == '1'
+MAINTENANCE_LOCK_PATH = os.path.join(DATABASE_DIR, 'maintenance.lock')
+# Seconds between runs of each job; 0 turns a job off
+SCHEDULES = {
+    "optimize": float(os.getenv('MAINTENANCE_OPTIMIZE_SECONDS', 3600)),
+    "analyze": float(os.getenv('MAINTENANCE_ANALYZE_SECONDS', 3600)),
+    "vacuum": float(os.getenv('MAINTENANCE_VACUUM_SECONDS', 600)),
+    "checkpoint": float(os.getenv('MAINTENANCE_CHECKPOINT_SECONDS', 60)),
+    "idempotency": float(os.getenv('MAINTENANCE_IDEMPOTENCY_SECONDS', 300)),
+}
+MAINTENANCE_BUSY_TIMEOUT_MS = int(os.getenv('MAINTENANCE_BUSY_TIMEOUT_MS', 100))
+# Rows ANALYZE samples per index (PRAGMA analysis_limit); 0 reads them all
+MAINTENANCE_ANALYSIS_LIMIT = int(os.getenv('MAINTENANCE_ANALYSIS_LIMIT', 1000))
+MAINTENANCE_ANALYZE_DRIFT = float(os.getenv('MAINTENANCE_ANALYZE_DRIFT', 0.1))
+MAINTENANCE_VACUUM_PAGES = int(os.getenv('MAINTENANCE_VACUUM_PAGES', 1000))
+MAINTENANCE_WAL_TRUNCATE_MB = float(os.getenv('MAINTENANCE_WAL_TRUNCATE_MB', 64))
+# Added to the maintenance thread's nice value
+MAINTENANCE_NICE = int(os.getenv('MAINTENANCE_NICE', 10))
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _connect(path):
+    connection = sqlite3.connect(
+        path, timeout=MAINTENANCE_BUSY_TIMEOUT_MS / 1000, isolation_level=None
+    )
+    connection.execute(f"PRAGMA analysis_limit={MAINTENANCE_ANALYSIS_LIMIT}")
+    return connection
+
+
+def _tables(connection):
+    return [
+        name for (name,) in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )
+    ]
+
+
+def _analyzed_rows(connection, table):
+    """Row count sqlite_stat1 holds for ``table``, or None if never analyzed"""
+    try:
+        row = connection.execute(
+            "SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1", (table,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None  # no sqlite_stat1 until the first ANALYZE
+    return int(row[0].split()[0]) if row else None
+
+
+def optimize(connection, path):
+    connection.execute("PRAGMA optimize")
+    return {}
+
+
+def analyze(connection, path):
+    analyzed = []
+    for table in _tables(connection):
+        rows = connection.execute(f'SELECT count(*) FROM "{table}"').fetchone()[0]
+        before = _analyzed_rows(connection, table)
+        if before is None and rows == 0:
+            continue
+        if before is None or abs(rows - before) > MAINTENANCE_ANALYZE_DRIFT * max(before, 1):
+            connection.execute(f'ANALYZE "{table}"')
+            analyzed.append(table)
+    return {"analyzed": analyzed}
+
+
+def vacuum(connection, path):
+    if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        return {"skipped": "auto_vacuum is not INCREMENTAL"}
+    free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0]
+    if free_pages:
+        # execute() steps a statement without result columns only once, freeing
+        # one page; executescript() runs it to the end
+        connection.executescript(f"PRAGMA incremental_vacuum({MAINTENANCE_VACUUM_PAGES})")
+    return {
+        "free_pages_before": free_pages,
+        "free_pages_after": connection.execute("PRAGMA freelist_count").fetchone()[0]
+    }
+
+
+def checkpoint(connection, path):
+    if connection.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+        return {"skipped": "not in WAL mode"}
+    wal_path = path + "-wal"
+    wal_bytes = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+    mode = "TRUNCATE" if wal_bytes > MAINTENANCE_WAL_TRUNCATE_MB * 2**20 else "PASSIVE"
+    busy, wal_pages, checkpointed = connection.execute(
+        f"PRAGMA wal_checkpoint({mode})"
+    ).fetchone()
+    return {
+        "mode": mode,
+        "wal_bytes": wal_bytes,
+        "busy": bool(busy),
+        "wal_pages": wal_pages,
+        "checkpointed": checkpointed
+    }
+
+
+JOBS = {
+    "optimize": optimize,
+    "analyze": analyze,
+    "vacuum": vacuum,
+    "checkpoint": checkpoint,
+    "idempotency": purge_expired,
+}
+
+
+def databases(job):
+    paths = [DATABASE_PATH]
+    if shards.SHARDING:
+        paths += [shards.shard_path(agency_id) for agency_id in shards.shard_ids()]
+    if job == "checkpoint" and os.path.exists(SHARED_CACHE_PATH):
+        paths.append(SHARED_CACHE_PATH)
+    return paths
+
+
+def run_job(job):
+    """Run ``job`` on every database; blocking, run it on the maintenance thread"""
+    results, busy = {}, 0
+    for path in databases(job):
+        name = os.path.relpath(path, DATABASE_DIR)
+        connection = _connect(path)
+        try:
+            results[name] = JOBS[job](connection, path)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            # Someone else is writing; try again next time
+            results[name] = {"busy": True}
+            busy += 1
+        finally:
+            connection.close()
+    return results, busy
+
+
+def lower_thread_priority():
+    """Executor initializer: renice the thread by MAINTENANCE_NICE"""
+    try:
+        # Linux applies nice values per thread
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), os.getpriority(
+            os.PRIO_PROCESS, threading.get_native_id()
+        ) + MAINTENANCE_NICE)
+    except (AttributeError, OSError) as e:
+        logger.info(f"Maintenance runs at normal priority: {e}")
+
+
+_executor = None
+_scheduler = None
+_lock_file = None
+_last_run = {}  # job -> monotonic time it last started
+stats = {
+    job: {
+        "every_seconds": seconds or None, "runs": 0, "busy": 0, "errors": 0,
+        "last_run_at": None, "last_ms": None, "last_result": None, "last_error": None
+    }
+    for job, seconds in SCHEDULES.items()
+}
+
+
+def _acquire_lock():
+    """Whether this worker is (now) the one running maintenance"""
+    global _lock_file
+    if _lock_file is not None:
+        return True
+    lock_file = open(MAINTENANCE_LOCK_PATH, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+    _lock_file = lock_file
+    logger.info(f"Worker {os.getpid()} runs database maintenance")
+    return True
+
+
+async def run(job):
+    """Run ``job`` now on the maintenance thread, recording its stats"""
+    job_stats = stats[job]
+    _last_run[job] = time.monotonic()
+    started = time.perf_counter()
+    try:
+        results, busy = await asyncio.get_running_loop().run_in_executor(
+            _executor, run_job, job
+        )
+    except Exception as e:
+        job_stats["errors"] += 1
+        job_stats["last_error"] = str(e)
+        logger.error(f"Maintenance job {job} failed: {e}")
+        return None
+    finally:
+        job_stats["runs"] += 1
+        job_stats["last_run_at"] = time.time()
+        job_stats["last_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    job_stats["busy"] += busy
+    job_stats["last_result"] = results
+    return results
+
+
+async def _run_periodically():
+    # First runs wait a full interval, so they stay out of the way of startup
+    for job in SCHEDULES:
+        _last_run[job] = time.monotonic()
+    while True:
+        await asyncio.sleep(1)
+        if not _acquire_lock():
+            continue
+        for job, seconds in SCHEDULES.items():
+            if seconds and time.monotonic() - _last_run[job] >= seconds:
+                await run(job)
+
+
+def running():
+    return _scheduler is not None
+
+
+def summary():
+    return {
+        "enabled": MAINTENANCE,
+        "runner": _lock_file is not None,
+        "pid": os.getpid(),
+        "jobs": stats
+    }
+
+
+async def start_maintenance(app, loop):
+    global _executor, _scheduler
+    if not MAINTENANCE:
+        return
+    _executor = ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix="maintenance", initializer=lower_thread_priority
+    )
+    _scheduler = asyncio.create_task(_run_periodically())
+
+
+async def stop_maintenance(app, loop):
+    global _executor, _scheduler, _lock_file
+    if _scheduler is not None:
+        _scheduler.cancel()
+        _scheduler = None
+    if _executor is not None:
+        # A running job finishes on its own; don't hold up shutdown for it
+        _executor.shutdown(wait=False)
+        _executor = None
+    if _lock_file is not None:
+        _lock_file.close()
+        _lock_file = None
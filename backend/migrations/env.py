@@ -11,6 +11,7 @@ import os
 import sys
 from api.models.models import Base
 from database import DATABASE_URL
+from backfill import PROGRESS_TABLE
 
 # this is the Alembic Config object
 config = context.config
@@ -20,6 +21,12 @@ config = context.config
 config.set_main_option('sqlalchemy.url', 
     DATABASE_URL.replace('sqlite+aiosqlite', 'sqlite'))
 
+# Migrate another database file, e.g. an agency shard (see shards.py):
+# alembic -x db=data/shards/agency_1.db upgrade head
+if context.get_x_argument(as_dictionary=True).get('db'):
+    config.set_main_option('sqlalchemy.url',
+        f"sqlite:///{context.get_x_argument(as_dictionary=True)['db']}")
+
 # Interpret the config file for Python logging
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
@@ -27,6 +34,11 @@ if config.config_file_name is not None:
 # Add your model's MetaData object here
 target_metadata = Base.metadata
 
+
+def include_object(object, name, type_, reflected, compare_to):
+    # backfill.py keeps its checkpoints in a table of its own; not a model
+    return not (type_ == "table" and name == PROGRESS_TABLE)
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode."""
     url = config.get_main_option("sqlalchemy.url")
@@ -50,9 +62,17 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
+        # Batch mode lets autogenerate emit SQLite-compatible ALTERs.
+        # PRAGMA foreign_keys stays off on this connection, so recreating a
+        # table during a batch migration doesn't fire ON DELETE CASCADE.
+        # One transaction per migration, so the write lock is released between
+        # them and a long backfill (backfill.py) doesn't hold back the rest.
         context.configure(
             connection=connection,
-            target_metadata=target_metadata
+            target_metadata=target_metadata,
+            render_as_batch=True,
+            include_object=include_object,
+            transaction_per_migration=True
         )
 
         with context.begin_transaction():
@@ -0,0 +1,56 @@
+"""on delete cascade
+
+Revision ID: 247326195e68
+Revises: 
+Create Date: 2026-10-19 13:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '247326195e68'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Tables created by create_all have unnamed foreign keys; this convention lets
+# batch mode name them on reflection so they can be dropped and recreated.
+naming_convention = {
+    "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
+}
+
+# (table, column, referred table)
+FOREIGN_KEYS = [
+    ("users", "travel_agency_id", "travel_agencies"),
+    ("itineraries", "user_id", "users"),
+    ("trips", "itinerary_id", "itineraries"),
+    ("lodgings", "itinerary_id", "itineraries"),
+]
+
+
+def recreate_foreign_keys(ondelete) -> None:
+    # SQLite can't alter constraints in place, so batch mode copies each table
+    for table, column, referred in FOREIGN_KEYS:
+        name = f"fk_{table}_{column}_{referred}"
+        with op.batch_alter_table(table, naming_convention=naming_convention) as batch_op:
+            batch_op.drop_constraint(name, type_="foreignkey")
+            batch_op.create_foreign_key(
+                name, referred, [column], ["id"], ondelete=ondelete
+            )
+
+
+def upgrade() -> None:
+    recreate_foreign_keys("CASCADE")
+    # Without these, every cascaded delete scans the whole child table
+    for table, column, _ in FOREIGN_KEYS:
+        op.create_index(f"ix_{table}_{column}", table, [column], if_not_exists=True)
+
+
+def downgrade() -> None:
+    for table, column, _ in FOREIGN_KEYS:
+        op.drop_index(f"ix_{table}_{column}", table_name=table, if_exists=True)
+    recreate_foreign_keys(None)
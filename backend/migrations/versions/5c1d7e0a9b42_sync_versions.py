@@ -0,0 +1,87 @@
+"""sync versions and tombstones
+
+Revision ID: 5c1d7e0a9b42
+Revises: 247326195e68
+Create Date: 2026-10-19 14:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1d7e0a9b42'
+down_revision: Union[str, None] = '247326195e68'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SYNC_TABLES = ("itineraries", "trips", "lodgings")
+
+
+def trigger_statements(table):
+    # Copy of api.models.models.sync_trigger_statements as of this revision
+    next_version = "UPDATE sync_state SET version = version + 1 WHERE id = 1;"
+    set_version = (
+        f"UPDATE {table} SET version = (SELECT version FROM sync_state WHERE id = 1) "
+        "WHERE id = NEW.id;"
+    )
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_insert AFTER INSERT ON {table} "
+        f"BEGIN {next_version} {set_version} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_update AFTER UPDATE ON {table} "
+        f"WHEN NEW.version IS OLD.version "
+        f"BEGIN {next_version} {set_version} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_delete AFTER DELETE ON {table} "
+        f"BEGIN {next_version} "
+        f"INSERT INTO sync_tombstones (version, table_name, row_id) "
+        f"SELECT version, '{table}', OLD.id FROM sync_state WHERE id = 1; END",
+    ]
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sync_state",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("version", sa.Integer(), nullable=False),
+    )
+    op.create_table(
+        "sync_tombstones",
+        sa.Column("version", sa.Integer(), primary_key=True),
+        sa.Column("table_name", sa.String(50), nullable=False),
+        sa.Column("row_id", sa.Integer(), nullable=False),
+    )
+
+    # Give existing rows distinct versions before the triggers take over
+    connection = op.get_bind()
+    version = 0
+    for table in SYNC_TABLES:
+        op.add_column(table, sa.Column("version", sa.Integer(), nullable=True))
+        connection.execute(
+            sa.text(f"UPDATE {table} SET version = id + :offset"), {"offset": version}
+        )
+        version = connection.execute(
+            sa.text(f"SELECT COALESCE(MAX(version), :offset) FROM {table}"),
+            {"offset": version}
+        ).scalar()
+        op.create_index(f"ix_{table}_version", table, ["version"])
+    connection.execute(
+        sa.text("INSERT INTO sync_state (id, version) VALUES (1, :version)"),
+        {"version": version}
+    )
+
+    for table in SYNC_TABLES:
+        for statement in trigger_statements(table):
+            op.execute(statement)
+
+
+def downgrade() -> None:
+    for table in SYNC_TABLES:
+        for trigger in ("insert", "update", "delete"):
+            op.execute(f"DROP TRIGGER IF EXISTS {table}_sync_{trigger}")
+        op.drop_index(f"ix_{table}_version", table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column("version")
+    op.drop_table("sync_tombstones")
+    op.drop_table("sync_state")
@@ -0,0 +1,29 @@
+"""timeline indexes
+
+Revision ID: 8d3f2a61c7b5
+Revises: 5c1d7e0a9b42
+Create Date: 2026-10-19 16:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d3f2a61c7b5'
+down_revision: Union[str, None] = '5c1d7e0a9b42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TIMELINE_TABLES = ("trips", "lodgings")
+
+
+def upgrade() -> None:
+    for table in TIMELINE_TABLES:
+        op.create_index(f"ix_{table}_itinerary_date", table, ["itinerary_id", "date_start"])
+
+
+def downgrade() -> None:
+    for table in TIMELINE_TABLES:
+        op.drop_index(f"ix_{table}_itinerary_date", table_name=table)
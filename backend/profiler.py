@@ -0,0 +1,285 @@
+# backend/profiler.py
+"""
+Request profiling by stack sampling.
+
+A background thread samples the event loop thread's stack. For each
+request task it records where the task is: the live stack if the task is
+running, or its chain of awaits (ending in e.g. "<awaiting Future>" while
+aiosqlite's thread runs a query) if it is suspended. Sampling is used
+because cProfile/setprofile would also pick up every other request
+interleaved on the loop.
+
+Two modes:
+
+* On demand: a request sent with "X-Profile: 1" by an admin is sampled
+  every PROFILE_REQUEST_INTERVAL_MS. The result is written to PROFILE_DIR
+  as a speedscope file (https://www.speedscope.app). The response's
+  X-Profile-Id header names the file, which /admin/profiles/<id> serves.
+* Always on: every PROFILE_SAMPLE_INTERVAL seconds, one sample of every
+  in-flight request is added to per-route stack counts in memory, for
+  /admin/profiles/routes. Set the interval to 0 to turn this off.
+"""
+import asyncio
+import json as jsonlib
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter, defaultdict
+
+from database import DATABASE_DIR
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.path.join(DATABASE_DIR, os.getenv('PROFILE_DIR', 'profiles'))
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 50))
+PROFILE_REQUEST_INTERVAL = float(os.getenv('PROFILE_REQUEST_INTERVAL_MS', 1)) / 1000
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 1.0))
+# Distinct stacks kept per route; further ones are counted as "<other>"
+PROFILE_MAX_STACKS = int(os.getenv('PROFILE_MAX_STACKS', 500))
+
+stats = {"request_profiles": 0, "background_samples": 0}
+
+
+def _label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def coroutine_chain(coro):
+    """(labels, awaited) for ``coro`` and the coroutines it is awaiting in turn"""
+    labels = []
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            return labels, coro
+        labels.append(_label(frame))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return labels, None
+
+
+def running_stack(frame, coro):
+    """Labels for the running task, outermost coroutine first"""
+    outer = getattr(coro, 'cr_frame', None)
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        if frame is outer:
+            return [_label(f) for f in reversed(frames)]
+        frame = frame.f_back
+    # The frames never reached the task: they run in a greenlet (SQLAlchemy's
+    # async bridge), whose stack starts fresh. Put the awaits in front.
+    labels, _ = coroutine_chain(coro)
+    return labels + [_label(f) for f in reversed(frames)]
+
+
+def awaiting_stack(coro):
+    """Labels for a suspended task, ending in what it's blocked on"""
+    labels, awaited = coroutine_chain(coro)
+    if awaited is not None:
+        labels.append(f"<awaiting {type(awaited).__name__}>")
+    return labels
+
+
+class RequestProfile:
+    def __init__(self, task, name):
+        self.task = task
+        self.name = name
+        self.id = uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.last_sample = self.started
+        self.samples = []  # (stack, weight in ms)
+
+    def add(self, stack, now):
+        self.samples.append((stack, (now - self.last_sample) * 1000))
+        self.last_sample = now
+
+    def speedscope(self):
+        frames, index, samples = [], {}, []
+        for stack, _ in self.samples:
+            for label in stack:
+                if label not in index:
+                    index[label] = len(frames)
+                    frames.append({"name": label})
+            samples.append([index[label] for label in stack])
+        weights = [weight for _, weight in self.samples]
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "profiler.py",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": self.name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights
+            }]
+        }
+
+
+class Sampler(threading.Thread):
+    def __init__(self, loop):
+        super().__init__(name="profiler", daemon=True)
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.routes = weakref.WeakKeyDictionary()  # request task -> route name
+        self.profiles = {}  # request task -> RequestProfile
+        self.route_stacks = defaultdict(Counter)
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stack_of(self, task):
+        current = asyncio.tasks._current_tasks.get(self.loop)
+        coro = task.get_coro()
+        if task is current:
+            frame = sys._current_frames().get(self.loop_thread)
+            return running_stack(frame, coro)
+        return awaiting_stack(coro)
+
+    def sample_background(self):
+        stats["background_samples"] += 1
+        for task, route in list(self.routes.items()):
+            stack = ";".join(self.stack_of(task))
+            counts = self.route_stacks[route]
+            if stack not in counts and len(counts) >= PROFILE_MAX_STACKS:
+                stack = "<other>"
+            counts[stack] += 1
+
+    def sample_profiles(self):
+        now = time.perf_counter()
+        for task, profile in list(self.profiles.items()):
+            profile.add(self.stack_of(task), now)
+
+    def run(self):
+        next_background = time.monotonic() + PROFILE_SAMPLE_INTERVAL
+        while not self._stop_event.is_set():
+            try:
+                if self.profiles:
+                    self.sample_profiles()
+                if PROFILE_SAMPLE_INTERVAL > 0 and time.monotonic() >= next_background:
+                    next_background = time.monotonic() + PROFILE_SAMPLE_INTERVAL
+                    self.sample_background()
+            except Exception as e:
+                # Stacks change underneath us; a failed sample is just skipped
+                logger.debug(f"Profiler sample failed: {e}")
+            self._stop_event.wait(PROFILE_REQUEST_INTERVAL if self.profiles else 0.05)
+
+
+sampler = None
+
+
+def save(profile):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{profile.id}.speedscope.json")
+    with open(path, 'w') as f:
+        jsonlib.dump(profile.speedscope(), f)
+    stats["request_profiles"] += 1
+
+    saved = sorted(
+        (entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".speedscope.json")),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    for entry in saved[:-PROFILE_KEEP]:
+        os.unlink(entry.path)
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for entry in os.scandir(PROFILE_DIR):
+        if entry.name.endswith(".speedscope.json"):
+            profiles.append({
+                "id": entry.name.split(".")[0],
+                "created_at": entry.stat().st_mtime,
+                "size": entry.stat().st_size
+            })
+    return sorted(profiles, key=lambda profile: profile["created_at"], reverse=True)
+
+
+def load_profile(profile_id):
+    """The saved speedscope document, or None"""
+    if not profile_id.isalnum():
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.speedscope.json")
+    try:
+        with open(path) as f:
+            return jsonlib.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def route_summary(route=None, top=20):
+    """Most frequent background-sampled stacks, per route"""
+    if sampler is None:
+        return {}
+    summary = {}
+    for name, counts in list(sampler.route_stacks.items()):
+        if route is not None and name != route:
+            continue
+        summary[name] = {
+            "samples": sum(counts.values()),
+            "stacks": [
+                {"stack": stack, "count": count}
+                for stack, count in counts.most_common(top)
+            ]
+        }
+    return summary
+
+
+def collapsed(route):
+    """Background samples for ``route`` in collapsed-stack format (flamegraph.pl)"""
+    if sampler is None:
+        return ""
+    counts = sampler.route_stacks.get(route, Counter())
+    return "".join(f"{stack} {count}\n" for stack, count in counts.items())
+
+
+def install(app, authorized):
+    """Register the profiling middleware; ``authorized(request)`` gates X-Profile"""
+
+    @app.on_request
+    async def start_profile(request):
+        if sampler is None or request.route is None:
+            return
+        task = asyncio.current_task()
+        sampler.routes[task] = request.route.name
+        if request.headers.get("x-profile") == "1" and authorized(request):
+            name = f"{request.method} {request.path}"
+            sampler.profiles[task] = RequestProfile(task, name)
+
+    @app.on_response
+    async def finish_profile(request, response):
+        if sampler is None:
+            return
+        task = asyncio.current_task()
+        sampler.routes.pop(task, None)
+        profile = sampler.profiles.pop(task, None)
+        if profile is not None:
+            try:
+                save(profile)
+                response.headers["X-Profile-Id"] = profile.id
+            except OSError as e:
+                logger.error(f"Error saving request profile: {e}")
+
+
+async def start_profiler(app, loop):
+    global sampler
+    sampler = Sampler(asyncio.get_running_loop())
+    sampler.start()
+
+
+async def stop_profiler(app, loop):
+    global sampler
+    if sampler is not None:
+        sampler.stop()
+        sampler.join(timeout=1)
+        sampler = None
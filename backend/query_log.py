@@ -0,0 +1,201 @@
+# backend/query_log.py
+"""
+Query observer: per-fingerprint timings and a slow-query log.
+
+Every statement run through an attached engine is timed and normalized
+into a fingerprint: literals become "?", and IN lists and multi-row
+VALUES collapse, so the same query with different arguments is counted
+once. Each fingerprint keeps its count, total and max time, a p95 over
+its most recent executions, and how much time each route spent on it.
+
+Statements slower than SLOW_QUERY_MS are logged together with the route
+they came from, and their EXPLAIN QUERY PLAN is captured. These are what
+/admin/queries/top and /admin/queries/slow report.
+
+This replaces echo=True, which logged every statement untimed. Set
+SQL_ECHO=1 to get that back.
+"""
+import logging
+import os
+import re
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from functools import lru_cache
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+QUERY_LOG = os.getenv('QUERY_LOG', '1') == '1'
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 100))
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', 100))
+QUERY_LOG_MAX_FINGERPRINTS = int(os.getenv('QUERY_LOG_MAX_FINGERPRINTS', 1000))
+# Executions per fingerprint the p95 is computed over
+TIMING_WINDOW = 512
+# Seconds before a fingerprint's plan is captured again
+PLAN_MAX_AGE = 300
+EXPLAINABLE = ("SELECT", "UPDATE", "DELETE", "WITH")
+
+# Route of the request being handled, set by the middleware in install()
+current_route = ContextVar('current_route', default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN \(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_ROWS = re.compile(r"(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+")
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement):
+    """``statement`` with literals and argument lists normalized away"""
+    sql = _SPACE.sub(" ", statement).strip()
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (?...)", sql)
+    return _ROWS.sub(r"\1, ...", sql)
+
+
+class QueryStats:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=TIMING_WINDOW)
+        self.route_time = Counter()
+        self.plan = None
+        self.plan_at = 0.0
+
+    def add(self, elapsed, route):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.recent.append(elapsed)
+        self.route_time[route or "(background)"] += elapsed
+
+    def p95(self):
+        ordered = sorted(self.recent)
+        return ordered[int(0.95 * (len(ordered) - 1))] if ordered else 0.0
+
+    def to_dict(self, db_total):
+        return {
+            "fingerprint": self.fingerprint,
+            "count": self.count,
+            "total_ms": round(self.total, 3),
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "p95_ms": round(self.p95(), 3),
+            "max_ms": round(self.max, 3),
+            "share": round(self.total / db_total, 4) if db_total else 0.0,
+            "routes": {
+                route: round(ms, 3) for route, ms in self.route_time.most_common(5)
+            },
+            "plan": self.plan
+        }
+
+
+queries = {}  # fingerprint -> QueryStats
+slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+stats = {"statements": 0, "slow": 0, "db_time_ms": 0.0}
+
+
+def explain(conn, statement, parameters):
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return [row[3] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    elapsed = (time.perf_counter() - started) * 1000
+    if statement.startswith("EXPLAIN"):
+        return
+
+    key = fingerprint(statement)
+    entry = queries.get(key)
+    if entry is None:
+        if len(queries) >= QUERY_LOG_MAX_FINGERPRINTS:
+            key = "<other>"
+            entry = queries.setdefault(key, QueryStats(key))
+        else:
+            entry = queries[key] = QueryStats(key)
+    route = current_route.get()
+    entry.add(elapsed, route)
+    stats["statements"] += 1
+    stats["db_time_ms"] += elapsed
+
+    if elapsed < SLOW_QUERY_MS:
+        return
+    stats["slow"] += 1
+    now = time.time()
+    if (
+        not executemany
+        and statement.lstrip().upper().startswith(EXPLAINABLE)
+        and now - entry.plan_at > PLAN_MAX_AGE
+    ):
+        try:
+            entry.plan = explain(conn, statement, parameters)
+            entry.plan_at = now
+        except Exception as e:
+            logger.debug(f"Could not explain slow query: {e}")
+    slow_queries.append({
+        "at": now,
+        "ms": round(elapsed, 3),
+        "route": route,
+        "fingerprint": key,
+        "plan": entry.plan
+    })
+    logger.warning(f"Slow query ({elapsed:.1f} ms) on {route or '(background)'}: {key}")
+
+
+def _on_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started'):
+        connection.info['query_started'].pop()
+
+
+def attach(sync_engine):
+    """Time every statement ``sync_engine`` runs"""
+    if not QUERY_LOG:
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_execute)
+    event.listen(sync_engine, "handle_error", _on_error)
+
+
+def top(limit=20, sort="total"):
+    key = {
+        "total": lambda entry: entry.total,
+        "max": lambda entry: entry.max,
+        "p95": lambda entry: entry.p95(),
+        "count": lambda entry: entry.count,
+    }[sort]
+    ranked = sorted(list(queries.values()), key=key, reverse=True)[:limit]
+    return [entry.to_dict(stats["db_time_ms"]) for entry in ranked]
+
+
+def reset():
+    queries.clear()
+    slow_queries.clear()
+    stats.update(statements=0, slow=0, db_time_ms=0.0)
+
+
+def install(app):
+    """Tag queries with the route of the request that ran them"""
+
+    @app.on_request
+    async def tag_route(request):
+        current_route.set(request.route.name if request.route else None)
+
+    @app.on_response
+    async def untag_route(request, response):
+        current_route.set(None)
@@ -1,16 +1,85 @@
-from sanic import Sanic
-from sanic_cors import CORS
-from api.routes import api
-from database import init_db
+import time
+_started_at = time.perf_counter()
+
+import startup_profile
+from startup_profile import StartupProfile
+
+profile = StartupProfile(_started_at)
+
+with profile.phase("imports"):
+    from sanic import Sanic
+    from sanic_cors import CORS
+    from api import init_app
+    from api.routes import api
+    from api.routes.admin import admin_bp, has_admin_token
+    import compression
+    import profiler
+    import query_log
+    import shards
+    import warmup
+    from profiler import start_profiler, stop_profiler
+    from database import init_db
+    from write_coalescer import start_write_coalescer, stop_write_coalescer
+    from shared_cache import start_shared_cache, stop_shared_cache
+    from bus import start_bus, stop_bus
+    from shards import start_shards, stop_shards
+    from analytics import start_analytics, stop_analytics
+    from api.route_graph import start_route_graph, stop_route_graph
+    from api.suggest import start_suggest, stop_suggest
+    from maintenance import start_maintenance, stop_maintenance
+    from backups import start_backups, stop_backups
 
 app = Sanic("user_management_app")
 CORS(app)
 
 @app.listener('before_server_start')
 async def setup_db(app, loop):
-    await init_db()
+    with profile.phase("db init"):
+        await init_db()
+
+@app.listener('before_server_start')
+async def warm_up(app, loop):
+    with profile.phase("warm-up"):
+        await warmup.warm_up(app, loop)
+
+app.register_listener(start_shards, 'after_server_start')
+app.register_listener(stop_shards, 'before_server_stop')
+app.register_listener(start_write_coalescer, 'after_server_start')
+app.register_listener(stop_write_coalescer, 'before_server_stop')
+app.register_listener(start_bus, 'after_server_start')
+app.register_listener(stop_bus, 'before_server_stop')
+app.register_listener(start_shared_cache, 'after_server_start')
+app.register_listener(stop_shared_cache, 'before_server_stop')
+app.register_listener(start_route_graph, 'after_server_start')
+app.register_listener(stop_route_graph, 'before_server_stop')
+app.register_listener(start_suggest, 'after_server_start')
+app.register_listener(stop_suggest, 'before_server_stop')
+app.register_listener(start_analytics, 'after_server_start')
+app.register_listener(stop_analytics, 'before_server_stop')
+app.register_listener(start_maintenance, 'after_server_start')
+app.register_listener(stop_maintenance, 'before_server_stop')
+app.register_listener(start_backups, 'after_server_start')
+app.register_listener(stop_backups, 'before_server_stop')
+app.register_listener(warmup.save_on_stop, 'before_server_stop')
+app.register_listener(start_profiler, 'after_server_start')
+app.register_listener(stop_profiler, 'before_server_stop')
+# Last: /ready turns healthy once everything above has started
+app.register_listener(warmup.mark_ready, 'after_server_start')
+
+with profile.phase("blueprint registration"):
+    app.blueprint(api)
+    app.blueprint(admin_bp)
+
+init_app(app)
+compression.install(app)
+# Only with the configured token; ADMIN_OPEN doesn't extend to X-Profile
+profiler.install(app, authorized=has_admin_token)
+query_log.install(app)
+shards.install(app)
+warmup.install(app)
 
-app.blueprint(api)
+if startup_profile.ENABLED:
+    startup_profile.install(app, profile)
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000, debug=True)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=8000, debug=True)
@@ -0,0 +1,346 @@
+# backend/shards.py
+"""
+Database-per-agency sharding (opt-in via SHARDING=1).
+
+The main database becomes the catalog: it holds the travel agencies.
+Each agency's users, itineraries, trips and lodgings live in their own
+file, SHARD_DIR/agency_<id>.db. Every shard has the full schema and a
+copy of its agency's row, so foreign keys, ON DELETE CASCADE and the sync
+triggers work unchanged. Writes to different agencies then take
+different SQLite locks, so write throughput scales with the number of
+agencies.
+
+Row ids carry their agency in the high bits: id = agency_id << 32 | n,
+where n comes from the shard's shard_sequences table. A trip, lodging,
+itinerary or user id therefore names its shard with no lookup. Keep
+agency ids below 2**21 so every id stays exact in JavaScript.
+
+Routing: middleware finds the request's agency in its route parameters
+(agency_id, user_id, itinerary_id, trip_id, lodging_id), in the agency_id
+query argument, or in the JSON body (travel_agency_id, user_id,
+itinerary_id). It then points get_session() at that shard. Requests with
+no agency use the catalog. List endpoints fan out to every shard with
+fetch_page()/fetch_all()/get_by_ids() and merge the results.
+
+New shards are created on first use for agencies that exist in the
+catalog. To move an existing single-file database into shards, use
+`python -m utils.shard_split`. The write coalescer is disabled in this
+mode, since its writer engine is bound to the single main database.
+"""
+import asyncio
+import logging
+import os
+from collections import defaultdict
+
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import sessionmaker
+
+import query_log
+from database import (
+    Base, DATABASE_DIR, SQL_ECHO, enable_foreign_keys, enable_wal, get_engine,
+    get_head_revision, prefer_incremental_vacuum, sync_schema, using_sessions
+)
+
+logger = logging.getLogger(__name__)
+
+SHARDING = os.getenv('SHARDING', '0') == '1'
+SHARD_DIR = os.path.join(DATABASE_DIR, os.getenv('SHARD_DIR', 'shards'))
+SHARD_ID_BITS = 32
+SHARDED_TABLES = ("users", "itineraries", "trips", "lodgings")
+
+# Where the routing middleware looks for the request's agency, and how to
+# get from each value to the agency id
+ROUTE_KEYS = {
+    "agency_id": lambda value: value,
+    "user_id": lambda value: shard_of(value),
+    "itinerary_id": lambda value: shard_of(value),
+    "trip_id": lambda value: shard_of(value),
+    "lodging_id": lambda value: shard_of(value),
+}
+BODY_KEYS = {
+    "travel_agency_id": lambda value: value,
+    "user_id": lambda value: shard_of(value),
+    "itinerary_id": lambda value: shard_of(value),
+}
+
+_engines = {}  # agency id -> AsyncEngine
+_sessionmakers = {}  # agency id -> sessionmaker
+_engine_agencies = {}  # sync Engine -> agency id, for assign_shard_id
+_creating = {}  # agency id -> Task creating that shard
+
+
+def shard_of(row_id):
+    """The agency id encoded in a sharded row id"""
+    return int(row_id) >> SHARD_ID_BITS
+
+
+def shard_path(agency_id):
+    return os.path.join(SHARD_DIR, f"agency_{agency_id}.db")
+
+
+def shard_ids():
+    """Agencies that have a shard, in id order (so row ids ascend across them)"""
+    if not os.path.isdir(SHARD_DIR):
+        return []
+    ids = []
+    for name in os.listdir(SHARD_DIR):
+        if name.startswith("agency_") and name.endswith(".db"):
+            ids.append(int(name[len("agency_"):-len(".db")]))
+    return sorted(ids)
+
+
+def _engine_for(agency_id):
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+    if agency_id not in _engines:
+        engine = create_async_engine(
+            f"sqlite+aiosqlite:///{shard_path(agency_id)}",
+            echo=SQL_ECHO,
+            future=True
+        )
+        event.listen(engine.sync_engine, "connect", enable_foreign_keys)
+        event.listen(engine.sync_engine, "connect", prefer_incremental_vacuum)
+        event.listen(engine.sync_engine, "connect", enable_wal)
+        query_log.attach(engine.sync_engine)
+        _engines[agency_id] = engine
+        _engine_agencies[engine.sync_engine] = agency_id
+        _sessionmakers[agency_id] = sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False
+        )
+    return _engines[agency_id]
+
+
+def sessions_for(agency_id):
+    """Session factory for an existing shard"""
+    _engine_for(agency_id)
+    return _sessionmakers[agency_id]
+
+
+def assign_shard_id(mapper, connection, target):
+    """Give rows inserted into a shard an id carrying the shard's agency"""
+    agency_id = _engine_agencies.get(connection.engine)
+    if agency_id is None or target.id is not None:
+        return
+    result = connection.execute(
+        text("UPDATE shard_sequences SET value = value + 1 WHERE name = :name RETURNING value"),
+        {"name": target.__tablename__}
+    )
+    target.id = (agency_id << SHARD_ID_BITS) | result.scalar_one()
+
+
+def _create_shard_schema(connection, agency, head):
+    sync_schema(connection, head)
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS shard_sequences "
+        "(name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+    ))
+    for table in SHARDED_TABLES:
+        connection.execute(
+            text("INSERT OR IGNORE INTO shard_sequences (name, value) VALUES (:name, 0)"),
+            {"name": table}
+        )
+    connection.execute(
+        text(
+            "INSERT OR IGNORE INTO travel_agencies (id, name, phone, address, logo) "
+            "VALUES (:id, :name, :phone, :address, :logo)"
+        ),
+        agency
+    )
+
+
+async def create_shard(agency_id):
+    """Create the shard for ``agency_id`` if the agency is in the catalog"""
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from api.models.models import TravelAgency
+
+    async with AsyncSession(get_engine()) as catalog:
+        agency = await catalog.get(TravelAgency, agency_id)
+    if agency is None:
+        return False
+
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    head = get_head_revision()
+    async with _engine_for(agency_id).begin() as conn:
+        await conn.run_sync(_create_shard_schema, agency.to_dict(), head)
+    logger.info(f"Created shard for agency {agency_id} at {shard_path(agency_id)}")
+    return True
+
+
+async def ensure_shard(agency_id):
+    """Whether ``agency_id`` has a shard, creating it if the agency exists"""
+    if agency_id in _engines or os.path.exists(shard_path(agency_id)):
+        return True
+    if agency_id not in _creating:
+        _creating[agency_id] = asyncio.ensure_future(create_shard(agency_id))
+        _creating[agency_id].add_done_callback(lambda _: _creating.pop(agency_id, None))
+    return await asyncio.shield(_creating[agency_id])
+
+
+async def drop_engine(agency_id):
+    engine = _engines.pop(agency_id, None)
+    _sessionmakers.pop(agency_id, None)
+    if engine is not None:
+        _engine_agencies.pop(engine.sync_engine, None)
+        await engine.dispose()
+
+
+async def drop_shard(agency_id):
+    """Delete an agency's shard (after the agency left the catalog)"""
+    await drop_engine(agency_id)
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        try:
+            os.unlink(shard_path(agency_id) + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def agency_for(request, kwargs):
+    """The agency a request belongs to, or None for catalog requests"""
+    for key, to_agency in ROUTE_KEYS.items():
+        if key in kwargs:
+            return to_agency(kwargs[key])
+    if request.args.get('agency_id', '').isdigit():
+        return int(request.args.get('agency_id'))
+    if request.method in ("POST", "PUT"):
+        try:
+            body = request.json
+        except Exception:
+            body = None
+        if isinstance(body, dict):
+            for key, to_agency in BODY_KEYS.items():
+                if isinstance(body.get(key), int):
+                    return to_agency(body[key])
+    return None
+
+
+async def route(request, kwargs):
+    """Session factory for the request's shard, or None to use the catalog"""
+    agency_id = agency_for(request, kwargs)
+    if agency_id is None or not await ensure_shard(agency_id):
+        # No such agency: the catalog's empty tables give the usual 404
+        return None
+    return sessions_for(agency_id)
+
+
+async def gather(operation, agency_ids=None):
+    """Run ``operation(session)`` on every shard concurrently; results in shard order"""
+    agency_ids = shard_ids() if agency_ids is None else agency_ids
+
+    async def run(agency_id):
+        async with sessions_for(agency_id)() as session:
+            return await operation(session)
+
+    return await asyncio.gather(*(run(agency_id) for agency_id in agency_ids))
+
+
+async def fetch_all(query):
+    """Rows of ``query`` from every shard, shard by shard"""
+    async def operation(session):
+        result = await session.execute(query)
+        return result.scalars().all()
+
+    return [row for rows in await gather(operation) for row in rows]
+
+
+async def fetch_page(model, query, count_query, page, per_page):
+    """(total, rows) for one page of ``query`` across all shards, ordered by id.
+
+    Shards hold disjoint, ascending id ranges, so the per-shard counts say
+    exactly which shards a page falls in; only those are read.
+    """
+    agency_ids = shard_ids()
+
+    async def count(session):
+        result = await session.execute(count_query)
+        return result.scalar()
+
+    counts = await gather(count, agency_ids)
+    offset, remaining = (page - 1) * per_page, per_page
+    slices = []
+    for agency_id, shard_count in zip(agency_ids, counts):
+        if remaining == 0:
+            break
+        if offset >= shard_count:
+            offset -= shard_count
+            continue
+        take = min(remaining, shard_count - offset)
+        slices.append((agency_id, offset, take))
+        offset, remaining = 0, remaining - take
+
+    async def read(agency_id, shard_offset, take):
+        async with sessions_for(agency_id)() as session:
+            result = await session.execute(
+                query.order_by(model.id).offset(shard_offset).limit(take)
+            )
+            return result.scalars().all()
+
+    pages = await asyncio.gather(*(read(*piece) for piece in slices))
+    return sum(counts), [row for rows in pages for row in rows]
+
+
+async def get_by_ids(model, ids, options=()):
+    """{id: row} for ``ids``, one IN query per shard involved"""
+    known = set(shard_ids())
+    by_shard = defaultdict(list)
+    for row_id in ids:
+        if shard_of(row_id) in known:
+            by_shard[shard_of(row_id)].append(row_id)
+
+    async def read(agency_id):
+        async with sessions_for(agency_id)() as session:
+            result = await session.execute(
+                select(model).filter(model.id.in_(by_shard[agency_id])).options(*options)
+            )
+            return result.scalars().all()
+
+    found = await asyncio.gather(*(read(agency_id) for agency_id in by_shard))
+    return {row.id: row for rows in found for row in rows}
+
+
+def install(app):
+    if not SHARDING:
+        return
+    # Only ORM inserts need this; the repo has no bulk INSERT statements
+    event.listen(Base, "before_insert", assign_shard_id, propagate=True)
+
+    @app.on_request
+    async def route_to_shard(request):
+        if request.route is None:
+            return
+        request.ctx.shard_scope = using_sessions(await route(request, request.match_info))
+        request.ctx.shard_scope.__enter__()
+
+    @app.on_response
+    async def unroute(request, response):
+        scope = getattr(request.ctx, 'shard_scope', None)
+        if scope is not None:
+            scope.__exit__(None, None, None)
+            request.ctx.shard_scope = None
+
+
+async def start_shards(app, loop):
+    if not SHARDING:
+        return
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    logger.info(f"Sharding by agency: {len(shard_ids())} shard(s) in {SHARD_DIR}")
+    # Same check as init_db(): refuses shards that need `alembic upgrade`
+    head = get_head_revision()
+    for agency_id in shard_ids():
+        async with _engine_for(agency_id).begin() as conn:
+            await conn.run_sync(sync_schema, head)
+
+    from sqlalchemy import func
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from api.models.models import User
+    async with AsyncSession(get_engine()) as catalog:
+        unsharded = (await catalog.execute(select(func.count(User.id)))).scalar()
+    if unsharded:
+        logger.warning(
+            f"The main database still holds {unsharded} user(s), which sharded "
+            "mode doesn't read. Run `python -m utils.shard_split` to move them."
+        )
+
+
+async def stop_shards(app, loop):
+    for agency_id in list(_engines):
+        await drop_engine(agency_id)
@@ -0,0 +1,250 @@
+# backend/shared_cache.py
+"""
+Cross-worker shared cache with an invalidation bus.
+
+Entries live in a small SQLite file next to the main database
+(SHARED_CACHE_NAME in DATABASE_DIR), so every worker on the host shares
+them. Keys are grouped into namespaces ("trips", "agencies", ...), and each
+namespace has a generation number stored alongside the entries. Keys embed
+the generation, so bumping it invalidates the whole namespace at once,
+including entries a slow reader stores after the write committed.
+
+Each worker keeps the generations in memory. When a worker commits a
+write, it bumps the affected generations and announces them on the worker
+bus (bus.py), so other workers drop their in-memory copy within
+milliseconds. In case a message is lost, in-memory generations are also
+re-read after GENERATION_MAX_AGE seconds.
+
+The sqlite3 calls run on a thread of the worker's own, so contention for
+the cache file never blocks the event loop. Invalidations are written
+there too; reads on the writing worker wait for them to land.
+
+Opt-in via SHARED_CACHE=1.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bus
+import changes
+from database import DATABASE_DIR
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE = os.getenv('SHARED_CACHE', '0') == '1'
+SHARED_CACHE_TTL = float(os.getenv('SHARED_CACHE_TTL', 300))
+SHARED_CACHE_PATH = os.path.join(DATABASE_DIR, os.getenv('SHARED_CACHE_NAME', 'cache.db'))
+GENERATION_MAX_AGE = 1.0
+PRUNE_INTERVAL = 60.0
+
+# Namespaces to invalidate when a table changes. Agency endpoints embed
+# users, itineraries, trips and lodgings, so every table touches "agencies".
+# The list endpoints embed related rows via ?include= (see api/includes.py).
+DEPENDENT_NAMESPACES = {
+    "trips": ["trips", "itineraries", "agencies"],
+    "lodgings": ["lodgings", "itineraries", "agencies"],
+    "itineraries": ["itineraries", "trips", "lodgings", "agencies"],
+    "users": ["users", "itineraries", "agencies"],
+    "travel_agencies": ["agencies"],
+}
+
+# Child tables removed by ON DELETE CASCADE when a row is deleted
+CASCADES = {
+    "travel_agencies": ["users"],
+    "users": ["itineraries"],
+    "itineraries": ["trips", "lodgings"],
+}
+
+
+def affected_namespaces(change_list):
+    namespaces = set()
+    tables = [(change.table, change.op) for change in change_list]
+    while tables:
+        table, op = tables.pop()
+        namespaces.update(DEPENDENT_NAMESPACES.get(table, []))
+        if op == "delete":
+            tables.extend((child, "delete") for child in CASCADES.get(table, []))
+    return namespaces
+
+
+class SharedCache:
+    def __init__(self, path=SHARED_CACHE_PATH):
+        self.path = path
+        self._db = None
+        # sqlite3 calls block, so they run on a thread of their own: a worker
+        # waiting on the cache file's write lock mustn't stall the event loop
+        self._executor = None
+        self._generations = {}  # namespace -> (generation, fetched_at)
+        self._pending = {}  # namespace -> future of a bump not yet written
+        self._last_prune = 0.0
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "bus_received": 0}
+
+    @property
+    def running(self):
+        return self._executor is not None
+
+    def _run(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries "
+            "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache_generations "
+            "(namespace TEXT PRIMARY KEY, generation INTEGER NOT NULL)"
+        )
+
+    async def open(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-cache")
+        await self._run(self._open)
+        logger.info(f"Shared cache at {self.path}")
+
+    def _close(self):
+        self._db.close()
+        self._db = None
+
+    async def close(self):
+        if self._executor is None:
+            return
+        executor, self._executor = self._executor, None
+        await asyncio.get_running_loop().run_in_executor(executor, self._close)
+        executor.shutdown(wait=False)
+
+    def _read_generation(self, namespace):
+        row = self._db.execute(
+            "SELECT generation FROM cache_generations WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    async def generation(self, namespace):
+        pending = self._pending.get(namespace)
+        if pending is not None:
+            # This worker's own write: don't read from before its bump
+            await asyncio.wait([pending])
+        cached = self._generations.get(namespace)
+        if cached is not None and time.monotonic() - cached[1] < GENERATION_MAX_AGE:
+            return cached[0]
+        generation = await self._run(self._read_generation, namespace)
+        self._generations[namespace] = (generation, time.monotonic())
+        return generation
+
+    def _get(self, key):
+        row = self._db.execute(
+            "SELECT value FROM cache_entries WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    async def get(self, namespace, key):
+        value = await self._run(self._get, f"{namespace}:{await self.generation(namespace)}:{key}")
+        if value is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return value
+
+    def _set(self, key, value, expires_at):
+        self._db.execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, expires_at)
+        )
+        now = time.time()
+        if now - self._last_prune > PRUNE_INTERVAL:
+            self._last_prune = now
+            self._db.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,))
+
+    async def set(self, namespace, key, value, generation, ttl=SHARED_CACHE_TTL):
+        """Store ``value`` under the generation that was current when it was read"""
+        await self._run(
+            self._set, f"{namespace}:{generation}:{key}", value, time.time() + ttl
+        )
+
+    def _bump(self, namespaces):
+        bumped = {}
+        for namespace in namespaces:
+            self._db.execute(
+                "INSERT INTO cache_generations (namespace, generation) VALUES (?, 1) "
+                "ON CONFLICT(namespace) DO UPDATE SET generation = generation + 1",
+                (namespace,)
+            )
+            bumped[namespace] = self._db.execute(
+                "SELECT generation FROM cache_generations WHERE namespace = ?", (namespace,)
+            ).fetchone()[0]
+        return bumped
+
+    def invalidate(self, namespaces):
+        """Bump each namespace's generation and tell the other workers.
+        Returns at once; reads on this worker wait for the bump."""
+        future = asyncio.ensure_future(self._run(self._bump, list(namespaces)))
+        for namespace in namespaces:
+            self._pending[namespace] = future
+        future.add_done_callback(self._bumped)
+        return future
+
+    def _bumped(self, future):
+        for namespace, pending in list(self._pending.items()):
+            if pending is future:
+                del self._pending[namespace]
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error(f"Error invalidating shared cache: {future.exception()}")
+            return
+        bumped = future.result()
+        now = time.monotonic()
+        for namespace, generation in bumped.items():
+            self._generations[namespace] = (generation, now)
+        self.stats["invalidations"] += len(bumped)
+        bus.publish("cache.generations", bumped)
+
+    def receive_generations(self, generations):
+        self.stats["bus_received"] += 1
+        now = time.monotonic()
+        for namespace, generation in generations.items():
+            current = self._generations.get(namespace)
+            if current is None or current[0] < generation:
+                self._generations[namespace] = (generation, now)
+
+
+def announce_invalidation(namespaces):
+    """invalidate() from a process that isn't a worker, e.g. a CLI script; blocking"""
+    if not os.path.exists(SHARED_CACHE_PATH):
+        return {}
+    outside = SharedCache()
+    outside._open()
+    try:
+        bumped = outside._bump(namespaces)
+    finally:
+        outside._close()
+    bus.announce("cache.generations", bumped)
+    return bumped
+
+
+cache = SharedCache()
+bus.subscribe("cache.generations", cache.receive_generations)
+
+
+@changes.on_commit
+def invalidate_on_commit(change_list):
+    if not cache.running:
+        return
+    namespaces = affected_namespaces(change_list)
+    if namespaces:
+        cache.invalidate(namespaces)
+
+
+async def start_shared_cache(app, loop):
+    if SHARED_CACHE:
+        await cache.open()
+
+
+async def stop_shared_cache(app, loop):
+    await cache.close()
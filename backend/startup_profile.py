@@ -0,0 +1,63 @@
+# backend/startup_profile.py
+"""
+Phase-by-phase startup timings, enabled with `python server.py --startup-profile`
+(or STARTUP_PROFILE=1).
+
+Each worker process reports its own boot phases once the server has started,
+and the duration of the first request it serves.
+"""
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+ENABLED = '--startup-profile' in sys.argv or os.getenv('STARTUP_PROFILE') == '1'
+
+
+class StartupProfile:
+    def __init__(self, started_at):
+        self.started_at = started_at
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    def report(self, title):
+        lines = [f"Startup profile [pid {os.getpid()}] - {title}"]
+        for name, seconds in self.phases:
+            lines.append(f"  {name:<24} {seconds * 1000:9.1f} ms")
+        total = time.perf_counter() - self.started_at
+        lines.append(f"  {'total since launch':<24} {total * 1000:9.1f} ms")
+        print("\n".join(lines), file=sys.stderr, flush=True)
+
+
+def install(app, profile):
+    """Report boot phases after startup and time the first request served"""
+    first_request = {}
+
+    @app.listener('after_server_start')
+    async def report_boot(app, loop):
+        profile.report("server started")
+
+    @app.on_request(priority=1000)
+    async def start_first_request(request):
+        if not first_request:
+            first_request["start"] = time.perf_counter()
+
+    @app.on_response(priority=-1000)
+    async def finish_first_request(request, response):
+        if "start" in first_request and "done" not in first_request:
+            first_request["done"] = True
+            profile.record(
+                f"first request {request.path}",
+                time.perf_counter() - first_request["start"]
+            )
+            profile.report("first request served")
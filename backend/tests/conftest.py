@@ -0,0 +1,52 @@
+# backend/tests/conftest.py
+"""
+The tests run the real app against a freshly seeded SQLite database in a
+temporary DATABASE_DIR. Settings are read when modules are imported, so
+they are set here, before anything from the app is.
+
+Run from ./backend: python -m pytest
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+os.environ["DATABASE_DIR"] = tempfile.mkdtemp(prefix="sanic_app_tests_")
+# Background jobs that would only slow the tests down
+for _name in ("ANALYTICS", "MAINTENANCE", "WARMUP"):
+    os.environ[_name] = "0"
+os.environ["PROFILE_SAMPLE_INTERVAL"] = "0"
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def client(loop):
+    """A test client for one server that serves every test in the run"""
+    from sanic_testing.reusable import ReusableClient
+
+    import seed
+    from server import app
+
+    loop.run_until_complete(seed.seed_database())
+    with ReusableClient(app, loop=loop) as client:
+        yield client
+
+
+@pytest.fixture
+def db(client):
+    """A plain sqlite3 connection to the database the server uses"""
+    from database import DATABASE_PATH
+
+    connection = sqlite3.connect(DATABASE_PATH)
+    connection.row_factory = sqlite3.Row
+    yield connection
+    connection.close()
@@ -0,0 +1,75 @@
+# backend/tests/test_backfill.py
+"""Chunked, resumable backfills (backfill.py), on a database file of their own"""
+import sqlite3
+
+import pytest
+
+import backfill
+
+SET = "doubled = value * 2"
+
+
+class Stopped(Exception):
+    """Stands in for Ctrl-C or a crash partway through"""
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "backfill.db")
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, value INTEGER, doubled INTEGER)")
+        connection.executemany(
+            "INSERT INTO items (id, value) VALUES (?, ?)", [(n, n) for n in range(1, 11)]
+        )
+    return path
+
+
+def query(path, sql):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(sql).fetchall()
+    finally:
+        connection.close()
+
+
+def run(path, set_sql=SET, **options):
+    return backfill.run(path, "doubled", "items", set_sql, batch_rows=3, sleep_ms=0, **options)
+
+
+def test_stopped_backfill_resumes_after_its_last_chunk(path, monkeypatch):
+    chunk = backfill._chunk
+    calls = []
+
+    def stopping_chunk(*args):
+        # args[6] is the last_id the chunk starts after
+        calls.append(args[6])
+        if len(calls) == 3:
+            raise Stopped()
+        return chunk(*args)
+
+    monkeypatch.setattr(backfill, "_chunk", stopping_chunk)
+    with pytest.raises(Stopped):
+        run(path)
+    assert query(path, "SELECT last_id, rows, finished_at FROM backfill_progress") == [(6, 6, None)]
+    assert query(path, "SELECT id FROM items WHERE doubled IS NOT NULL") == [(n,) for n in range(1, 7)]
+
+    progress = run(path)
+    assert calls[3:] == [6, 9, 10]
+    assert progress["done"] and progress["rows"] == 10 and progress["chunks"] == 2
+    assert query(path, "SELECT count(*) FROM items WHERE doubled = value * 2") == [(10,)]
+    # Done: running it again changes nothing
+    assert run(path)["chunks"] == 0
+
+
+def test_changed_definition_is_refused_unless_restarted(path):
+    run(path)
+    with pytest.raises(backfill.BackfillError, match="restart it"):
+        run(path, "doubled = value * 3")
+    assert query(path, "SELECT count(*) FROM items WHERE doubled = value * 2") == [(10,)]
+
+    progress = run(path, "doubled = value * 3", restart=True)
+    assert progress["done"] and progress["rows"] == 10
+    assert query(path, "SELECT definition FROM backfill_progress") == [
+        ('UPDATE "items" SET doubled = value * 3',)
+    ]
+    assert query(path, "SELECT count(*) FROM items WHERE doubled = value * 3") == [(10,)]
@@ -0,0 +1,74 @@
+# backend/tests/test_backups.py
+"""Online backups (backups.py), restoring them (utils/backup.py) and reset_db"""
+import os
+import sqlite3
+
+import pytest
+
+import backups
+from database import DATABASE_PATH
+from utils import backup as backup_cli
+from utils import reset_db
+
+
+@pytest.fixture
+def backup_dir(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(backups, "BACKUP_DIR", str(tmp_path / "backups"))
+    monkeypatch.setattr(backups, "BACKUP_LOCK_PATH", str(tmp_path / "backups" / "backup.lock"))
+    return tmp_path / "backups"
+
+
+def dump(path):
+    connection = sqlite3.connect(path)
+    try:
+        return list(connection.iterdump())
+    finally:
+        connection.close()
+
+
+def test_backup_restores_to_an_identical_database(backup_dir, tmp_path, monkeypatch, db, capsys):
+    before = dump(DATABASE_PATH)
+    manifest = backups.take_backup()
+    assert [m["name"] for m in backups.list_backups()] == [manifest["name"]]
+    assert list(manifest["files"]) == ["users.db"]
+
+    # Written after the backup, so not in it
+    db.execute("INSERT INTO travel_agencies (name) VALUES ('After the backup')")
+    db.commit()
+    try:
+        restored_dir = tmp_path / "restored"
+        monkeypatch.setattr(backup_cli, "DATABASE_DIR", str(restored_dir))
+        backup_cli.restore(manifest["name"])
+        restored = restored_dir / "users.db"
+        assert dump(restored) == before
+
+        # Restoring over an existing file replaces its contents
+        with sqlite3.connect(restored) as connection:
+            connection.execute("DELETE FROM trips")
+        backup_cli.restore(manifest["name"])
+        assert dump(restored) == before
+    finally:
+        db.execute("DELETE FROM travel_agencies WHERE name = 'After the backup'")
+        db.commit()
+    assert "Restored users.db" in capsys.readouterr().out
+
+
+def test_backups_are_looked_up_by_name_only(backup_dir):
+    name = backups.take_backup()["name"]
+    assert backups.backup_path(name, "users.db") == os.path.join(backup_dir, name, "users.db")
+    for bad in ("../backups", ".partial", "no-such-backup"):
+        with pytest.raises(backups.BackupError):
+            backups.backup_path(bad)
+    with pytest.raises(SystemExit):
+        backup_cli.restore("no-such-backup")
+
+
+def test_reset_db_refuses_without_a_backup(loop, backup_dir, db):
+    users = db.execute("SELECT count(*) FROM users").fetchone()[0]
+    # Another backup holds the lock, so none can be taken now
+    with backups.backup_lock() as locked:
+        assert locked
+        with pytest.raises(SystemExit, match="Another backup is in progress"):
+            loop.run_until_complete(reset_db.reset_database())
+    assert db.execute("SELECT count(*) FROM users").fetchone()[0] == users
+    assert backups.list_backups() == []
@@ -0,0 +1,226 @@
+# backend/tests/test_idempotency.py
+"""Idempotency-Key on the create endpoints (api/idempotency.py)"""
+import asyncio
+import json as jsonlib
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from sanic import json
+
+from api import idempotency
+from api.idempotency import HEADER, idempotent
+
+TRIP = {
+    "itinerary_id": 1, "date_start": "2024-08-01", "date_end": "2024-08-02",
+    "mode": "bus", "location_start": "Porto", "location_end": "Braga"
+}
+SCOPE = "tests.create"
+
+
+def new_key():
+    return str(uuid.uuid4())
+
+
+def post_trip(client, key, body=TRIP):
+    _, response = client.post("/api/trips/", json=body, headers={HEADER: key})
+    return response
+
+
+def stored(db, key):
+    return db.execute("SELECT * FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+
+
+def fake_request(key, body=b"{}"):
+    """What idempotent() reads from a request, for calling it directly"""
+    return SimpleNamespace(
+        headers={HEADER: key}, name=SCOPE, method="POST", path="/tests", body=body
+    )
+
+
+class SlowHandler:
+    """A handler that answers once released, counting its calls"""
+
+    def __init__(self, status=201):
+        self.status = status
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self, request):
+        self.calls += 1
+        await self.release.wait()
+        return json({"call": self.calls}, status=self.status)
+
+
+async def until_claimed(key):
+    while (SCOPE, key) not in idempotency._in_flight:
+        await asyncio.sleep(0.001)
+
+
+def test_retry_gets_the_first_response(client, db):
+    key = new_key()
+    first = post_trip(client, key)
+    retry = post_trip(client, key)
+
+    assert first.status == retry.status == 201
+    assert retry.json == first.json
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    trip_id = first.json["data"]["id"]
+    assert db.execute(
+        "SELECT count(*) FROM trips WHERE location_start = 'Porto' AND id >= ?", (trip_id,)
+    ).fetchone()[0] == 1
+    assert stored(db, key)["status"] == 201
+
+
+def test_same_key_with_another_body_is_rejected(client, db):
+    key = new_key()
+    assert post_trip(client, key).status == 201
+    response = post_trip(client, key, {**TRIP, "location_end": "Lisbon"})
+    assert response.status == 422
+    # Keys are per endpoint
+    _, response = client.post("/api/lodgings/", json={
+        "itinerary_id": 1, "name": "Casa", "date_start": "2024-08-01",
+        "date_end": "2024-08-02", "room_count": 1
+    }, headers={HEADER: key})
+    assert response.status == 201
+
+
+def test_invalid_keys(client):
+    assert post_trip(client, "").status == 400
+    assert post_trip(client, "k" * (idempotency.MAX_KEY_LENGTH + 1)).status == 400
+
+
+def test_server_errors_release_the_key(client, db):
+    key = new_key()
+    # Trip() doesn't take unknown columns: the handler answers 500
+    broken = {**TRIP, "no_such_column": 1}
+    assert post_trip(client, key, broken).status == 500
+    assert stored(db, key) is None
+    # Not replayed: the retry runs again
+    retry = post_trip(client, key, broken)
+    assert retry.status == 500 and "Idempotent-Replayed" not in retry.headers
+    # And the key is free for a corrected request
+    assert post_trip(client, key).status == 201
+
+
+def test_duplicate_on_the_same_worker_waits_for_the_first(loop, client, db):
+    handler = SlowHandler()
+    wrapped = idempotent(handler)
+    key = new_key()
+
+    async def scenario():
+        first = asyncio.ensure_future(wrapped(fake_request(key)))
+        await until_claimed(key)
+        duplicate = asyncio.ensure_future(wrapped(fake_request(key)))
+        other_body = await wrapped(fake_request(key, b'{"other": true}'))
+        await asyncio.sleep(0.05)
+        assert not duplicate.done()
+        handler.release.set()
+        return await first, await duplicate, other_body
+
+    first, duplicate, other_body = loop.run_until_complete(scenario())
+    assert handler.calls == 1
+    assert first.status == duplicate.status == 201
+    assert duplicate.body == first.body
+    assert duplicate.headers["Idempotent-Replayed"] == "true"
+    assert other_body.status == 422
+    assert stored(db, key)["status"] == 201
+
+
+def test_duplicate_retries_after_the_first_fails(loop, client, db):
+    handler = SlowHandler(status=503)
+    wrapped = idempotent(handler)
+    key = new_key()
+
+    async def scenario():
+        first = asyncio.ensure_future(wrapped(fake_request(key)))
+        await until_claimed(key)
+        duplicate = asyncio.ensure_future(wrapped(fake_request(key)))
+        await asyncio.sleep(0.05)
+        handler.release.set()
+        return await first, await duplicate
+
+    first, duplicate = loop.run_until_complete(scenario())
+    # The duplicate didn't get the 503 replayed; it ran the handler itself
+    assert handler.calls == 2
+    assert "Idempotent-Replayed" not in duplicate.headers
+    assert stored(db, key) is None
+
+
+def claim_elsewhere(db, key, body=b"{}", expires_in=60):
+    """A claim as another worker leaves it while its request runs"""
+    now = time.time()
+    db.execute(
+        "INSERT INTO idempotency_keys (scope, key, fingerprint, created_at, expires_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (SCOPE, key, idempotency.fingerprint(fake_request(key, body)), now, now + expires_in)
+    )
+    db.commit()
+
+
+def test_duplicate_polls_for_another_workers_response(loop, client, db, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_POLL_MS", 10)
+    handler = SlowHandler()
+    handler.release.set()
+    wrapped = idempotent(handler)
+    key = new_key()
+    claim_elsewhere(db, key)
+
+    async def scenario():
+        duplicate = asyncio.ensure_future(wrapped(fake_request(key)))
+        await asyncio.sleep(0.1)
+        assert not duplicate.done()
+        # The other worker finishes and stores its response
+        db.execute(
+            "UPDATE idempotency_keys SET status = 201, headers = ?, content_type = ?, "
+            "body = ?, expires_at = ? WHERE key = ?",
+            (jsonlib.dumps({}), "application/json", b'{"from": "elsewhere"}',
+             time.time() + 3600, key)
+        )
+        db.commit()
+        return await duplicate
+
+    response = loop.run_until_complete(scenario())
+    assert handler.calls == 0
+    assert response.status == 201
+    assert response.body == b'{"from": "elsewhere"}'
+    assert response.headers["Idempotent-Replayed"] == "true"
+
+
+def test_other_workers_request_running_too_long_gets_409(loop, client, db, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_POLL_MS", 10)
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT_SECONDS", 0.2)
+    handler = SlowHandler()
+    key = new_key()
+    claim_elsewhere(db, key)
+
+    response = loop.run_until_complete(idempotent(handler)(fake_request(key)))
+    assert response.status == 409
+    assert response.headers["Retry-After"] == "1"
+    assert handler.calls == 0
+
+
+def test_abandoned_claim_is_taken_over(loop, client, db):
+    handler = SlowHandler()
+    handler.release.set()
+    key = new_key()
+    # Its worker died: the lock deadline has passed
+    claim_elsewhere(db, key, expires_in=-1)
+
+    response = loop.run_until_complete(idempotent(handler)(fake_request(key)))
+    assert response.status == 201
+    assert handler.calls == 1
+    assert stored(db, key)["status"] == 201
+
+
+def test_handler_exception_releases_the_key(loop, client, db):
+    async def handler(request):
+        raise RuntimeError("boom")
+
+    key = new_key()
+    with pytest.raises(RuntimeError):
+        loop.run_until_complete(idempotent(handler)(fake_request(key)))
+    assert stored(db, key) is None
+    assert (SCOPE, key) not in idempotency._in_flight
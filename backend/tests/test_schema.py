@@ -0,0 +1,121 @@
+# backend/tests/test_schema.py
+"""database.sync_schema() and the migrations, on database files of their own"""
+import argparse
+import os
+import sqlite3
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, text
+
+import shards
+from database import SchemaOutOfDate, get_head_revision, sync_schema
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def alembic(path, *args):
+    """Run an alembic command on the database file at ``path``"""
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BACKEND_DIR, "migrations"))
+    config.cmd_opts = argparse.Namespace(x=[f"db={path}"])
+    getattr(command, args[0])(config, *args[1:])
+
+
+def run_sync_schema(path):
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        with engine.begin() as connection:
+            sync_schema(connection, get_head_revision())
+    finally:
+        engine.dispose()
+
+
+def objects(path, kind):
+    with sqlite3.connect(path) as connection:
+        return {row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = ?", (kind,)
+        )}
+
+
+def insert_trip(path):
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute("INSERT INTO travel_agencies (id, name) VALUES (1, 'A')")
+        connection.execute(
+            "INSERT INTO users (id, name, email, travel_agency_id) VALUES (1, 'U', 'u@example.com', 1)"
+        )
+        connection.execute(
+            "INSERT INTO itineraries (id, tour_name, date_start, date_end, user_id) "
+            "VALUES (1, 'T', '2024-01-01', '2024-01-02', 1)"
+        )
+        connection.execute(
+            "INSERT INTO trips (itinerary_id, date_start, date_end, location_start, location_end) "
+            "VALUES (1, '2024-01-01', '2024-01-02', 'A', 'B')"
+        )
+        connection.commit()
+        return connection.execute("SELECT version FROM trips").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_new_database_gets_the_head_schema(tmp_path):
+    path = tmp_path / "new.db"
+    run_sync_schema(path)
+    assert {"sync_state", "sync_tombstones", "idempotency_keys"} <= objects(path, "table")
+    assert len(objects(path, "trigger")) == 9
+    assert insert_trip(path) is not None
+    # Once at head, starting again is a no-op
+    run_sync_schema(path)
+
+
+def test_database_behind_head_is_refused_and_left_alone(tmp_path):
+    path = tmp_path / "old.db"
+    run_sync_schema(path)
+    # The schema before any migration, as the app used to create it
+    alembic(path, "downgrade", "base")
+    tables = objects(path, "table")
+    assert "sync_state" not in tables and not objects(path, "trigger")
+
+    with pytest.raises(SchemaOutOfDate, match="alembic -x db="):
+        run_sync_schema(path)
+    assert objects(path, "table") == tables
+    assert not objects(path, "trigger")
+
+    alembic(path, "upgrade", "head")
+    run_sync_schema(path)
+    assert insert_trip(path) is not None
+
+
+def pragmas(connection):
+    return (
+        connection.execute("PRAGMA auto_vacuum").fetchone()[0],
+        connection.execute("PRAGMA journal_mode").fetchone()[0],
+    )
+
+
+def test_new_database_is_incremental_vacuum_and_wal(db):
+    # The file the server created at startup
+    assert pragmas(db) == (2, "wal")
+
+
+def test_new_shard_is_incremental_vacuum_and_wal(loop, tmp_path, monkeypatch):
+    monkeypatch.setattr(shards, "SHARD_DIR", str(tmp_path))
+    for name in ("_engines", "_engine_agencies", "_sessionmakers"):
+        monkeypatch.setattr(shards, name, {})
+    engine = shards._engine_for(7)
+
+    async def check():
+        try:
+            async with engine.connect() as connection:
+                return (
+                    (await connection.execute(text("PRAGMA auto_vacuum"))).scalar(),
+                    (await connection.execute(text("PRAGMA journal_mode"))).scalar(),
+                )
+        finally:
+            await engine.dispose()
+
+    assert loop.run_until_complete(check()) == (2, "wal")
+    with sqlite3.connect(shards.shard_path(7)) as connection:
+        assert pragmas(connection) == (2, "wal")
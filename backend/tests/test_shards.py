@@ -0,0 +1,114 @@
+# backend/tests/test_shards.py
+"""Per-agency shards (shards.py) and moving data into them (utils/shard_split.py)"""
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event, select
+
+import shards
+from api.models.models import Base, Itinerary, User
+from utils import shard_split
+
+
+def shard_id(agency_id, n):
+    return agency_id << shards.SHARD_ID_BITS | n
+
+
+@pytest.fixture
+def sharded(loop, client, tmp_path, monkeypatch):
+    """Shards in a directory of their own, with ids assigned as SHARDING=1 does"""
+    monkeypatch.setattr(shards, "SHARD_DIR", str(tmp_path))
+    for name in ("_engines", "_engine_agencies", "_sessionmakers", "_creating"):
+        monkeypatch.setattr(shards, name, {})
+    event.listen(Base, "before_insert", shards.assign_shard_id, propagate=True)
+    yield
+    event.remove(Base, "before_insert", shards.assign_shard_id)
+    loop.run_until_complete(shards.stop_shards(None, None))
+
+
+def add_user(loop, agency_id, name):
+    async def add():
+        async with shards.sessions_for(agency_id)() as session:
+            user = User(name=name, email=f"{name}@example.com", travel_agency_id=agency_id)
+            session.add(user)
+            await session.commit()
+            return user.id
+    return loop.run_until_complete(add())
+
+
+def user_ids(loop, agency_id):
+    async def read():
+        async with shards.sessions_for(agency_id)() as session:
+            return (await session.execute(select(User.id).order_by(User.id))).scalars().all()
+    return loop.run_until_complete(read())
+
+
+def test_ids_carry_their_agency(loop, sharded):
+    assert loop.run_until_complete(shards.ensure_shard(1))
+    assert loop.run_until_complete(shards.ensure_shard(2))
+    assert not loop.run_until_complete(shards.ensure_shard(999))
+    assert shards.shard_ids() == [1, 2]
+
+    first, second = add_user(loop, 1, "ann"), add_user(loop, 1, "al")
+    other = add_user(loop, 2, "bea")
+    assert (first, second, other) == (shard_id(1, 1), shard_id(1, 2), shard_id(2, 1))
+    assert [shards.shard_of(row_id) for row_id in (first, second, other)] == [1, 1, 2]
+    # Each row is in its own agency's file only
+    assert user_ids(loop, 1) == [first, second]
+    assert user_ids(loop, 2) == [other]
+
+
+def request(args=None, body=None, method="GET"):
+    return SimpleNamespace(args=args or {}, json=body, method=method)
+
+
+def test_requests_are_routed_by_the_ids_they_name():
+    trip_id = shard_id(3, 42)
+    assert shards.agency_for(request(), {"trip_id": trip_id}) == 3
+    assert shards.agency_for(request(), {"agency_id": 5}) == 5
+    assert shards.agency_for(request(args={"agency_id": "4"}), {}) == 4
+    body = {"itinerary_id": shard_id(6, 1)}
+    assert shards.agency_for(request(body=body, method="POST"), {}) == 6
+    assert shards.agency_for(request(body={"travel_agency_id": 2}, method="PUT"), {}) == 2
+    # Nothing names an agency: the catalog answers
+    assert shards.agency_for(request(body=body), {}) is None
+    assert shards.agency_for(request(), {"id": 1}) is None
+
+
+def test_route_picks_the_agencys_shard(loop, sharded):
+    assert loop.run_until_complete(
+        shards.route(request(), {"user_id": shard_id(2, 1)})
+    ) is shards.sessions_for(2)
+    assert loop.run_until_complete(shards.route(request(), {"agency_id": 999})) is None
+    assert loop.run_until_complete(shards.route(request(), {})) is None
+
+
+def test_split_rewrites_ids_into_the_agencys_shard(loop, sharded, db):
+    users = db.execute("SELECT id FROM users WHERE travel_agency_id = 2 ORDER BY id").fetchall()
+    itineraries = db.execute(
+        "SELECT i.id, i.user_id FROM itineraries i JOIN users u ON u.id = i.user_id "
+        "WHERE u.travel_agency_id = 2 ORDER BY i.id"
+    ).fetchall()
+    assert users and itineraries
+
+    loop.run_until_complete(shards.create_shard(2))
+    loop.run_until_complete(shards.drop_engine(2))
+    shard_split.copy_agency(2)
+
+    assert user_ids(loop, 2) == [shard_id(2, row["id"]) for row in users]
+
+    async def read_itineraries():
+        async with shards.sessions_for(2)() as session:
+            rows = await session.execute(
+                select(Itinerary.id, Itinerary.user_id).order_by(Itinerary.id)
+            )
+            return [tuple(row) for row in rows]
+
+    assert loop.run_until_complete(read_itineraries()) == [
+        (shard_id(2, row["id"]), shard_id(2, row["user_id"])) for row in itineraries
+    ]
+    # New rows continue after every id the main database had handed out
+    highest = db.execute("SELECT max(id) FROM users").fetchone()[0]
+    assert add_user(loop, 2, "new") == shard_id(2, highest + 1)
+    # The main database is left as it was
+    assert db.execute("SELECT count(*) FROM users WHERE travel_agency_id = 2").fetchone()[0] == len(users)
@@ -0,0 +1,98 @@
+# backend/tests/test_sync.py
+"""The sync triggers (api/models/models.py) and GET /api/sync"""
+from api.models.models import SYNC_TABLES, sync_trigger_statements
+
+TRIP = {
+    "itinerary_id": 1, "date_start": "2024-07-01", "date_end": "2024-07-02",
+    "mode": "train", "location_start": "Lyon", "location_end": "Turin"
+}
+
+
+def current_version(db):
+    return db.execute("SELECT version FROM sync_state WHERE id = 1").fetchone()[0]
+
+
+def create_trip(client):
+    _, response = client.post("/api/trips/", json=TRIP)
+    assert response.status == 201
+    return response.json["data"]["id"]
+
+
+def changes_since(client, since):
+    _, response = client.get(f"/api/sync/?since={since}")
+    assert response.status == 200
+    return response.json
+
+
+def test_insert_gets_the_next_version(client, db):
+    before = current_version(db)
+    trip_id = create_trip(client)
+
+    version = db.execute("SELECT version FROM trips WHERE id = ?", (trip_id,)).fetchone()[0]
+    assert version == before + 1 == current_version(db)
+    page = changes_since(client, before)
+    assert [(entry["table"], entry["op"], entry["id"]) for entry in page["data"]] == [
+        ("trips", "upsert", trip_id)
+    ]
+    assert page["_meta"]["cursor"] == version
+
+
+def test_update_gets_a_new_version_whatever_the_body_says(client, db):
+    trip_id = create_trip(client)
+    before = current_version(db)
+
+    _, response = client.put(
+        f"/api/trips/{trip_id}", json={"transporter": "Trenitalia", "version": 1, "id": 999}
+    )
+    assert response.status == 200
+
+    row = db.execute("SELECT id, version, transporter FROM trips WHERE id = ?", (trip_id,)).fetchone()
+    assert tuple(row) == (trip_id, before + 1, "Trenitalia")
+    assert [entry["id"] for entry in changes_since(client, before)["data"]] == [trip_id]
+
+
+def test_untouched_rows_keep_their_version(client, db):
+    trip_id = create_trip(client)
+    versions = dict(db.execute("SELECT id, version FROM trips WHERE id != ?", (trip_id,)).fetchall())
+
+    client.put(f"/api/trips/{trip_id}", json={"transporter": "SNCF"})
+
+    assert dict(db.execute("SELECT id, version FROM trips WHERE id != ?", (trip_id,)).fetchall()) == versions
+
+
+def test_delete_leaves_a_tombstone(client, db):
+    trip_id = create_trip(client)
+    before = current_version(db)
+
+    _, response = client.delete(f"/api/trips/{trip_id}")
+    assert response.status in (200, 204)
+
+    tombstone = db.execute(
+        "SELECT version, table_name FROM sync_tombstones WHERE row_id = ? AND table_name = 'trips'",
+        (trip_id,)
+    ).fetchone()
+    assert tuple(tombstone) == (before + 1, "trips")
+    entries = changes_since(client, before)["data"]
+    assert [(entry["op"], entry["id"]) for entry in entries] == [("delete", trip_id)]
+
+
+def test_versions_are_never_reused(client, db):
+    before = current_version(db)
+    trip_id = create_trip(client)
+    client.put(f"/api/trips/{trip_id}", json={"transporter": "SNCF"})
+    client.delete(f"/api/trips/{trip_id}")
+
+    page = changes_since(client, before)
+    versions = [entry["version"] for entry in page["data"]]
+    assert versions == sorted(set(versions))
+    assert page["_meta"]["cursor"] == current_version(db) == before + 3
+
+
+def test_trigger_statements_can_run_again(db):
+    triggers = db.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger'").fetchone()[0]
+    for table in SYNC_TABLES:
+        for statement in sync_trigger_statements(table):
+            db.execute(statement)
+    assert db.execute(
+        "SELECT count(*) FROM sqlite_master WHERE type = 'trigger'"
+    ).fetchone()[0] == triggers
@@ -0,0 +1,125 @@
+# backend/tests/test_timeline.py
+"""GET /api/users/<id>/timeline and its cursor (api/timeline.py)"""
+from datetime import date
+
+import pytest
+
+from api import timeline
+
+TRIP_DAYS = ["2024-03-01", "2024-03-05", "2024-03-05", "2024-04-10", "2024-05-02"]
+LODGING_DAYS = ["2024-03-05", "2024-03-01", "2024-04-01", "2024-05-02"]
+
+
+def created(response):
+    assert response.status == 201, response.json
+    return response.json
+
+
+@pytest.fixture(scope="module")
+def traveler(client):
+    """A new user with two itineraries of trips and lodgings, some on the
+    same day; returns (user id, the expected timeline as (date, type, id))"""
+    _, response = client.post("/api/users/", json={
+        "name": "Tess Timeline", "email": "tess@example.com", "travel_agency_id": 1
+    })
+    user_id = created(response)["id"]
+    itineraries = [
+        created(client.post("/api/itineraries/", json={
+            "tour_name": name, "date_start": "2024-03-01", "date_end": "2024-05-31", "user_id": user_id
+        })[1])["data"]["id"]
+        for name in ("Spring", "Later spring")
+    ]
+    events = []
+    for index, day in enumerate(TRIP_DAYS):
+        trip = created(client.post("/api/trips/", json={
+            "itinerary_id": itineraries[index % 2], "date_start": day, "date_end": day,
+            "mode": "train", "location_start": "Ghent", "location_end": "Bruges"
+        })[1])["data"]
+        events.append((day, "trip", trip["id"]))
+    for index, day in enumerate(LODGING_DAYS):
+        lodging = created(client.post("/api/lodgings/", json={
+            "itinerary_id": itineraries[index % 2], "name": f"Hotel {index}",
+            "date_start": day, "date_end": day, "room_count": 1
+        })[1])["data"]
+        events.append((day, "lodging", lodging["id"]))
+    events.sort(key=lambda event: (event[0], timeline.RANKS[event[1]], event[2]))
+    return user_id, events
+
+
+def page(client, user_id, query=""):
+    _, response = client.get(f"/api/users/{user_id}/timeline?{query}")
+    assert response.status == 200, response.text
+    return response.json
+
+
+def events_of(body):
+    return [(event["date"], event["type"], event["data"]["id"]) for event in body["data"]]
+
+
+def test_cursor_round_trip():
+    event = {"date": "2024-05-01", "type": "lodging", "data": {"id": 7}}
+    cursor = timeline.format_cursor(event)
+    assert cursor == "2024-05-01:lodging:7"
+    assert timeline.parse_cursor(cursor) == (date(2024, 5, 1), timeline.RANKS["lodging"], 7)
+
+
+@pytest.mark.parametrize("cursor", [
+    "2024-05-01", "2024-13-01:trip:1", "2024-05-01:flight:1", "2024-05-01:trip:x", "a:b:c:d"
+])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(timeline.InvalidCursor):
+        timeline.parse_cursor(cursor)
+
+
+def test_one_page_is_in_date_order_trips_first(client, traveler):
+    user_id, expected = traveler
+    body = page(client, user_id)
+    assert events_of(body) == expected
+    assert body["_meta"] == {"count": len(expected), "next_cursor": None}
+    assert body["_links"]["next"] is None
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 100])
+def test_following_cursors_visits_every_event_once(client, traveler, monkeypatch, limit):
+    # Smaller than a page, so pages span several keyset batches per source
+    monkeypatch.setattr(timeline, "TIMELINE_BATCH_ROWS", 2)
+    user_id, expected = traveler
+    seen, query = [], f"limit={limit}"
+    # Bounded, so a cursor that doesn't move on fails instead of hanging
+    for _ in range(len(expected) + 1):
+        body = page(client, user_id, query)
+        assert body["_meta"]["count"] == len(body["data"]) <= limit
+        seen += events_of(body)
+        cursor = body["_meta"]["next_cursor"]
+        if cursor is None:
+            break
+        assert cursor == "{}:{}:{}".format(*seen[-1])
+        assert body["_links"]["next"] == f"/api/users/{user_id}/timeline?limit={limit}&cursor={cursor}"
+        query = f"limit={limit}&cursor={cursor}"
+    else:
+        pytest.fail(f"Still paging after {len(expected) + 1} pages")
+    assert seen == expected
+
+
+def test_cursor_between_same_day_events(client, traveler):
+    user_id, expected = traveler
+    # The first 2024-03-05 trip: the rest of that day follows it
+    index = next(i for i, event in enumerate(expected) if event[:2] == ("2024-03-05", "trip"))
+    body = page(client, user_id, "cursor={}:{}:{}".format(*expected[index]))
+    assert events_of(body) == expected[index + 1:]
+
+
+def test_date_window(client, traveler):
+    user_id, expected = traveler
+    body = page(client, user_id, "from=2024-03-05&to=2024-04-10")
+    assert events_of(body) == [event for event in expected if "2024-03-05" <= event[0] <= "2024-04-10"]
+
+
+def test_bad_requests(client, traveler):
+    user_id, _ = traveler
+    _, response = client.get(f"/api/users/{user_id}/timeline?cursor=yesterday")
+    assert response.status == 400
+    _, response = client.get(f"/api/users/{user_id}/timeline?from=05/01/2024")
+    assert response.status == 400
+    _, response = client.get("/api/users/999999/timeline")
+    assert response.status == 404
@@ -0,0 +1,149 @@
+# backend/tests/test_write_coalescer.py
+"""Group-commit write coalescing (write_coalescer.py), on the test database"""
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import text
+
+from write_coalescer import WriteCoalescer
+
+TABLE = "coalesced_rows"
+
+
+@pytest.fixture
+def rows(db):
+    """A scratch table; returns a function listing its values"""
+    db.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    db.execute(
+        f"CREATE TABLE {TABLE} (id INTEGER PRIMARY KEY, value TEXT, "
+        "agency_id INTEGER REFERENCES travel_agencies (id))"
+    )
+    db.commit()
+    yield lambda: sorted(row[0] for row in db.execute(f"SELECT value FROM {TABLE}"))
+    db.execute(f"DROP TABLE {TABLE}")
+    db.commit()
+
+
+@pytest.fixture
+def run(loop):
+    """Run ``scenario(coalescer)`` against a started WriteCoalescer"""
+    def run(scenario, **options):
+        async def main():
+            coalescer = WriteCoalescer(**options)
+            await coalescer.start()
+            try:
+                return await scenario(coalescer)
+            finally:
+                await coalescer.stop()
+        return loop.run_until_complete(main())
+    return run
+
+
+def insert(value, agency_id=None):
+    async def operation(session):
+        await session.execute(
+            text(f"INSERT INTO {TABLE} (value, agency_id) VALUES (:value, :agency_id)"),
+            {"value": value, "agency_id": agency_id}
+        )
+        return value
+    return operation
+
+
+def failing(value):
+    async def operation(session):
+        await insert(value)(session)
+        raise ValueError(f"{value} failed")
+    return operation
+
+
+def submit_all(coalescer, operations):
+    return asyncio.gather(
+        *(coalescer.submit(operation) for operation in operations), return_exceptions=True
+    )
+
+
+def test_concurrent_writes_share_one_commit(run, rows):
+    async def scenario(coalescer):
+        results = await submit_all(coalescer, [insert(f"row {n}") for n in range(5)])
+        return results, dict(coalescer.stats)
+
+    results, stats = run(scenario, max_batch=10, max_delay_ms=50)
+    assert results == [f"row {n}" for n in range(5)]
+    assert stats == {"batches": 1, "writes": 5, "errors": 0}
+    assert rows() == [f"row {n}" for n in range(5)]
+
+
+def test_failing_write_fails_only_its_own_request(run, rows):
+    async def scenario(coalescer):
+        results = await submit_all(coalescer, [insert("a"), failing("b"), insert("c")])
+        return results, dict(coalescer.stats)
+
+    (a, b, c), stats = run(scenario, max_batch=10, max_delay_ms=50)
+    assert (a, c) == ("a", "c")
+    assert isinstance(b, ValueError)
+    assert stats == {"batches": 1, "writes": 2, "errors": 1}
+    # b's own insert was rolled back with its SAVEPOINT
+    assert rows() == ["a", "c"]
+
+
+def test_failed_commit_fails_the_whole_batch(run, rows):
+    async def deferred_violation(session):
+        # Checked at COMMIT rather than in the write's SAVEPOINT
+        await session.execute(text("PRAGMA defer_foreign_keys = ON"))
+        return await insert("orphan", agency_id=999999)(session)
+
+    async def scenario(coalescer):
+        return await submit_all(coalescer, [insert("a"), deferred_violation, insert("c")])
+
+    results = run(scenario, max_batch=10, max_delay_ms=50)
+    assert all(isinstance(result, Exception) for result in results)
+    assert "FOREIGN KEY" in str(results[0])
+    assert rows() == []
+
+
+def test_full_batch_commits_without_waiting_for_the_delay(run, rows):
+    async def scenario(coalescer):
+        started = time.monotonic()
+        await submit_all(coalescer, [insert(f"row {n}") for n in range(3)])
+        elapsed = time.monotonic() - started
+        # One more than a batch holds: the last write goes in a second batch
+        await submit_all(coalescer, [insert(f"more {n}") for n in range(4)])
+        return elapsed, dict(coalescer.stats)
+
+    elapsed, stats = run(scenario, max_batch=3, max_delay_ms=200)
+    assert elapsed < 0.2
+    assert stats["batches"] == 3 and stats["writes"] == 7
+    assert len(rows()) == 7
+
+
+def test_lone_write_commits_once_the_delay_expires(run, rows):
+    async def scenario(coalescer):
+        started = time.monotonic()
+        await coalescer.submit(insert("alone"))
+        return time.monotonic() - started, dict(coalescer.stats)
+
+    elapsed, stats = run(scenario, max_batch=100, max_delay_ms=100)
+    assert 0.09 <= elapsed < 1
+    assert stats["batches"] == 1
+    assert rows() == ["alone"]
+
+
+def test_worker_survives_a_batch_that_fails_outside_its_writes(run, rows):
+    async def scenario(coalescer):
+        session_factory = coalescer._session_factory
+
+        def broken():
+            raise RuntimeError("can't open a session")
+
+        coalescer._session_factory = broken
+        # Bounded: a dead worker would leave these waiting forever
+        failed = await asyncio.wait_for(submit_all(coalescer, [insert("a"), insert("b")]), 5)
+        coalescer._session_factory = session_factory
+        after = await asyncio.wait_for(coalescer.submit(insert("c")), 5)
+        return failed, after, coalescer.running
+
+    failed, after, running = run(scenario, max_batch=10, max_delay_ms=10)
+    assert [str(result) for result in failed] == ["can't open a session"] * 2
+    assert after == "c" and running
+    assert rows() == ["c"]
@@ -0,0 +1,71 @@
+# backend/utils/backfill.py
+"""
+Run a chunked backfill (see backfill.py), or show the saved progress of
+backfills.
+
+Safe to run while the server runs; running workers are told to drop the
+cached data the backfill changed. A stopped backfill resumes where it
+left off when run again with the same definition; --restart starts it
+over, e.g. after changing the definition.
+
+Run from ./backend:
+    python -m utils.backfill run <name> --table trips --set "<column> = <expr>" [--where "<column> IS NULL"]
+    python -m utils.backfill status
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backfill
+
+
+def print_progress(progress):
+    state = "done" if progress["done"] else f"{progress['percent']}%"
+    speed = f", {progress['rows_per_second']} rows/s" if progress["rows_per_second"] else ""
+    print(f"{progress['database']}: {state}, {progress['rows']} rows, "
+          f"{progress['chunks']} chunks, {progress['retries']} retries{speed}")
+
+
+def run(args):
+    try:
+        results = backfill.run_all(
+            args.name, args.table, args.set, args.where, key=args.key,
+            batch_rows=args.batch_rows, sleep_ms=args.sleep_ms, restart=args.restart,
+            on_progress=print_progress
+        )
+    except backfill.BackfillError as e:
+        sys.exit(str(e))
+    except KeyboardInterrupt:
+        sys.exit(f"Stopped; run it again to resume {args.name}")
+    notified = sorted({item for progress in results for item in progress.get("notified", [])})
+    if notified:
+        print("Told running workers to refresh their " + "; ".join(notified))
+
+
+def status():
+    for progress in backfill.status():
+        state = "done" if progress["finished_at"] else f"at id {progress['last_id']}"
+        print(f"{progress['database']}  {progress['name']}  {state}  "
+              f"{progress['rows']} rows  {progress['definition']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run or resume a backfill")
+    run_parser.add_argument("name")
+    run_parser.add_argument("--table", required=True)
+    run_parser.add_argument("--set", required=True, help="SET clause, e.g. \"col = expr\"")
+    run_parser.add_argument("--where", help="only rows matching this are updated")
+    run_parser.add_argument("--key", default="id", help="integer primary key to walk")
+    run_parser.add_argument("--batch-rows", type=int, default=backfill.BACKFILL_BATCH_ROWS)
+    run_parser.add_argument("--sleep-ms", type=float, default=backfill.BACKFILL_SLEEP_MS)
+    run_parser.add_argument("--restart", action="store_true", help="ignore the saved progress")
+    commands.add_parser("status", help="saved progress of every backfill")
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        status()
@@ -0,0 +1,73 @@
+# backend/utils/backup.py
+"""
+Take, list and restore online backups (see backups.py).
+
+Backups can be taken while the server runs. Restore with the server
+stopped: it copies the backup's files over the live ones.
+
+Run from ./backend:
+    python -m utils.backup create
+    python -m utils.backup list
+    python -m utils.backup restore <name>
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backups
+from database import DATABASE_DIR
+
+
+def create():
+    manifest = backups.take_backup()
+    if manifest is None:
+        sys.exit("Another backup is in progress")
+    print(f"Backup {manifest['name']} written in {manifest['ms']} ms")
+    for relative_path, stats in manifest["files"].items():
+        print(f"  {relative_path}: {stats['bytes']} bytes, {stats['restarts']} restarts")
+
+
+def list_all():
+    for manifest in backups.list_backups():
+        size = sum(stats["bytes"] for stats in manifest["files"].values())
+        print(f"{manifest['name']}  {manifest['created_at']}  "
+              f"{len(manifest['files'])} files  {size} bytes")
+
+
+def restore(name):
+    manifest = next((m for m in backups.list_backups() if m["name"] == name), None)
+    if manifest is None:
+        sys.exit(f"No backup named {name}")
+    for relative_path in manifest["files"]:
+        source = backups.connect_readonly(backups.backup_path(name, relative_path))
+        target_path = os.path.join(DATABASE_DIR, relative_path)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        print(f"Restored {relative_path}")
+    extra = set(backups.database_files()) - set(manifest["files"])
+    for relative_path in sorted(extra):
+        print(f"{relative_path} is newer than the backup and was left as it is")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("create", help="back up every database now")
+    commands.add_parser("list", help="list backups, newest first")
+    restore_parser = commands.add_parser("restore", help="copy a backup over the live databases")
+    restore_parser.add_argument("name")
+    args = parser.parse_args()
+    if args.command == "create":
+        create()
+    elif args.command == "list":
+        list_all()
+    else:
+        restore(args.name)
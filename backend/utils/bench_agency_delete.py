@@ -0,0 +1,123 @@
+# backend/utils/bench_agency_delete.py
+"""
+Benchmark agency deletes as the number of child rows grows.
+
+Compares the old ORM-loaded cascade (load every user, itinerary, trip and
+lodging, then delete row by row) with the single DELETE statement that relies
+on ON DELETE CASCADE. Runs against a throwaway database.
+
+Run from ./backend:  python -m utils.bench_agency_delete
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+# Point database.py at a scratch directory before it is imported
+os.environ['DATABASE_DIR'] = tempfile.mkdtemp()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import selectinload
+from database import engine, Base, get_session
+from api.models.models import TravelAgency, User, Itinerary, Trip, Lodging
+
+SIZES = [10, 100, 1000]
+ITINERARIES_PER_USER = 2
+CHILDREN_PER_ITINERARY = 5
+
+
+async def build_agency(users):
+    """Create one agency with ``users`` users and a fixed fan-out below each"""
+    today = date.today()
+    async with get_session() as session:
+        agency = TravelAgency(name="Benchmark Agency")
+        session.add(agency)
+        await session.flush()
+
+        await session.execute(insert(User), [
+            {"name": f"User {i}", "email": f"user{agency.id}-{i}@example.com",
+             "travel_agency_id": agency.id}
+            for i in range(users)
+        ])
+        user_ids = (await session.execute(
+            select(User.id).filter(User.travel_agency_id == agency.id)
+        )).scalars().all()
+
+        await session.execute(insert(Itinerary), [
+            {"tour_name": "Tour", "date_start": today, "date_end": today,
+             "user_id": user_id}
+            for user_id in user_ids
+            for _ in range(ITINERARIES_PER_USER)
+        ])
+        itinerary_ids = (await session.execute(
+            select(Itinerary.id).filter(Itinerary.user_id.in_(user_ids))
+        )).scalars().all()
+
+        await session.execute(insert(Trip), [
+            {"date_start": today, "date_end": today, "location_start": "A",
+             "location_end": "B", "itinerary_id": itinerary_id}
+            for itinerary_id in itinerary_ids
+            for _ in range(CHILDREN_PER_ITINERARY)
+        ])
+        await session.execute(insert(Lodging), [
+            {"date_start": today, "date_end": today, "name": "Hotel",
+             "itinerary_id": itinerary_id}
+            for itinerary_id in itinerary_ids
+            for _ in range(CHILDREN_PER_ITINERARY)
+        ])
+        await session.commit()
+        return agency.id
+
+
+async def delete_orm_loaded(agency_id):
+    async with get_session() as session:
+        result = await session.execute(
+            select(TravelAgency)
+            .options(
+                selectinload(TravelAgency.users)
+                .selectinload(User.itineraries)
+                .options(
+                    selectinload(Itinerary.trips),
+                    selectinload(Itinerary.lodgings)
+                )
+            )
+            .filter(TravelAgency.id == agency_id)
+        )
+        await session.delete(result.scalar_one())
+        await session.commit()
+
+
+async def delete_cascade(agency_id):
+    async with get_session() as session:
+        await session.execute(
+            delete(TravelAgency).filter(TravelAgency.id == agency_id)
+        )
+        await session.commit()
+
+
+async def main():
+    engine.echo = False
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    print(f"{'users':>6} {'rows':>8} {'orm (ms)':>10} {'cascade (ms)':>13}")
+    for users in SIZES:
+        rows = users * (1 + ITINERARIES_PER_USER * (1 + 2 * CHILDREN_PER_ITINERARY))
+        timings = []
+        for strategy in (delete_orm_loaded, delete_cascade):
+            agency_id = await build_agency(users)
+            start = time.perf_counter()
+            await strategy(agency_id)
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"{users:>6} {rows:>8} {timings[0]:>10.1f} {timings[1]:>13.1f}")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    asyncio.run(main())
@@ -1,9 +1,18 @@
 import asyncio
 import os
-from database import engine, Base
+import sys
+import backups
+from database import engine, Base, DATABASE_PATH
 from seed import seed_database
 
 async def reset_database():
+    # Keep a copy of what is about to be dropped (see utils/backup.py)
+    if os.path.exists(DATABASE_PATH):
+        manifest = backups.take_backup()
+        if manifest is None:
+            sys.exit("Another backup is in progress; try again once it's done")
+        print(f"Backed up the old data as {manifest['name']}")
+
     # Drop all tables
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
@@ -0,0 +1,126 @@
+# backend/utils/shard_split.py
+"""
+Move a single-database install into per-agency shards (see shards.py).
+
+Each agency's users, itineraries, trips and lodgings are copied into
+SHARD_DIR/agency_<id>.db. Ids and foreign keys are rewritten to carry the
+agency (agency_id << 32 | old id), so the old id is still the low bits.
+Agencies that already have a shard are skipped. The main database is left
+as it was unless --delete-source is given.
+
+Run from ./backend with the server stopped, then start it with SHARDING=1:
+    python -m utils.shard_split [--delete-source]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shards
+from database import DATABASE_PATH, get_engine, init_db
+
+AGENCY_USERS = "SELECT id FROM source.users WHERE travel_agency_id = :agency"
+AGENCY_ITINERARIES = f"SELECT id FROM source.itineraries WHERE user_id IN ({AGENCY_USERS})"
+
+# (table, which of its rows belong to the agency, columns holding sharded ids)
+COPIES = [
+    ("users", "travel_agency_id = :agency", ("id",)),
+    ("itineraries", f"user_id IN ({AGENCY_USERS})", ("id", "user_id")),
+    ("trips", f"itinerary_id IN ({AGENCY_ITINERARIES})", ("id", "itinerary_id")),
+    ("lodgings", f"itinerary_id IN ({AGENCY_ITINERARIES})", ("id", "itinerary_id")),
+]
+
+
+def copy_agency(agency_id):
+    """Copy one agency's rows into its (new, empty) shard; returns row counts"""
+    counts = {}
+    shard = sqlite3.connect(shards.shard_path(agency_id))
+    try:
+        shard.execute("PRAGMA foreign_keys = ON")
+        shard.execute("ATTACH DATABASE ? AS source", (DATABASE_PATH,))
+        with shard:
+            for table, belongs, remapped in COPIES:
+                # The sync triggers give every copied row a fresh version
+                columns = [
+                    row[1] for row in shard.execute(f"PRAGMA source.table_info({table})")
+                    if row[1] != "version"
+                ]
+                values = [
+                    f"(:agency << {shards.SHARD_ID_BITS}) | {column}"
+                    if column in remapped else column
+                    for column in columns
+                ]
+                cursor = shard.execute(
+                    f"INSERT INTO main.{table} ({', '.join(columns)}) "
+                    f"SELECT {', '.join(values)} FROM source.{table} WHERE {belongs}",
+                    {"agency": agency_id}
+                )
+                counts[table] = cursor.rowcount
+                # New rows continue after every old id, so low bits never repeat
+                shard.execute(
+                    f"UPDATE shard_sequences SET value = "
+                    f"(SELECT coalesce(max(id), 0) FROM source.{table}) WHERE name = ?",
+                    (table,)
+                )
+    finally:
+        shard.close()
+    return counts
+
+
+def delete_source(agency_ids):
+    """Remove the moved users from the main database; their rows cascade"""
+    main = sqlite3.connect(DATABASE_PATH)
+    try:
+        main.execute("PRAGMA foreign_keys = ON")
+        with main:
+            main.executemany(
+                "DELETE FROM users WHERE travel_agency_id = ?",
+                [(agency_id,) for agency_id in agency_ids]
+            )
+        main.execute("VACUUM")
+    finally:
+        main.close()
+
+
+async def split(delete):
+    await init_db()
+    main = sqlite3.connect(DATABASE_PATH)
+    try:
+        agency_ids = [row[0] for row in main.execute("SELECT id FROM travel_agencies ORDER BY id")]
+        agencyless = main.execute(
+            "SELECT count(*) FROM users WHERE travel_agency_id IS NULL"
+        ).fetchone()[0]
+    finally:
+        main.close()
+
+    moved = []
+    for agency_id in agency_ids:
+        if os.path.exists(shards.shard_path(agency_id)):
+            print(f"Agency {agency_id}: already has a shard, skipped")
+            continue
+        await shards.create_shard(agency_id)
+        # Close the shard's engine before writing the file with sqlite3
+        await shards.drop_engine(agency_id)
+        counts = copy_agency(agency_id)
+        moved.append(agency_id)
+        print(f"Agency {agency_id}: " + ", ".join(f"{n} {table}" for table, n in counts.items()))
+
+    if delete and moved:
+        delete_source(moved)
+        print(f"Deleted the moved rows of {len(moved)} agencies from {DATABASE_PATH}")
+    if agencyless:
+        print(f"{agencyless} user(s) have no agency; sharded mode can't serve them")
+    await get_engine().dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--delete-source", action="store_true",
+        help="delete the copied rows from the main database afterwards"
+    )
+    args = parser.parse_args()
+    asyncio.run(split(args.delete_source))
@@ -0,0 +1,273 @@
+# backend/warmup.py
+"""
+Worker warm-up, so the first requests after a deploy don't all pay for
+cold caches, and the readiness check that waits for it (GET /ready).
+
+Runs in before_server_start, after the schema check:
+
+1. Connections and statements: the ORM mappers are configured, the
+   engine's pool is filled, and the hot route queries (list pages and
+   counts, detail lookups, agency and itinerary joins) are run once
+   against an id that doesn't exist, so SQLAlchemy's compiled cache
+   already holds them.
+2. Indexes: every index of the hot tables is read end to end, on a
+   thread, through a read-only connection (main database and shards), so
+   their pages are in the OS page cache. Stops after WARMUP_TOUCH_SECONDS.
+3. Entity cache: at shutdown the ids of the most recently used users and
+   agencies are written to DATABASE_DIR/warmup_snapshot.json. Warm-up
+   reads those rows again and puts them back in the cache. Only ids are
+   kept on disk, so nothing stale is restored. GET responses need nothing
+   here: the shared cache (shared_cache.py) already lives on disk.
+
+/ready answers 503 until every after_server_start listener has finished
+too (route graph, suggestions, ...), and again once shutdown begins.
+Disable warm-up with WARMUP=0; /ready then only waits for startup.
+"""
+import asyncio
+import json as jsonlib
+import logging
+import os
+import sqlite3
+import time
+from contextlib import AsyncExitStack
+from itertools import islice
+
+from sanic import json
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import configure_mappers, joinedload
+
+import shards
+from database import DATABASE_DIR, DATABASE_PATH, get_engine, get_session
+from api.entity_cache import ENTITY_CACHE, entity_cache
+from api.models.models import Itinerary, Lodging, TravelAgency, Trip, User
+
+logger = logging.getLogger(__name__)
+
+WARMUP = os.getenv('WARMUP', '1') == '1'
+WARMUP_SNAPSHOT_PATH = os.path.join(DATABASE_DIR, 'warmup_snapshot.json')
+# Most recently used users and agencies saved at shutdown
+WARMUP_SNAPSHOT_ENTRIES = int(os.getenv('WARMUP_SNAPSHOT_ENTRIES', 1000))
+WARMUP_TOUCH_SECONDS = float(os.getenv('WARMUP_TOUCH_SECONDS', 10))
+
+HOT_TABLES = ("travel_agencies", "users", "itineraries", "trips", "lodgings")
+# Rows per IN query when reloading cached entities
+RELOAD_CHUNK = 500
+
+ready = False
+stats = {"ms": None, "steps": {}, "statements": 0, "indexes": 0, "entities": 0}
+
+
+def statements():
+    """The shapes of the hot route queries, with placeholder values"""
+    from api.routes import itineraries, lodgings, trips
+
+    shapes = []
+    for model, apply_filters in (
+        (Trip, trips.apply_filters),
+        (Lodging, lodgings.apply_filters),
+        (Itinerary, itineraries.apply_filters),
+    ):
+        shapes += [
+            apply_filters(select(model), {}).offset(0).limit(1),
+            apply_filters(select(func.count(model.id)), {}),
+            select(model).filter(model.id == 0),
+            select(model).filter(model.id.in_([0])),
+        ]
+    return shapes + [
+        select(TravelAgency).order_by(TravelAgency.name),
+        select(TravelAgency, User)
+        .outerjoin(User, User.travel_agency_id == TravelAgency.id)
+        .filter(TravelAgency.id == 0)
+        .order_by(User.name),
+        select(Itinerary)
+        .options(joinedload(Itinerary.trips), joinedload(Itinerary.lodgings))
+        .filter(Itinerary.user_id == 0)
+        .order_by(Itinerary.date_start),
+        select(User, Itinerary)
+        .outerjoin(Itinerary, Itinerary.user_id == User.id)
+        .options(joinedload(Itinerary.trips), joinedload(Itinerary.lodgings))
+        .filter(User.id == 0)
+        .order_by(Itinerary.date_start),
+        select(Itinerary)
+        .options(joinedload(Itinerary.trips), joinedload(Itinerary.lodgings))
+        .filter(Itinerary.id == 0),
+    ]
+
+
+async def warm_connections():
+    configure_mappers()
+    engine = get_engine()
+    # Check out a pool's worth at once, so each is a separate connection
+    async with AsyncExitStack() as stack:
+        for _ in range(getattr(engine.pool, "size", lambda: 1)()):
+            connection = await stack.enter_async_context(engine.connect())
+            await connection.execute(text("SELECT 1"))
+    shapes = statements()
+    async with get_session() as session:
+        for statement in shapes:
+            (await session.execute(statement)).unique().all()
+    stats["statements"] = len(shapes)
+
+
+def touch_indexes(paths, deadline):
+    """Read every index of HOT_TABLES in each database; blocking"""
+    touched = 0
+    for path in paths:
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            for table in HOT_TABLES:
+                for row in connection.execute(f'PRAGMA index_list("{table}")').fetchall():
+                    if time.monotonic() > deadline:
+                        logger.info(f"Warm-up stopped touching indexes after {touched}")
+                        return touched
+                    # A full scan of the index, not the table
+                    connection.execute(
+                        f'SELECT count(*) FROM "{table}" INDEXED BY "{row[1]}"'
+                    ).fetchone()
+                    touched += 1
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Couldn't touch the indexes of {path}: {e}")
+        finally:
+            connection.close()
+    return touched
+
+
+async def warm_indexes():
+    paths = [DATABASE_PATH]
+    if shards.SHARDING:
+        paths += [shards.shard_path(agency_id) for agency_id in shards.shard_ids()]
+    deadline = time.monotonic() + WARMUP_TOUCH_SECONDS
+    stats["indexes"] = await asyncio.get_running_loop().run_in_executor(
+        None, touch_indexes, paths, deadline
+    )
+
+
+def _chunks(ids):
+    ids = iter(ids)
+    while chunk := list(islice(ids, RELOAD_CHUNK)):
+        yield chunk
+
+
+async def _read_users(user_ids):
+    if shards.SHARDING:
+        return list((await shards.get_by_ids(User, user_ids)).values())
+    users = []
+    async with get_session() as session:
+        for chunk in _chunks(user_ids):
+            result = await session.execute(select(User).filter(User.id.in_(chunk)))
+            users += result.scalars().all()
+    return users
+
+
+async def _read_members(agency_ids):
+    """{agency id: its users in name order}"""
+    query = select(User).order_by(User.name)
+    members = {agency_id: [] for agency_id in agency_ids}
+    if shards.SHARDING:
+        known = set(shards.shard_ids())
+        for agency_id in agency_ids:
+            if agency_id in known:
+                async with shards.sessions_for(agency_id)() as session:
+                    result = await session.execute(
+                        query.filter(User.travel_agency_id == agency_id)
+                    )
+                    members[agency_id] = result.scalars().all()
+        return members
+    async with get_session() as session:
+        for chunk in _chunks(agency_ids):
+            result = await session.execute(query.filter(User.travel_agency_id.in_(chunk)))
+            for user in result.scalars():
+                members[user.travel_agency_id].append(user)
+    return members
+
+
+async def restore_entities():
+    """Reload the users and agencies cached when the last worker stopped"""
+    if not ENTITY_CACHE or not os.path.exists(WARMUP_SNAPSHOT_PATH):
+        return
+    with open(WARMUP_SNAPSHOT_PATH) as f:
+        snapshot = jsonlib.load(f)
+    version = entity_cache.version
+    # Catalog rows; with sharding the agencies are in the main database
+    async with get_session() as session:
+        agencies = []
+        for chunk in _chunks(snapshot.get("agencies", [])):
+            result = await session.execute(
+                select(TravelAgency).filter(TravelAgency.id.in_(chunk))
+            )
+            agencies += result.scalars().all()
+    members = await _read_members([agency.id for agency in agencies])
+    for agency in agencies:
+        entity_cache.store_agency_users(
+            agency.to_dict(), [user.to_dict() for user in members[agency.id]], version
+        )
+    users = await _read_users(snapshot.get("users", []))
+    for user in users:
+        entity_cache.store_user(user.to_dict(), version)
+    stats["entities"] = len(agencies) + len(users)
+
+
+def save_snapshot():
+    """Write the ids of the hottest cached users and agencies for the next start"""
+    snapshot = {
+        # LRU order: the most recently used are last
+        "users": list(entity_cache.users.entries)[-WARMUP_SNAPSHOT_ENTRIES:],
+        "agencies": list(entity_cache.members.entries)[-WARMUP_SNAPSHOT_ENTRIES:],
+    }
+    if not snapshot["users"] and not snapshot["agencies"]:
+        return
+    partial_path = f"{WARMUP_SNAPSHOT_PATH}.{os.getpid()}"
+    with open(partial_path, "w") as f:
+        jsonlib.dump(snapshot, f)
+    os.replace(partial_path, WARMUP_SNAPSHOT_PATH)
+
+
+STEPS = (
+    ("connections", warm_connections),
+    ("indexes", warm_indexes),
+    ("entities", restore_entities),
+)
+
+
+async def warm_up(app, loop):
+    if not WARMUP:
+        return
+    started = time.perf_counter()
+    for name, step in STEPS:
+        step_started = time.perf_counter()
+        try:
+            await step()
+        except Exception as e:
+            # A cold cache is slower, not broken; carry on
+            logger.warning(f"Warm-up step {name} failed: {e}")
+        stats["steps"][name] = round((time.perf_counter() - step_started) * 1000, 3)
+    stats["ms"] = round((time.perf_counter() - started) * 1000, 3)
+    logger.info(f"Warm-up done in {stats['ms']} ms: {stats}")
+
+
+async def mark_ready(app, loop):
+    global ready
+    ready = True
+
+
+async def save_on_stop(app, loop):
+    global ready
+    ready = False
+    if WARMUP and ENTITY_CACHE:
+        try:
+            save_snapshot()
+        except OSError as e:
+            logger.warning(f"Couldn't save the warm-up snapshot: {e}")
+
+
+def summary():
+    return {"ready": ready, **stats}
+
+
+def install(app):
+    """Register GET /ready for load balancers and orchestrators"""
+    @app.get("/ready")
+    async def readiness(request):
+        if not ready:
+            return json({"ready": False}, status=503, headers={"Retry-After": "1"})
+        return json({"ready": True, "warmup_ms": stats["ms"]})
@@ -0,0 +1,240 @@
+# backend/write_coalescer.py
+"""
+Group-commit write coalescing.
+
+Single-row inserts and updates submitted here are queued and committed in
+batches: everything that arrives within WRITE_COALESCE_DELAY_MS (or until
+WRITE_COALESCE_MAX_BATCH rows are pending) shares one transaction, so SQLite
+pays one journal sync per batch instead of one per row. Each write runs in its
+own SAVEPOINT, so a failing row only fails its own request.
+
+Batches go through a dedicated writer engine that opens every transaction with
+BEGIN IMMEDIATE, so SAVEPOINTs behave under pysqlite/aiosqlite and the batch
+takes the write lock up front instead of failing halfway through.
+
+Coalescing is opt-in via WRITE_COALESCING=1. When it is off, the helpers
+below fall back to a plain session-per-write. It is also off in sharded mode
+(SHARDING=1), where each agency's writes already go to their own database.
+"""
+import asyncio
+import logging
+import os
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+import query_log
+import shards
+from database import (
+    DATABASE_URL, enable_foreign_keys, enable_wal, get_engine, get_session,
+    prefer_incremental_vacuum
+)
+
+logger = logging.getLogger(__name__)
+
+WRITE_COALESCING = os.getenv('WRITE_COALESCING', '0') == '1'
+WRITE_COALESCE_MAX_BATCH = int(os.getenv('WRITE_COALESCE_MAX_BATCH', 64))
+WRITE_COALESCE_DELAY_MS = float(os.getenv('WRITE_COALESCE_DELAY_MS', 2))
+
+
+def create_writer_engine():
+    """Create an engine whose transactions SQLAlchemy (not pysqlite) begins."""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    writer_engine = create_async_engine(
+        DATABASE_URL,
+        echo=get_engine().echo,
+        future=True
+    )
+
+    @event.listens_for(writer_engine.sync_engine, "connect")
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        enable_foreign_keys(dbapi_connection, connection_record)
+        prefer_incremental_vacuum(dbapi_connection, connection_record)
+        enable_wal(dbapi_connection, connection_record)
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(writer_engine.sync_engine, "begin")
+    def begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    query_log.attach(writer_engine.sync_engine)
+    return writer_engine
+
+
+class WriteCoalescer:
+    """Batch queued write operations into shared transactions."""
+
+    def __init__(self, max_batch=WRITE_COALESCE_MAX_BATCH,
+                 max_delay_ms=WRITE_COALESCE_DELAY_MS):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self._queue = None
+        self._worker = None
+        self._engine = None
+        self._session_factory = None
+        self.stats = {"batches": 0, "writes": 0, "errors": 0}
+
+    @property
+    def running(self):
+        return self._worker is not None and not self._worker.done()
+
+    async def start(self):
+        if self.running:
+            return
+        from sqlalchemy.ext.asyncio import AsyncSession
+
+        self._engine = create_writer_engine()
+        self._session_factory = sessionmaker(
+            self._engine,
+            class_=AsyncSession,
+            expire_on_commit=False
+        )
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+        logger.info(
+            f"Write coalescer started (max_batch={self.max_batch}, "
+            f"delay={self.max_delay * 1000:.1f}ms)"
+        )
+
+    async def stop(self):
+        if not self.running:
+            return
+        # Let queued writes finish before shutting down
+        await self._queue.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        await self._engine.dispose()
+
+    async def submit(self, operation):
+        """
+        Queue ``operation`` and wait for its batch to commit.
+
+        ``operation`` is an async callable taking the batch session. Its return
+        value (or exception) is delivered to the caller once the batch is done.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((operation, future))
+        return await future
+
+    async def _collect(self):
+        """Wait for one write, then gather more until the batch is full or the delay expires."""
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                await self._commit_batch(batch)
+            except Exception as e:
+                # Opening, rolling back or closing the session failed. Fail
+                # this batch's writes, but keep serving the ones after it.
+                logger.error(f"Write batch failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _commit_batch(self, batch):
+        results = []
+        async with self._session_factory() as session:
+            try:
+                for operation, future in batch:
+                    try:
+                        async with session.begin_nested():
+                            result = await operation(session)
+                        results.append((future, result))
+                    except Exception as e:
+                        self.stats["errors"] += 1
+                        if not future.done():
+                            future.set_exception(e)
+                await session.commit()
+            except Exception as e:
+                # The shared commit failed, so none of the batch was written
+                logger.error(f"Error committing write batch: {e}")
+                await session.rollback()
+                for future, _ in results:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+        self.stats["batches"] += 1
+        self.stats["writes"] += len(results)
+        for future, result in results:
+            if not future.done():
+                future.set_result(result)
+
+
+coalescer = WriteCoalescer()
+
+
+def enabled():
+    return WRITE_COALESCING and coalescer.running
+
+
+async def insert(instance):
+    """Insert ``instance`` and return it with its primary key populated."""
+    async def operation(session):
+        session.add(instance)
+        await session.flush()
+        return instance
+
+    if enabled():
+        return await coalescer.submit(operation)
+
+    async with get_session() as session:
+        await operation(session)
+        await session.commit()
+        return instance
+
+
+class RowNotFound(LookupError):
+    pass
+
+
+async def update_by_id(model, row_id, values):
+    """Apply ``values`` to the ``model`` row with primary key ``row_id``.
+    Raises RowNotFound if the row is gone (deleted since the caller read it)."""
+    async def operation(session):
+        # Load and modify the row (rather than a bare UPDATE) so the change
+        # goes through the flush and is picked up by changes.py
+        instance = await session.get(model, row_id)
+        if instance is None:
+            raise RowNotFound(f"No {model.__tablename__} row {row_id}")
+        for key, value in values.items():
+            setattr(instance, key, value)
+        await session.flush()
+
+    if enabled():
+        return await coalescer.submit(operation)
+
+    async with get_session() as session:
+        await operation(session)
+        await session.commit()
+
+
+async def start_write_coalescer(app, loop):
+    if WRITE_COALESCING and shards.SHARDING:
+        logger.warning("WRITE_COALESCING is ignored when SHARDING=1")
+    elif WRITE_COALESCING:
+        await coalescer.start()
+
+
+async def stop_write_coalescer(app, loop):
+    await coalescer.stop()